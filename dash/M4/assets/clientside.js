@@ -0,0 +1,86 @@
+// clientside.js
+// theme switching for M4: the day & night templates and table styles are
+// sent once in stores and swapped in the browser; live quote streaming
+
+// typed arrays from m4_wire.py are decoded by assets/wire.js
+const decodeTrace = (trace) => window.m4Wire.decodeTrace(trace);
+
+// live quotes from m4_stream.py: ticks arrive over server-sent events and
+// are kept in per-ticker rings; the interval callbacks below drain them
+const stream = {source: null, rings: {}, rows: {}, rowsChanged: false};
+
+const openStream = (config) => {
+    if (stream.source) {
+        return;
+    }
+    // the browser reconnects by itself, resuming from the last event id
+    stream.source = new EventSource(config.url);
+    stream.source.onmessage = (event) => {
+        const tick = JSON.parse(event.data);
+        const ring = stream.rings[tick.ticker] ||
+            (stream.rings[tick.ticker] = {x: [], y: [], received: 0, sent: 0});
+        ring.x.push(tick.ms);
+        ring.y.push(tick.price);
+        ring.received++;
+        if (ring.x.length > config.ring_size) {
+            ring.x.shift();
+            ring.y.shift();
+        }
+        if (tick.row) {
+            stream.rows[tick.ticker] = tick.row;
+            stream.rowsChanged = true;
+        }
+    };
+};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    clientside: {
+        apply_theme: function(figure, theme, templates) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            const layout = Object.assign({}, figure.layout, {template: templates[theme]});
+            return {data: figure.data.map(decodeTrace), layout: layout};
+        },
+
+        table_theme: function(theme, ids, styles) {
+            return [
+                ids.map(() => styles[theme].style_cell),
+                ids.map(() => styles[theme].style_header)
+            ];
+        },
+
+        page_theme: function(theme, colors) {
+            return {backgroundColor: colors[theme].background};
+        },
+
+        // extend the live trace of the price chart with ticks not yet shown;
+        // a new figure (ticker or theme change) starts empty and gets the
+        // whole ring, maxPoints keeps the trace at ring_size
+        price_stream: function(n_intervals, figure, ticker, config) {
+            openStream(config);
+            const ring = stream.rings[ticker];
+            const triggered = window.dash_clientside.callback_context.triggered.map((t) => t.prop_id);
+            if (!ring || !figure) {
+                return window.dash_clientside.no_update;
+            }
+            const fresh = triggered.some((id) => id.endsWith('.figure'));
+            const count = fresh ? ring.x.length : Math.min(ring.received - ring.sent, ring.x.length);
+            ring.sent = ring.received;
+            if (!count) {
+                return window.dash_clientside.no_update;
+            }
+            const live = figure.data.length - 1;
+            return [{x: [ring.x.slice(-count)], y: [ring.y.slice(-count)]}, [live], config.ring_size];
+        },
+
+        // update the summary rows of tickers that ticked, in place
+        summary_stream: function(n_intervals, data) {
+            if (!stream.rowsChanged || !data) {
+                return window.dash_clientside.no_update;
+            }
+            stream.rowsChanged = false;
+            return data.map((row) => Object.assign({}, row, stream.rows[row.ticker] || {}));
+        }
+    }
+});
@@ -0,0 +1,34 @@
+// wire.js
+// decodes the typed arrays of m4_wire.py, see the plotly.js binary array
+// spec; also served to the stock dashboard (dash/stock-dashboard-python)
+
+window.m4Wire = (function() {
+    const typedArrays = {
+        i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+    };
+
+    const decodeArray = (value) => {
+        if (!value || typeof value.bdata !== 'string') {
+            return value;
+        }
+        const raw = atob(value.bdata);
+        const bytes = new Uint8Array(raw.length);
+        for (let i = 0; i < raw.length; i++) {
+            bytes[i] = raw.charCodeAt(i);
+        }
+        return new typedArrays[value.dtype](bytes.buffer);
+    };
+
+    const decodeTrace = (trace) => {
+        const decoded = Object.assign({}, trace);
+        ['x', 'y', 'z', 'open', 'high', 'low', 'close'].forEach((key) => {
+            if (key in trace) {
+                decoded[key] = decodeArray(trace[key]);
+            }
+        });
+        return decoded;
+    };
+
+    return {decodeArray: decodeArray, decodeTrace: decodeTrace};
+})();
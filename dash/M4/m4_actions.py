@@ -0,0 +1,160 @@
+# corporate actions store: splits & dividends per ticker with a
+# precomputed cumulative adjustment factor (actions table in m4.db)
+#
+# yahoo's close is already split-adjusted while the ledger keeps the
+# shares & prices of the day, so ledger rows are brought into today's
+# units with the split factor; the dividend factor turns a close into a
+# total-return series
+
+# libraries
+import pandas as pd
+import numpy as np
+import m4_cache
+import m4_db
+import m4_lazy
+
+si = m4_lazy.lazy_import('yahoo_fin.stock_info')
+
+# seconds between checks for new actions, they change rarely
+actions_ttl = 24 * 3600
+
+# factor is the product of the ratios of the ticker's actions of the
+# same kind on or after the action's date, so a row dated before it is
+# adjusted by the factor of the first action after the row
+#   split ratio:    new shares per old share
+#   dividend ratio: previous close / (previous close - dividend)
+
+# memory-resident copy of the actions table, reloaded once any worker
+# has changed it (the actions version in the versions table)
+state = {'actions': None, 'version': None}
+
+def actions_version():
+    row = m4_db.connection().execute("SELECT version FROM versions WHERE name = 'actions'").fetchone()
+    return row[0] if row else 0
+
+def actions_load():
+    version = actions_version()
+    if state['actions'] is None or state['version'] != version:
+        actions = m4_db.query("SELECT * FROM actions ORDER BY date")
+        actions['date'] = pd.to_datetime(actions['date'])
+        state['actions'], state['version'] = actions, version
+    return state['actions']
+
+def action_add(ticker, date, kind, value, ratio):
+    """Record one action and update the factors it changes
+
+    Only the ticker's earlier actions of the same kind are touched;
+    price histories and ledger rows are adjusted when they are read.
+
+    Args:
+        ticker: stock ticker symbol
+        date: ex-date
+        kind: 'split' or 'dividend'
+        value: split ratio or dividend amount
+        ratio: price divisor of the action
+    Returns:
+        False when another worker had already recorded it
+    """
+    date = str(date)[0:10]
+    con = m4_db.connection()
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        later = con.execute("SELECT factor FROM actions WHERE ticker = ? AND kind = ? AND date > ? "
+                            "ORDER BY date LIMIT 1", (ticker, kind, date)).fetchone()
+        inserted = con.execute("INSERT OR IGNORE INTO actions VALUES (?, ?, ?, ?, ?, ?)",
+                               (ticker, date, kind, value, ratio, ratio * (later[0] if later else 1))).rowcount
+        if not inserted:
+            return False
+        con.execute("UPDATE actions SET factor = factor * ? WHERE ticker = ? AND kind = ? AND date < ?",
+                    (ratio, ticker, kind, date))
+        con.execute("INSERT INTO versions VALUES ('actions', 1) "
+                    "ON CONFLICT (name) DO UPDATE SET version = version + 1")
+    return True
+
+def split_add(ticker, date, ratio):
+    return action_add(ticker, date, 'split', ratio, ratio)
+
+def dividend_add(ticker, date, amount, close):
+    """Record a dividend, close being the last close before the ex-date"""
+    return action_add(ticker, date, 'dividend', amount, close / (close - amount))
+
+#### download ####
+
+def split_ratio(text):
+    # yahoo writes splits as "2:1" or "2/1"
+    numerator, denominator = text.replace(':', '/').split('/')
+    return float(numerator) / float(denominator)
+
+def actions_sync(ticker, quote):
+    """Add the splits & dividends newer than the stored ones
+
+    Args:
+        ticker: stock ticker symbol
+        quote: price history, for the close before each dividend
+    Returns:
+        the number of actions added
+    """
+    actions = actions_load()
+    known = actions[actions['ticker'] == ticker].groupby('kind')['date'].max()
+    added = 0
+
+    try:
+        splits = si.get_splits(ticker)
+    except AssertionError:
+        # raised when the ticker never split
+        splits = pd.DataFrame()
+    for date, row in splits.iterrows():
+        if date > known.get('split', pd.Timestamp.min):
+            added += split_add(ticker, date, split_ratio(row['splitRatio']))
+
+    try:
+        dividends = si.get_dividends(ticker)
+    except AssertionError:
+        # raised when the ticker never paid a dividend
+        dividends = pd.DataFrame()
+    close = quote['close'].dropna()
+    for date, row in dividends.iterrows():
+        before = close[close.index < date]
+        if date > known.get('dividend', pd.Timestamp.min) and len(before):
+            added += dividend_add(ticker, date, row['dividend'], before.iloc[-1])
+    return added
+
+def actions_fetch(ticker, quote):
+    # checked once per actions_ttl by any worker
+    return m4_cache.cached('actions:' + ticker, lambda: actions_sync(ticker, quote), actions_ttl)
+
+#### adjustment ####
+
+def factors(tickers, dates, kind='split'):
+    """Cumulative adjustment factor for each (ticker, date)
+
+    Args:
+        tickers: array of ticker symbols
+        dates: array of dates, same length
+        kind: 'split' or 'dividend'
+    Returns:
+        an array of factors, 1 after the ticker's last action
+    """
+    actions = actions_load()
+    actions = actions.loc[actions['kind'] == kind, ['ticker', 'date', 'factor']]
+    rows = pd.DataFrame({'ticker': np.asarray(tickers), 'date': pd.to_datetime(dates),
+                         'order': np.arange(len(tickers))})
+    # the first action strictly after each row
+    rows = pd.merge_asof(rows.sort_values('date'), actions, on='date', by='ticker',
+                         direction='forward', allow_exact_matches=False)
+    return rows.sort_values('order')['factor'].fillna(1).values
+
+def adjust_ledger(st):
+    """Ledger rows in today's share units: shares times the split factor,
+    prices divided by it; totals are unchanged"""
+    factor = factors(st['ticker'].values, st['date'].values)
+    return st.assign(number=st['number'] * factor, price=st['price'] / factor)
+
+def adjust_quote(ticker, quote, kind='dividend'):
+    """Price history divided by the ticker's factors, by default the
+    total-return series with dividends reinvested"""
+    factor = factors(np.repeat(ticker, len(quote)), quote.index.values, kind)
+    adjusted = quote.copy()
+    for column in ['open', 'high', 'low', 'close']:
+        adjusted[column] = quote[column].values / factor
+    return adjusted
@@ -0,0 +1,132 @@
+# amortization schedules & what-if comparisons for the mortgage tab
+
+# libraries
+import pandas as pd
+import numpy as np
+
+# payments per year, and the share of the monthly payment paid each period
+# for the accelerated options
+frequencies = {
+    'monthly': (12, None),
+    'semi-monthly': (24, None),
+    'biweekly': (26, None),
+    'weekly': (52, None),
+    'accelerated biweekly': (26, 1 / 2),
+    'accelerated weekly': (52, 1 / 4),
+}
+
+# canadian fixed-rate mortgages compound semi-annually
+def periodic_rate(rate, periods_per_year, compounding=2):
+    return (1 + rate / compounding) ** (compounding / periods_per_year) - 1
+
+def annual_rate(r, periods_per_year, compounding=2):
+    return compounding * ((1 + r) ** (periods_per_year / compounding) - 1)
+
+def annuity(balance, r, periods):
+    # at a zero rate the balance is repaid in equal parts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(r == 0, balance / periods, balance * r / (1 - (1 + r) ** -periods))
+
+def amortize_batch(principal, rate, years=25, frequency='monthly',
+                   annual_prepayment=0, prepayments=None, compounding=2):
+    """Amortization schedules for N what-if scenarios in one pass
+
+    Every argument except prepayments may be a scalar or a list, and they
+    are broadcast to N scenarios. Balances use the closed form
+    B_k = (1+r)^k * (B - sum_{j<=k} (P + L_j) / (1+r)^j), so the whole
+    N x periods grid is a single np.cumsum with no per-period loop.
+
+    Args:
+        principal: starting balance
+        rate: annual interest rate, e.g. 0.025
+        years: amortization in years
+        frequency: a key of `frequencies`
+        annual_prepayment: lump sum paid with the last payment of each year
+        prepayments: dict of payment number -> extra lump sum, numbers
+            past the end of the longest schedule are ignored
+        compounding: compounding periods per year
+    Returns:
+        a long schedule dataframe (scenario x period) and a summary
+        dataframe with one row per scenario
+    Raises:
+        ValueError: a prepayment number below 1
+    """
+    principal, rate, years, frequency, annual_prepayment = np.broadcast_arrays(
+        principal, rate, years, np.asarray(frequency, dtype=object), annual_prepayment)
+    principal = principal.astype(float).ravel()[:, None]
+    rate = rate.astype(float).ravel()[:, None]
+    years = years.astype(int).ravel()[:, None]
+    frequency = frequency.ravel()
+    annual_prepayment = annual_prepayment.astype(float).ravel()[:, None]
+
+    ppy = np.array([frequencies[f][0] for f in frequency])[:, None]
+    share = np.array([frequencies[f][1] or np.nan for f in frequency])[:, None]
+    r = periodic_rate(rate, ppy, compounding)
+    periods = years * ppy
+
+    # accelerated payments are a fraction of the monthly payment
+    payment = annuity(principal, r, periods)
+    monthly = annuity(principal, periodic_rate(rate, 12, compounding), years * 12)
+    payment = np.where(np.isnan(share), payment, monthly * share)
+
+    k = np.arange(1, periods.max() + 1)[None, :]
+    lump = np.where(k % ppy == 0, annual_prepayment, 0.0)
+    for period, amount in (prepayments or {}).items():
+        if period < 1:
+            raise ValueError('prepayment number %r, payments are numbered from 1' % period)
+        if period <= lump.shape[1]:
+            lump[:, period - 1] += amount
+    lump = np.where(k <= periods, lump, 0.0)
+
+    discount = (1 + r) ** -k
+    paid = np.where(k <= periods, payment + lump, 0.0)
+    balance = (principal - np.cumsum(paid * discount, axis=1)) / discount
+
+    # stop each scenario at the payment that clears it
+    done = balance <= 0.005
+    payoff = np.where(done.any(axis=1), done.argmax(axis=1) + 1, periods.ravel())[:, None]
+    opening = np.hstack([principal, balance[:, :-1]])
+    paid = np.where(k == payoff, opening * (1 + r), paid)
+    paid = np.where(k > payoff, 0.0, paid)
+    lump = np.where(k <= payoff, np.minimum(lump, paid), 0.0)
+    interest = np.where(k <= payoff, opening * r, 0.0)
+    balance = np.where(k < payoff, balance, 0.0)
+
+    live = k <= payoff
+    rows = np.nonzero(live)
+    schedule = pd.DataFrame({
+        'scenario': rows[0],
+        'period': k.ravel()[rows[1]],
+        'years': (k / ppy)[live],
+        'payment': (paid - lump)[live].round(2),
+        'prepayment': lump[live].round(2),
+        'interest': interest[live].round(2),
+        'principal': (paid - interest)[live].round(2),
+        'balance': balance[live].round(2),
+    })
+
+    summary = pd.DataFrame({
+        'scenario': np.arange(len(frequency)),
+        'frequency': frequency,
+        'rate %': (rate.ravel() * 100).round(2),
+        'payment': np.broadcast_to(payment, principal.shape).ravel().round(2),
+        'annual prepayment': annual_prepayment.ravel(),
+        'payoff years': (payoff / ppy).ravel().round(2),
+        'total interest': interest.sum(axis=1).round(2),
+    })
+    summary['interest saved'] = (summary['total interest'].max() - summary['total interest']).round(2)
+
+    return schedule, summary
+
+def amortize(principal, rate, years=25, frequency='monthly',
+             annual_prepayment=0, prepayments=None, compounding=2):
+    """Full amortization schedule for a single scenario
+
+    Args:
+        see amortize_batch
+    Returns:
+        the schedule dataframe, one row per payment
+    """
+    schedule, _ = amortize_batch(principal, rate, years, frequency,
+                                 annual_prepayment, prepayments, compounding)
+    return schedule.drop(columns='scenario')
@@ -6,7 +6,9 @@
 #### libraries ####
 import os
 import time
-from numpy.core.arrayprint import format_float_positional
+import functools
+import threading
+import urllib.parse
 import pandas as pd
 import numpy as np 
 
@@ -14,16 +16,30 @@ import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
-
-import plotly.express as px
-import plotly.graph_objects as go
+from dash.exceptions import PreventUpdate
+from dash.dependencies import Input, Output, State, ClientsideFunction, MATCH, ALL
 
 import m4_functions
+import m4_actions
+import m4_amortization
+import m4_events
+import m4_figures
+import m4_holdings
+import m4_ingest
+import m4_jobs
+import m4_ledger
+import m4_lots
+import m4_montecarlo
 import m4_parameters 
-import yahoo_fin.stock_info as si
+import m4_portfolios
+import m4_salary
+import m4_stream
+import m4_theme
+import m4_wire
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], compress=True)
+app.server.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+server = app.server
 
 #### Fetch data 
 mt, mt_summary = m4_functions.mt_fetch()
@@ -31,45 +47,212 @@ st, st_summary, tickers, current_date = m4_functions.st_fetch()
 csa, csa_sell = m4_functions.csa_fetch()
 sal = m4_functions.sal_fetch()
 
+# ledger events: seeded from the csvs once, the logged events that are
+# not in the csvs top up the tables like rows appended to the csvs
+ledger = m4_events.load()
+m4_events.seed(ledger, mt, st, sal)
+
+mt, mt_summary = m4_ledger.mortgage_fetch(ledger, (mt, mt_summary))
+sal = m4_ledger.salary_fetch(ledger, sal)
+sal_stats = m4_salary.sal_fetch_analytics(sal)
+
+def stocks_load(fetched):
+    """Stock tables from the results of st_fetch, with the logged
+    transactions that are not in stocks.csv"""
+    global st, holdings, lots
+    tables = m4_ledger.stocks_fetch(ledger, fetched)
+    st, holdings, lots = tables['st'], tables['holdings'], tables['lots']
+    quote_marks.update({ticker: quote_mark(quote) for ticker, quote in tables['quotes'].items()})
+    stocks_summarized(tables)
+
+def stocks_summarized(tables):
+    # the tables of m4_ledger.stocks_summarize
+    global st_summary, tickers, current_date, positions, prices, risk
+    st_summary, tickers, current_date = tables['st_summary'], tables['tickers'], tables['current_date']
+    positions, prices, risk = tables['positions'], tables['prices'], tables['risk']
+
+# last date & close of each history in the holdings table
+quote_marks = {}
+
+def quote_mark(quote):
+    return (quote.index[-1], quote['close'].iloc[-1]) if len(quote) else None
+
+stocks_load((st, st_summary, tickers, current_date))
+
+# the event callbacks, the csv watcher & the quote refresh all update the
+# stock tables
+stocks_lock = threading.Lock()
+
+def stock_rows_add(rows):
+    global st, holdings, lots
+    with stocks_lock:
+        # the tables are replaced once all of them are computed, so a
+        # failed download leaves them as they were for the rows to be
+        # added again
+        added = st.append(rows, ignore_index=True)
+        # splits of a new ticker before its rows are adjusted
+        m4_functions.st_actions(rows['ticker'].unique())
+        adjusted = m4_actions.adjust_ledger(added)
+        rows = adjusted.iloc[len(adjusted) - len(rows):]
+        # holdings are updated in place
+        added_holdings = m4_holdings.holdings_add_transactions(holdings.copy(), rows, adjusted,
+                                                               m4_ledger.held_quotes(added))
+        added_lots = {method: m4_lots.lots_add(state, rows, method) for method, state in lots.items()}
+        summarized = m4_ledger.stocks_summarize(added, m4_functions.positions_table(added))
+        st, holdings, lots = added, added_holdings, added_lots
+        stocks_summarized(summarized)
+
+def quotes_refresh():
+    """Fetch the quote histories past their ttl and materialize the new
+    quote days in the holdings table & the summary
+
+    Returns:
+        whether any history changed
+    """
+    global holdings
+    with stocks_lock:
+        quotes = m4_ledger.held_quotes(st)
+        marks = {ticker: quote_mark(quote) for ticker, quote in quotes.items()}
+        if marks == quote_marks:
+            return False
+        holdings = m4_holdings.holdings_add_prices(holdings, m4_actions.adjust_ledger(st), quotes)
+        quote_marks.update(marks)
+        stocks_summarized(m4_ledger.stocks_summarize(st, positions))
+    return True
+
+# events read from the log that are not in the tables yet; the ledger
+# lock keeps them & the views in step with the tables
+pending = []
+ledger_lock = threading.RLock()
+
+@m4_events.subscribe
+def ledger_event(event, state):
+    if state is ledger and not event.get('csv'):
+        pending.append(event)
+
+def ledger_update():
+    """Read the new ledger events and fold them into the tables
+
+    Returns:
+        the number of events read
+    """
+    with ledger_lock:
+        applied = m4_events.catch_up(ledger)
+        for view, (table, columns) in m4_ledger.event_tables.items():
+            kinds = m4_events.view_kinds[view]
+            events = [event for event in pending if event['kind'] in kinds]
+            if events:
+                ledger_ingest({table: m4_ledger.event_rows(events, view)})
+                # dropped once folded in, the next call retries a failed table
+                pending[:] = [event for event in pending if event['kind'] not in kinds]
+    return applied
+
+def mortgage_load(fetched):
+    # the mortgage tables & their payoff simulation, replaced together
+    global mt, mt_summary, mt_terms, mc, mc_summary
+    simulated = m4_ledger.mortgage_simulation(fetched[0])
+    (mt, mt_summary), (mt_terms, mc, mc_summary) = fetched, simulated
+
+mortgage_load((mt, mt_summary))
+
 #### graphical elements ####
 
-# set up plots
-mt_balance = px.scatter(mt, x="date", y="balance", color="type", size="principal")
-mt_balance.update_traces(hovertemplate = 'Date: %{x}<br>Balance: %{y:$,.0f}<br>Principal: %{marker.size:$,.2f}')
+# set up plots, each built on the first render of its tab
+@functools.lru_cache()
+def mt_balance_figure():
+    return m4_figures.mt_balance_figure(mt)
+
+@functools.lru_cache()
+def mt_interest_figure():
+    return m4_figures.mt_interest_figure(mt)
+
+@functools.lru_cache()
+def mt_payoff_figure():
+    return m4_figures.mt_payoff_figure(mc, m4_ledger.mc_params.get('years', m4_montecarlo.default_years))
 
-mt_interest = px.scatter(mt, x="date", y=["prin_total", "int_total"])
-mt_interest.update_layout(hovermode='x')
+@functools.lru_cache()
+def csa_figure():
+    return m4_figures.csa_figure(csa, csa_sell)
 
-csa_graph = px.line(csa, x="date", y="price")
-csa_graph.add_trace(go.Scatter(x=csa_sell.date, y=csa_sell.price, 
-                                name = "sell price", mode="markers", marker_size = 10,
-                                marker_color='rgba(200, 40, 0, .8)',
-                                marker_line_width=2,
-                                showlegend=False))
+@functools.lru_cache()
+def sal_figure():
+    return m4_figures.sal_figure(sal)
 
-sal_graph = px.line(sal, x="date", y="amount", color="type")
-sal_graph.add_trace(go.Scatter(x=sal.date, y=sal.amount, 
-                                name = 'amount', mode="markers", marker_size = 12,
-                                marker_line_width=3))
-sal_graph.update_traces(hovertemplate = 'Date: %{x}<br>Amount: %{y:$,.0f}')
+@functools.lru_cache()
+def sal_real_figure():
+    return m4_figures.sal_real_figure(sal_stats)
 
-# adjust plots for time of day
-mt_balance = m4_functions.time_of_day(mt_balance)
-mt_interest = m4_functions.time_of_day(mt_interest)
-csa_graph = m4_functions.time_of_day(csa_graph)
-sal_graph = m4_functions.time_of_day(sal_graph)
+@functools.lru_cache()
+def sal_cumulative_figure():
+    return m4_figures.sal_cumulative_figure(sal_stats)
 
 # set up tables
-mt_table = m4_functions.table_setup(mt, 1500)
-mt_summary_table = m4_functions.table_setup(mt_summary, 100)
-st_table = m4_functions.table_setup(st)
-st_summary_table = m4_functions.table_setup(st_summary, 300)
-csa_table = m4_functions.table_setup(csa)
-csa_sell_table = m4_functions.table_setup(csa_sell)
-sal_table = m4_functions.table_setup(sal, 1000)
+def tables_setup():
+    global mt_table, mt_summary_table, mc_summary_table, csa_table, csa_sell_table
+    global sal_table, sal_summary_table, sal_annual_table
+    mt_table = m4_functions.table_setup(mt, 1500, name='mt', formats={'balance': ',.2f'})
+    mt_summary_table = m4_functions.table_setup(mt_summary, 100, name='mt-summary')
+    mc_summary_table = m4_functions.table_setup(mc_summary, 250, name='mc-summary')
+    csa_table = m4_functions.table_setup(csa, name='csa')
+    csa_sell_table = m4_functions.table_setup(csa_sell, name='csa-sell')
+    sal_table = m4_functions.table_setup(sal, 1000, name='sal')
+    sal_summary_table = m4_functions.table_setup(sal_stats['summary'], 100, name='sal-summary')
+    sal_annual_table = m4_functions.table_setup(sal_stats['annual'], 400, name='sal-annual')
+
+tables_setup()
+
+#### ledger csv ingest ####
+
+# figures drawn from the mortgage, csa & salary tables
+ledger_figures = [mt_balance_figure, mt_interest_figure, mt_payoff_figure, csa_figure,
+                  sal_figure, sal_real_figure, sal_cumulative_figure]
+
+def ledger_ingest(changes):
+    """Fold the rows appended to the ledger csvs or logged as events into
+    the tables, rebuild those of a ledger whose earlier lines changed
+
+    Args:
+        changes: from m4_ingest.poll, or ledger_update
+    """
+    global csa, csa_sell, sal, sal_stats
+    with ledger_lock:
+        if 'stocks' in changes:
+            rows = changes['stocks']
+            if rows is None:
+                stocks_load(m4_functions.st_fetch())
+            else:
+                rows['date'] = pd.to_datetime(rows['date'])
+                stock_rows_add(rows)
+        if 'mortgage' in changes:
+            rows = changes['mortgage']
+            if rows is None:
+                mortgage_load(m4_ledger.mortgage_fetch(ledger))
+            else:
+                mortgage_load(m4_functions.mt_append(mt, rows))
+        if 'csa' in changes:
+            # the sell periods & the hypothetical current sale span the ledger
+            csa, csa_sell = m4_functions.csa_fetch()
+        if 'salary' in changes:
+            rows = changes['salary']
+            if rows is None:
+                added = m4_ledger.salary_fetch(ledger)
+            else:
+                added = sal.append(rows.assign(date=pd.to_datetime(rows['date'])))
+            sal, sal_stats = added, m4_salary.sal_fetch_analytics(added)
+        tables_setup()
+        for figure in ledger_figures:
+            figure.cache_clear()
+
+# the ledgers the tables above were built from
+m4_ingest.poll()
+
+@server.before_request
+def ingest_start():
+    m4_ingest.ensure_started(ledger_ingest)
 
 ## selection options for stock chart
-form_card_group = dbc.Card(
+def form_card_group(tickers):
+    return dbc.Card(
     [
         dbc.FormGroup(
             [
@@ -85,13 +268,127 @@ form_card_group = dbc.Card(
             ]
         )])
 
+## what-if options for mortgage schedules
+whatif_card_group = dbc.Card(
+    [
+        dbc.FormGroup(
+            [
+                dbc.Label("Rate %"),
+                dcc.Input(id="whatif-rate", type="number", min=0, step=0.05,
+                          value=round(mt_terms['rate'] * 100, 2)),
+                dbc.Label("Years remaining"),
+                dcc.Input(id="whatif-years", type="number", min=1, max=35, value=25),
+                dbc.Label("Annual prepayment"),
+                dcc.Input(id="whatif-prepayment", type="number", min=0, step=1000, value=0),
+            ]
+        ),
+        dbc.FormGroup(
+            [
+                dbc.Label("Payment frequency"),
+                dcc.Checklist(
+                    id="whatif-frequency",
+                    options=[{"label": f, "value": f}
+                        for f in m4_amortization.frequencies
+                    ],
+                    value=["monthly", "accelerated biweekly"],
+                    labelStyle={'display': 'block'},
+                ),
+            ]
+        )], body=True)
+
+## live quotes, when M4_STREAM names a tick source
+def stream_setup():
+    if not m4_stream.source_name:
+        return []
+    return [
+        dcc.Interval(id='stream-interval', interval=int(m4_stream.tick_seconds * 1000)),
+        dcc.Store(id='stream-config', data={'url': '/stream/quotes', 'ring_size': m4_stream.ring_size}),
+    ]
+
+if m4_stream.source_name:
+    # positions, st_summary & tickers follow the ledger, see stocks_summarized
+    def stream_row(ticker, ms, price):
+        summary = st_summary[st_summary['ticker'] == ticker]
+        if ticker not in positions.index or summary.empty:
+            return None
+        return m4_functions.st_stream_row(ticker, positions.loc[ticker], summary.iloc[0],
+                                          pd.Timestamp(ms, unit='ms'), price)
+
+    m4_stream.register(server, lambda: list(tickers), stream_row)
+
+## portfolios
+# the page url picks the portfolio (?portfolio=<name>, see m4_portfolios);
+# portfolios are not listed, and only the default one has the household
+# mortgage, csa & salary tabs
+def portfolio_name(search):
+    query = urllib.parse.parse_qs((search or '').lstrip('?'))
+    return query.get('portfolio', [m4_portfolios.default])[0]
+
+def investments_state(name):
+    if name == m4_portfolios.default:
+        return {'st': st, 'st_summary': st_summary, 'tickers': list(tickers), 'current_date': current_date,
+                'holdings': holdings, 'gains': m4_lots.gains_table(lots, prices), 'risk': risk}
+    return m4_portfolios.portfolio_fetch(name)
+
+def investments_tab(state, live):
+    """Investments tab for one portfolio
+
+    Args:
+        state: tables from investments_state
+        live: add the ledger-event & quote-stream updates, which follow
+            the default portfolio
+    """
+    risk_summary = state['risk']['summary']
+    return html.Div([
+        html.H3(children= 'Summary as of ' + str(state['current_date'])[0:10],
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(m4_functions.table_setup(state['st_summary'], 300, name='st-summary'),
+                 style = {"padding": "1rem 1rem"}),
+        html.H3(children='Gains (ACB & FIFO)',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(m4_functions.table_setup(state['gains'], 250, name='st-gains'),
+                 style = {"padding": "1rem 1rem"}),
+        html.H3(children='Risk',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(m4_functions.table_setup(risk_summary[risk_summary['ticker'] == 'portfolio'], 100, name='st-risk'),
+                 style = {"padding": "1rem 1rem"}),
+        html.Div(m4_functions.graph_setup('st-risk', m4_figures.risk_figure(state['risk']))),
+        html.H3(children='Portfolio value',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(m4_functions.graph_setup('st-value', m4_figures.value_figure(state['holdings']))),
+        html.Div([dcc.Interval(id='ledger-interval', interval=60 * 1000)] if live else []),
+        html.H3(children='Stock history',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(form_card_group(state['tickers'])),
+        html.Div(m4_functions.graph_setup('stock-price')),
+        html.Div(id='price-job-progress', style = {"padding": "0 1rem"}),
+        dcc.Store(id='price-job'),
+        dcc.Interval(id='price-job-interval', interval=int(m4_jobs.poll_seconds * 1000), disabled=True),
+        html.Div(stream_setup() if live else []),
+        html.H3(children='Transactions', 
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(m4_functions.table_setup(state['st'], name='st'), style = {"padding": "1rem 1rem"}),
+        ])
+
 #### app layout ####
 
-app.layout = html.Div(style={'backgroundColor': m4_functions.colors['background']}, children=[
+app.layout = html.Div(id='m4-page', style={'backgroundColor': m4_theme.colors[m4_theme.theme_now()]['background']}, children=[
+    dcc.Location(id='url'),
     html.H3(
         children="Marc's Money-Making Machine",
         style={'textAlign': 'center','color': '#2fa4e7'}
     ),
+    dcc.RadioItems(
+        id='theme-select',
+        options=[{'label': theme, 'value': theme} for theme in m4_theme.colors],
+        value=m4_theme.theme_now(),
+        labelStyle={'display': 'inline-block', 'padding': '0 0.5rem', 'color': '#2fa4e7'},
+        style={'textAlign': 'right'},
+    ),
+    # theme variants, swapped in the browser without re-rendering figures
+    dcc.Store(id='theme-templates', data=m4_theme.templates),
+    dcc.Store(id='theme-tables', data=m4_theme.table_styles),
+    dcc.Store(id='theme-colors', data=m4_theme.colors),
     dcc.Tabs(id='tabs-example', value='tab-1', children=[
         dcc.Tab(label='Investments', value='tab-1', style=m4_parameters.tab_style, 
         selected_style=m4_parameters.tab_selected_style),
@@ -99,30 +396,56 @@ app.layout = html.Div(style={'backgroundColor': m4_functions.colors['background'
         dcc.Tab(label='CSA', value='tab-3', style=m4_parameters.tab_style, selected_style=m4_parameters.tab_selected_style),
         dcc.Tab(label='Salary', value='tab-4', style=m4_parameters.tab_style, selected_style=m4_parameters.tab_selected_style),
     ]),
-    html.Div(id='tabs-example-content')
+    html.Div(id='tabs-example-content'),
+    # other portfolios are computed in the background, polled until ready
+    dcc.Store(id='portfolio-job'),
+    dcc.Interval(id='portfolio-job-interval', interval=int(m4_jobs.poll_seconds * 1000), disabled=True),
 ])
 
 #### app callback ####
 
 # tabs callback
 @app.callback(Output('tabs-example-content', 'children'),
-              Input('tabs-example', 'value'))
-
-def render_content(tab):
+              Output('portfolio-job', 'data'),
+              Output('portfolio-job-interval', 'disabled'),
+              Input('tabs-example', 'value'),
+              Input('url', 'search'),
+              Input('portfolio-job-interval', 'n_intervals'),
+              State('portfolio-job', 'data'))
+
+def render_content(tab, search, n_intervals, job):
+    name = portfolio_name(search)
+    folder = m4_portfolios.portfolio_dir(name)
+    if name == m4_portfolios.default or folder is None or tab != 'tab-1':
+        # the page moved on, a portfolio still loading is not needed
+        if job:
+            m4_jobs.job_cancel(job)
+        if folder is None:
+            return (html.H3(children='No portfolio named ' + name,
+                            style={'textAlign': 'center','color': '#2fa4e7'}), None, True)
+        if name != m4_portfolios.default:
+            return (html.H3(children='This portfolio only has investments',
+                            style={'textAlign': 'center','color': '#2fa4e7'}), None, True)
+        return tab_content(tab), None, True
+
+    job = m4_jobs.job_submit(m4_portfolios.portfolio_key(name, folder), m4_portfolios.portfolio_compute, folder,
+                             ttl=m4_functions.quote_ttl, previous=job)
+    status = m4_jobs.job_poll(job)
+    if status['state'] == 'done':
+        return investments_tab(status['result'], live=False), None, True
+    return job_progress(status), job, status['state'] == 'failed'
+
+def job_progress(status):
+    """Progress bar of a background job, or its error once it failed"""
+    if status['state'] == 'failed':
+        return html.Div(children='Failed: ' + status['message'], style={'textAlign': 'center','color': '#e74c3c'})
+    return dbc.Progress(children=status['message'], value=round(status['progress'] * 100),
+                        striped=True, animated=True, style={'margin': '1rem'})
+
+def tab_content(tab):
     if tab == 'tab-1':
-        return (html.Div([
-        html.H3(children= 'Summary as of ' + str(current_date)[0:10],
-        style={'textAlign': 'center','color': '#2fa4e7'}),
-        html.Div(st_summary_table, style = {"padding": "1rem 1rem"}),
-        html.H3(children='Stock history',
-        style={'textAlign': 'center','color': '#2fa4e7'}),
-        html.Div(form_card_group),
-        dcc.Graph(id="stock-price-graph"),
-        html.H3(children='Transactions', 
-        style={'textAlign': 'center','color': '#2fa4e7'}),
-        html.Div(st_table, style = {"padding": "1rem 1rem"}),
-        ])),
-  
+        return investments_tab(investments_state(m4_portfolios.default), live=True)
+
     elif tab == 'tab-2':
         return (html.Div([
         html.H3(children='Summary stats',
@@ -131,19 +454,26 @@ def render_content(tab):
         html.H3(children='Balance',
         style={'textAlign': 'center','color': '#2fa4e7'}),
 
-        dcc.Graph(
-            id='graph1',
-            figure=mt_balance
-        ),  
+        html.Div(m4_functions.graph_setup('mt-balance', mt_balance_figure())),
     ]),
     # New Div for all elements in the new 'row' of the page
     html.Div([
         html.H3(children='Principal & Interest',
         style={'textAlign': 'center','color': '#2fa4e7'}),
-        dcc.Graph(
-            id='graph2',
-            figure=mt_interest
-        ),  
+        html.Div(m4_functions.graph_setup('mt-interest', mt_interest_figure())),
+    ]),
+    html.Div([
+        html.H3(children='What-if schedules',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(whatif_card_group),
+        html.Div(m4_functions.graph_setup('whatif')),
+        html.Div(id='whatif-table', style = {"padding": "1rem 1rem"}),
+    ]),
+    html.Div([
+        html.H3(children='Payoff projection',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(mc_summary_table, style = {"padding": "1rem 1rem"}),
+        html.Div(m4_functions.graph_setup('mt-payoff', mt_payoff_figure())),
     ]),
     html.Div([
         html.H3(children='Transactions',
@@ -155,10 +485,7 @@ def render_content(tab):
         return (html.Div([
         html.H3(children='CSA history',
          style={'textAlign': 'center','color': '#2fa4e7'}),
-        dcc.Graph(
-            id='graph3',
-            figure=csa_graph
-        ), 
+        html.Div(m4_functions.graph_setup('csa', csa_figure())),
         html.H3(children='Summary stats',
         style={'textAlign': 'center','color': '#2fa4e7'}),
         html.Div(csa_sell_table, style = {"padding": "1rem 1rem"}),
@@ -171,10 +498,17 @@ def render_content(tab):
         return (html.Div([
         html.H3(children='Salary history',
          style={'textAlign': 'center','color': '#2fa4e7'}),
-        dcc.Graph(
-            id='graph3',
-            figure=sal_graph
-        ), 
+        html.Div(m4_functions.graph_setup('sal', sal_figure())),
+        html.H3(children='Summary stats',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(sal_summary_table, style = {"padding": "1rem 1rem"}),
+        html.H3(children='Nominal & real salary',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(m4_functions.graph_setup('sal-real', sal_real_figure())),
+        html.H3(children='Cumulative earnings',
+        style={'textAlign': 'center','color': '#2fa4e7'}),
+        html.Div(m4_functions.graph_setup('sal-cumulative', sal_cumulative_figure())),
+        html.Div(sal_annual_table, style = {"padding": "1rem 1rem"}),
         html.H3(children='Transactions', 
         style={'textAlign': 'center','color': '#2fa4e7'}),
         html.Div(sal_table, style = {"padding": "1rem 1rem"}),
@@ -184,105 +518,154 @@ def render_content(tab):
 
 ## stock chart callback
 @app.callback(
-    Output("stock-price-graph", "figure"),
+    Output({'type': 'figure-store', 'index': 'stock-price'}, "data"),
+    Output('price-job', 'data'),
+    Output('price-job-interval', 'disabled'),
+    Output('price-job-progress', 'children'),
     Input("stock-ticker-select", "value"),
+    Input('price-job-interval', 'n_intervals'),
+    State("url", "search"),
+    State('price-job', 'data'),
 )
 # def update_price_figure(ticker):
 #     fig = m4_functions.update_price_figure(ticker)
 #     return fig
 
-def update_price_figure(ticker):
+def update_price_figure(ticker, n_intervals, search, job):
     """Create a plot of stock prices
+
+    The figure is drawn by a background job; until it is ready the
+    interval polls its progress, and a new ticker cancels the old job.
+
     Args:
         tickers: ticker symbols from the dropdown select
+        n_intervals: progress polls so far
+        search: page url query, names the portfolio
+        job: id of the job drawing the figure, if one is running
     Returns:
         a graph `figure` dict containing the specificed
-        price data points per stock
+        price data points per stock, the job id, whether polling stops
+        and the job's progress bar
     """
+    name = portfolio_name(search)
+    if name == m4_portfolios.default:
+        # the figure draws the ticker's buy date & price from st_summary,
+        # which changes with the ledger events & csv rows folded in; the
+        # pool's workers were forked before, so the row goes with the job
+        buy = st_summary.loc[st_summary['ticker'] == ticker, ['ticker', 'buy_date', 'buy_price']]
+        if buy.empty:
+            raise PreventUpdate
+        version = '%s@%s' % (buy['buy_date'].iloc[0], buy['buy_price'].iloc[0])
+    else:
+        folder = m4_portfolios.portfolio_dir(name)
+        if folder is None:
+            raise PreventUpdate
+        # the job reads the portfolio's summary from the cache
+        buy = None
+        version = m4_portfolios.portfolio_version(folder)
+
+    # the theme is applied in the browser, one figure serves both
+    key = 'price-figure:%s:%s:%s:%s' % (name, version, ticker, m4_stream.source_name)
+    job = m4_jobs.job_submit(key, price_job, ticker, name, buy, ttl=m4_functions.quote_ttl, previous=job)
+    status = m4_jobs.job_poll(job)
+    if status['state'] == 'done':
+        return status['result'], None, True, None
+    return dash.no_update, job, status['state'] == 'failed', job_progress(status)
+
+def price_job(ticker, name, buy):
+    # runs in a pool worker, whose tables are the ones it was forked with:
+    # it draws from its arguments & the shared cache only
+    m4_jobs.progress(0.1, 'Loading ' + ticker)
+    m4_functions.quote_fetch(ticker)
+    if buy is None:
+        buy = m4_portfolios.portfolio_fetch(name)['st_summary']
+    m4_jobs.progress(0.7, 'Drawing ' + ticker)
+    return m4_wire.encode_figure(m4_figures.price_figure(ticker, buy, bool(m4_stream.source_name)))
+
+## ledger events callback
+@app.callback(
+    Output({'type': 'figure-store', 'index': 'st-value'}, "data"),
+    Input("ledger-interval", "n_intervals"),
+)
+def update_ledger(n_intervals):
+    """Apply new ledger events & quotes and redraw the portfolio value
+    Args:
+        n_intervals: interval tick
+    Returns:
+        the portfolio value `figure`, only when events or quotes arrived
+    """
+    applied = ledger_update()
+    if not quotes_refresh() and not applied:
+        raise PreventUpdate
+    return m4_wire.encode_figure(m4_figures.value_figure(holdings))
 
-    quote = si.get_data(ticker)
-    quote['date'] = quote.index
-    quote.index.name = None
-    quote['SMA_50'] = quote['close'].rolling(window=50).mean()
-    quote['SMA_200'] = quote['close'].rolling(window=200).mean()
-
-    # Marc's purchase date & cost 
-    quote_date = st_summary.loc[st_summary['ticker'] == ticker]['buy_date'].iloc[0]
-    quote_cost = float(st_summary.loc[st_summary['ticker'] == ticker]['buy_price'])
-
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=quote['date'], y=quote['close'],
-                        mode='lines',
-                        name='close',
-                        line = dict(color='black', width=2)
-                        ))
-    fig.add_trace(go.Scatter(x=quote['date'], y=quote['SMA_50'],
-                        mode='lines',
-                        name='50-day SMA',
-                        line = dict(color='LightSeaGreen', width=2)
-                        ))
-    fig.add_trace(go.Scatter(x=quote['date'], y=quote['SMA_200'],
-                        mode='lines', 
-                        name='200-day SMA',
-                        line = dict(color='SeaGreen', width=2),
-
-                        ))
-
-    fig.add_shape(
-            # Line Horizontal 
-                type="line",
-                x0=quote_date,
-                y0=quote_cost,
-                x1=quote['date'].max(),
-                y1=quote_cost,
-                line=dict(color="firebrick", width=2, dash = 'dot',
-                ),
-        )
-
-    # update layout
+## mortgage what-if callback
+@app.callback(
+    Output({'type': 'figure-store', 'index': 'whatif'}, "data"),
+    Output("whatif-table", "children"),
+    Input("whatif-rate", "value"),
+    Input("whatif-years", "value"),
+    Input("whatif-prepayment", "value"),
+    Input("whatif-frequency", "value"),
+)
+def update_whatif(rate, years, prepayment, frequencies):
+    """Compare schedules for the selected frequencies, with and without
+    the annual prepayment, starting from the current balance
+    Args:
+        rate: annual rate in percent
+        years: remaining amortization
+        prepayment: annual lump sum
+        frequencies: payment frequencies to compare
+    Returns:
+        a balance `figure` and a summary table
+    """
+    fig, summary = m4_figures.whatif_figure(mt_terms['balance'], rate, years, prepayment, frequencies)
+    return m4_wire.encode_figure(fig), m4_functions.table_setup(summary, 250, name='whatif')
+
+## live quote callbacks
+if m4_stream.source_name:
+    app.clientside_callback(
+        ClientsideFunction(namespace='clientside', function_name='price_stream'),
+        Output({'type': 'themed-graph', 'index': 'stock-price'}, 'extendData'),
+        Input('stream-interval', 'n_intervals'),
+        Input({'type': 'themed-graph', 'index': 'stock-price'}, 'figure'),
+        State('stock-ticker-select', 'value'),
+        State('stream-config', 'data'),
+    )
 
-    mytime = time.localtime()
-    if mytime.tm_hour < m4_parameters.morning or mytime.tm_hour > m4_parameters.night:
-        # night
-        colors = {
-        'background': '#111111',
-        'text': '#ffffe5'
-        }
-    else:
-        # day
-        colors = {
-        'background': '#fdfcfa',
-        'text': '#000000'
-        }
-
-    fig.update_layout(
-        autosize=True,
-        # width=800,
-        height=650,
-        legend_orientation="h",
-        showlegend=False,
-        hovermode="x unified",
-        paper_bgcolor = colors['background']
-        )
-
-    # render slider
-    fig.update_xaxes(
-        range=[quote_date, quote['date'].max()],
-        rangeslider_visible=True,
-        rangeselector=dict(
-            buttons=list([
-                dict(count=1, label="1m", step="month", stepmode="backward"),
-                dict(count=6, label="6m", step="month", stepmode="backward"),
-                dict(count=1, label="YTD", step="year", stepmode="todate"),
-                dict(count=1, label="1y", step="year", stepmode="backward"),
-                dict(count=2, label="2y", step="year", stepmode="backward"),
-                dict(count=5, label="5y", step="year", stepmode="backward"),
-                dict(step="all")
-            ])
-        )
+    app.clientside_callback(
+        ClientsideFunction(namespace='clientside', function_name='summary_stream'),
+        Output({'type': 'themed-table', 'index': 'st-summary'}, 'data'),
+        Input('stream-interval', 'n_intervals'),
+        State({'type': 'themed-table', 'index': 'st-summary'}, 'data'),
     )
 
-    return fig
+## theme callbacks
+# switching themes swaps the precomputed template and table styles in the
+# browser (assets/clientside.js); the server only sends figure data
+app.clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='apply_theme'),
+    Output({'type': 'themed-graph', 'index': MATCH}, 'figure'),
+    Input({'type': 'figure-store', 'index': MATCH}, 'data'),
+    Input('theme-select', 'value'),
+    State('theme-templates', 'data'),
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='table_theme'),
+    Output({'type': 'themed-table', 'index': ALL}, 'style_cell'),
+    Output({'type': 'themed-table', 'index': ALL}, 'style_header'),
+    Input('theme-select', 'value'),
+    Input({'type': 'themed-table', 'index': ALL}, 'id'),
+    State('theme-tables', 'data'),
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='page_theme'),
+    Output('m4-page', 'style'),
+    Input('theme-select', 'value'),
+    State('theme-colors', 'data'),
+)
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
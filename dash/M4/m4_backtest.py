@@ -0,0 +1,185 @@
+# vectorized indicator backtests over a date x ticker price panel
+#
+#   python m4_backtest.py [prices.csv]   # holdings' quotes, or a long csv
+#   python m4_backtest.py --bench        # 500 tickers x 400 pairs x 20 years
+
+# libraries
+import sys
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+
+trading_days = 252
+
+#### price panel ####
+
+def panel_from_long(prices, value='close'):
+    """Pivot long prices (date, ticker, value) into a date x ticker panel"""
+    panel = prices.pivot_table(index='date', columns='ticker', values=value)
+    panel.index = pd.to_datetime(panel.index)
+    return panel.sort_index()
+
+def panel_from_quotes(quotes, value='close'):
+    """Panel from a dict of ticker -> quote history (m4_functions.quotes)"""
+    return pd.DataFrame({ticker: quote[value] for ticker, quote in quotes.items()}).sort_index()
+
+#### indicators ####
+
+def rolling_means(close, windows):
+    """Simple moving averages for several windows from one cumulative sum
+
+    Args:
+        close: T x N array, nan where a ticker has no price
+        windows: window lengths
+    Returns:
+        dict of window -> T x N array, nan until the window is full
+    """
+    valid = np.isfinite(close)
+    cs = np.vstack([np.zeros((1, close.shape[1])), np.cumsum(np.where(valid, close, 0), axis=0)])
+    cn = np.vstack([np.zeros((1, close.shape[1])), np.cumsum(valid, axis=0)])
+    means = {}
+    for w in windows:
+        sma = np.full(close.shape, np.nan)
+        full = (cn[w:] - cn[:-w]) == w
+        sma[w - 1:] = np.where(full, (cs[w:] - cs[:-w]) / w, np.nan)
+        means[w] = sma
+    return means
+
+# each strategy maps its parameters to a long (True) / flat signal; nan
+# comparisons are False, so a strategy is flat until its windows fill
+strategies = {
+    'sma_cross': lambda close, sma, fast, slow: sma[fast] > sma[slow],
+    'price_sma': lambda close, sma, window: close > sma[window],
+    'momentum': lambda close, sma, lookback: close > np.vstack([np.full((lookback, close.shape[1]), np.nan),
+                                                                close[:-lookback]]),
+}
+
+# sma windows each strategy reads
+strategy_windows = {
+    'sma_cross': lambda fast, slow: [fast, slow],
+    'price_sma': lambda window: [window],
+    'momentum': lambda lookback: [],
+}
+
+def sma_grid(fast=range(5, 105, 5), slow=range(110, 510, 20)):
+    """sma_cross parameter pairs with fast < slow; the default ranges do
+    not overlap, so all 20 x 20 pairs are kept"""
+    return [('sma_cross', (f, s)) for f, s in itertools.product(fast, slow) if f < s]
+
+#### engine ####
+
+def backtest_block(close, grid, cost=0.001):
+    """Run every strategy of the grid over a block of tickers
+
+    A position is taken at the close of the day its signal changes and
+    held over the next day's return.
+
+    Args:
+        close: T x N array of closes
+        grid: list of (strategy name, parameter tuple)
+        cost: fraction of the position charged on each change
+    Returns:
+        dict of metric -> len(grid) x N array
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        filled = pd.DataFrame(close).ffill().values
+        log_returns = np.diff(np.log(filled), axis=0)
+        log_returns[~np.isfinite(log_returns)] = 0
+        windows = {w for name, params in grid for w in strategy_windows[name](*params)}
+        sma = rolling_means(filled, sorted(windows))
+        days = np.isfinite(filled).sum(axis=0) - 1
+
+        metrics = {k: np.empty((len(grid), close.shape[1]))
+                   for k in ['total_return', 'cagr', 'max_drawdown', 'sharpe', 'trades', 'exposure']}
+        for i, (name, params) in enumerate(grid):
+            signal = strategies[name](filled, sma, *params)[:-1]
+            changes = np.diff(signal, axis=0, prepend=False)
+            trades = changes.sum(axis=0)
+            strategy_returns = signal * log_returns - cost * changes
+            equity = np.cumsum(strategy_returns, axis=0)
+            peak = np.maximum.accumulate(np.maximum(equity, 0), axis=0)
+            total = equity[-1]
+            # std from the sums, one pass less over the T x N block
+            mean = total / len(equity)
+            std = np.sqrt(np.einsum('ij,ij->j', strategy_returns, strategy_returns) / len(equity) - mean ** 2)
+
+            metrics['total_return'][i] = np.expm1(total)
+            metrics['cagr'][i] = np.expm1(total * trading_days / days)
+            metrics['max_drawdown'][i] = np.expm1((equity - peak).min(axis=0))
+            metrics['sharpe'][i] = mean / std * np.sqrt(trading_days)
+            metrics['trades'][i] = trades
+            metrics['exposure'][i] = signal.mean(axis=0)
+    return metrics
+
+def buy_and_hold(panel):
+    filled = panel.ffill()
+    equity = np.log(filled / filled.bfill().iloc[0])
+    return pd.DataFrame({
+        'total_return': np.expm1(equity.iloc[-1]),
+        'max_drawdown': np.expm1((equity - equity.cummax().clip(lower=0)).min()),
+    })
+
+def backtest(panel, grid=None, cost=0.001, processes=None, block=64):
+    """Backtest a parameter grid over every ticker of a panel
+
+    Ticker blocks run in a process pool once the panel is large enough
+    for the pickling to pay off.
+
+    Args:
+        panel: date x ticker dataframe of closes
+        grid: list of (strategy name, parameter tuple), default sma_grid()
+        cost: cost per position change
+        processes: pool size, 0 to stay in this process, None for one per core
+        block: tickers per task
+    Returns:
+        a long dataframe with one row per strategy, parameters & ticker
+    """
+    grid = grid or sma_grid()
+    close = panel.values.astype(float)
+    blocks = [close[:, i:i + block] for i in range(0, close.shape[1], block)]
+    if processes == 0 or len(blocks) == 1:
+        parts = [backtest_block(b, grid, cost) for b in blocks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            parts = list(pool.map(backtest_block, blocks, [grid] * len(blocks), [cost] * len(blocks)))
+
+    metrics = {k: np.hstack([p[k] for p in parts]) for k in parts[0]}
+    results = pd.DataFrame({k: v.ravel() for k, v in metrics.items()})
+    results.insert(0, 'ticker', np.tile(panel.columns.values, len(grid)))
+    results.insert(0, 'params', np.repeat([str(params) for name, params in grid], panel.shape[1]))
+    results.insert(0, 'strategy', np.repeat([name for name, params in grid], panel.shape[1]))
+    return results
+
+def strategy_summary(results):
+    """Median metrics per strategy & parameters across tickers, best first"""
+    summary = results.groupby(['strategy', 'params'], sort=False).median(numeric_only=True)
+    return summary.sort_values('sharpe', ascending=False).reset_index()
+
+def synthetic_panel(tickers=500, years=20, seed=0):
+    rng = np.random.default_rng(seed)
+    days = years * trading_days
+    returns = rng.normal(0.0003, 0.015, (days, tickers))
+    dates = pd.bdate_range('2000-01-03', periods=days)
+    return pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)), index=dates,
+                        columns=['T%03d' % i for i in range(tickers)])
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        panel = synthetic_panel()
+    elif len(sys.argv) > 1:
+        panel = panel_from_long(pd.read_csv(sys.argv[1]))
+    else:
+        import m4_db
+        import m4_functions
+        tickers = m4_db.query("SELECT DISTINCT ticker FROM stocks")['ticker']
+        panel = panel_from_quotes({t: m4_functions.quote_cached(t) for t in tickers})
+
+    grid = sma_grid()
+    start = time.perf_counter()
+    results = backtest(panel, grid)
+    elapsed = time.perf_counter() - start
+    print('%d tickers x %d parameter sets x %d days in %.1f s'
+          % (panel.shape[1], len(grid), panel.shape[0], elapsed))
+    print(strategy_summary(results).head(10).to_string(index=False))
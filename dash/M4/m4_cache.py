@@ -0,0 +1,317 @@
+# cache shared by the gunicorn workers for quotes, figures & summaries
+
+# libraries
+import os
+import math
+import time
+import pickle
+import random
+import sqlite3
+import weakref
+import itertools
+import threading
+from collections import OrderedDict
+
+data_dir = os.path.join(os.path.dirname(__file__), "../../data")
+
+# M4_CACHE picks the backend:
+#   memory             per-process lru, lost on restart
+#   sqlite (default)   data/cache.db, shared by every worker on the host
+#   diskcache          data/cache/, needs the diskcache package
+#   redis://host:6379  shared between hosts, needs the redis package
+#   fakeredis          in-process stand-in for the redis backend
+backend_url = os.environ.get("M4_CACHE", "sqlite")
+
+# entries are stored as (value, delta, expires): delta is how long the
+# value took to compute, used to spread recomputation before expiry
+
+#### backends ####
+
+class MemoryCache:
+    """Thread-safe lru bounded by entry count"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if item[1] is not None and item[1] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return item[0]
+
+    def set(self, key, entry, ttl=None):
+        with self.lock:
+            self.entries[key] = (entry, time.time() + ttl if ttl else None)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def add(self, key, entry, ttl=None):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and (item[1] is None or item[1] >= time.time()):
+                return False
+            self.entries[key] = (entry, time.time() + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class SqliteCache:
+    """Pickled entries in a sqlite file, lru-evicted by total size
+
+    Eviction sums the table, so it runs every evict_every writes of a
+    process rather than on each one; the total may overshoot max_bytes
+    by the entries written in between.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+    """
+
+    def __init__(self, path=os.path.join(data_dir, "cache.db"), max_bytes=256 * 2**20, evict_every=64):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.writes = itertools.count(1)
+        self.local = threading.local()
+
+    def connect(self):
+        # one connection per thread, reopened in forked workers
+        con = getattr(self.local, 'con', None)
+        if con is None or self.local.pid != os.getpid():
+            con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(self.schema)
+            self.local.con, self.local.pid = con, os.getpid()
+        return con
+
+    def get(self, key):
+        con = self.connect()
+        now = time.time()
+        row = con.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < now:
+            con.execute("DELETE FROM cache WHERE key = ? AND expires < ?", (key, now))
+            return None
+        con.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, entry, ttl=None, replace=True):
+        con = self.connect()
+        now = time.time()
+        value = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        expires = now + ttl if ttl else None
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            if not replace:
+                row = con.execute("SELECT expires FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and (row[0] is None or row[0] >= now):
+                    return False
+            con.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                        (key, value, len(value), expires, now))
+            if next(self.writes) % self.evict_every == 0:
+                self.evict(con)
+        return True
+
+    def add(self, key, entry, ttl=None):
+        return self.set(key, entry, ttl, replace=False)
+
+    def delete(self, key):
+        self.connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def evict(self, con):
+        con.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        total = con.execute("SELECT TOTAL(size) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop least recently used rows until the total fits
+        for key, size in con.execute("SELECT key, size FROM cache ORDER BY accessed").fetchall():
+            con.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+class DiskCache:
+    """diskcache.Cache, which already evicts by size"""
+
+    def __init__(self, path=os.path.join(data_dir, "cache"), max_bytes=256 * 2**20):
+        import diskcache
+        self.cache = diskcache.Cache(path, size_limit=max_bytes)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, entry, ttl=None):
+        self.cache.set(key, entry, expire=ttl)
+
+    def add(self, key, entry, ttl=None):
+        return self.cache.add(key, entry, expire=ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+class RedisCache:
+    """Any client speaking get / set(nx, px) / delete, eviction is left to
+    the server's maxmemory-policy (allkeys-lru)"""
+
+    def __init__(self, client, prefix='m4:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, entry, ttl=None, nx=False):
+        value = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        px = int(ttl * 1000) if ttl else None
+        return bool(self.client.set(self.prefix + key, value, px=px, nx=nx))
+
+    def add(self, key, entry, ttl=None):
+        return self.set(key, entry, ttl, nx=True)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+class FakeRedis:
+    """The part of the redis client RedisCache uses, kept in memory"""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            item = self.data.get(name)
+            if item is None or (item[1] is not None and item[1] < time.time()):
+                self.data.pop(name, None)
+                return None
+            return item[0]
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        expires = time.time() + (px / 1000 if px else ex) if (px or ex) else None
+        with self.lock:
+            item = self.data.get(name)
+            if nx and item is not None and (item[1] is None or item[1] >= time.time()):
+                return None
+            self.data[name] = (value, expires)
+            return True
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(self.data.pop(name, None) is not None for name in names)
+
+def cache_connect(url=backend_url):
+    if url == 'memory':
+        return MemoryCache()
+    if url == 'sqlite':
+        return SqliteCache()
+    if url == 'diskcache':
+        return DiskCache()
+    if url == 'fakeredis':
+        return RedisCache(FakeRedis())
+    if url.startswith('redis://'):
+        import redis
+        return RedisCache(redis.Redis.from_url(url))
+    raise ValueError("unknown M4_CACHE backend: %s" % url)
+
+backend = cache_connect()
+
+#### memoization ####
+
+# lock entries expire so a crashed worker cannot block a key for long
+lock_ttl = 60
+lock_wait = 0.05
+
+class KeyLock:
+    """threading.Lock that a WeakValueDictionary can hold"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+# per-process locks, so threads of one worker compute a key once; a
+# key's lock is dropped once no thread holds or waits on it
+local_locks = weakref.WeakValueDictionary()
+local_locks_guard = threading.Lock()
+
+def cached(key, compute, ttl=None, beta=1.0):
+    """Return the cached value for key, computing it at most once across
+    threads & workers
+
+    A value may be recomputed a little before it expires, with a chance
+    that grows as expiry nears and with how slow it is to compute
+    (probabilistic early expiration, "XFetch"), so popular keys do not
+    all expire at once. Concurrent misses are serialised by a lock: one
+    caller computes, the others wait for its result. The memory backend
+    hands out the stored object itself, so treat values as read-only.
+
+    Args:
+        key: cache key string
+        compute: function with no arguments that builds the value
+        ttl: seconds the value stays valid, None to keep it until evicted
+        beta: > 1 favours earlier recomputation, 0 turns it off
+    Returns:
+        the value
+    """
+    entry = backend.get(key)
+    if entry is not None:
+        value, delta, expires = entry
+        if expires is None or time.time() - delta * beta * math.log(random.random() or 1e-12) < expires:
+            return value
+
+    with local_locks_guard:
+        lock = local_locks.get(key)
+        if lock is None:
+            lock = local_locks[key] = KeyLock()
+    with lock:
+        # another thread may have filled it while we waited
+        fresh = backend.get(key)
+        if fresh is not None and (entry is None or fresh[2] != entry[2]):
+            return fresh[0]
+
+        deadline = time.time() + lock_ttl
+        while not backend.add('lock:' + key, os.getpid(), lock_ttl):
+            # another worker is computing, serve the stale value if there is one
+            if entry is not None:
+                return entry[0]
+            time.sleep(lock_wait)
+            fresh = backend.get(key)
+            if fresh is not None:
+                return fresh[0]
+            if time.time() > deadline:
+                break
+
+        try:
+            start = time.time()
+            value = compute()
+            delta = time.time() - start
+            backend.set(key, (value, delta, start + ttl if ttl else None), ttl)
+        finally:
+            backend.delete('lock:' + key)
+    return value
+
+def invalidate(key):
+    backend.delete(key)
@@ -0,0 +1,282 @@
+# embedded sqlite store for the ledgers & quote history
+
+# libraries
+import io
+import os
+import hashlib
+import sqlite3
+import threading
+import contextlib
+import contextvars
+import collections
+import pandas as pd
+
+data_dir = os.path.join(os.path.dirname(__file__), "../../data")
+db_path = os.path.join(data_dir, "m4.db")
+
+# ledger directory of the portfolio being worked on (see m4_portfolios);
+# each portfolio keeps its ledgers in its own m4.db and shares the quotes
+# & actions tables of the default one
+ledger_dir_var = contextvars.ContextVar('ledger_dir', default=data_dir)
+state = {'shared': False}
+
+# open connections, one per thread & database: a sqlite connection can't
+# be used from another thread, nor from a worker forked after it opened;
+# each thread keeps the most recently used few, since every connection
+# holds file descriptors & a page cache, and one to a portfolio attaches
+# the shared database as well
+local = threading.local()
+max_connections = int(os.environ.get("M4_DB_CONNECTIONS", 8))
+
+def ledger_dir():
+    return ledger_dir_var.get()
+
+@contextlib.contextmanager
+def portfolio(folder):
+    """Run the fetchers against the ledgers in folder"""
+    token = ledger_dir_var.set(folder)
+    try:
+        yield
+    finally:
+        ledger_dir_var.reset(token)
+
+# table name -> csv file
+ledgers = {
+    'mortgage': 'mortgage.csv',
+    'stocks': 'stocks.csv',
+    'csa': 'csa.csv',
+    'salary': 'salary.csv',
+}
+
+# sha1 & prefix cover the complete lines imported so far, so rows appended
+# to a csv are parsed alone; size & mtime are the file's as last read, so
+# an unchanged file, or a line still being written, is not read again;
+# reloads counts the full imports
+ledger_schema = """
+CREATE TABLE IF NOT EXISTS imports (
+    name TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    reloads INTEGER NOT NULL DEFAULT 0,
+    prefix INTEGER
+);
+"""
+
+# columns added to imports since it was first created
+import_columns = {'size': 'INTEGER', 'mtime': 'INTEGER', 'reloads': 'INTEGER NOT NULL DEFAULT 0',
+                  'prefix': 'INTEGER'}
+
+# tables shared by every portfolio; versions counts the writes to a
+# table that the workers keep a copy of, e.g. actions
+schema = """
+CREATE TABLE IF NOT EXISTS quotes (
+    ticker TEXT NOT NULL,
+    date TEXT NOT NULL,
+    open REAL, high REAL, low REAL, close REAL, adjclose REAL, volume REAL,
+    PRIMARY KEY (ticker, date)
+);
+CREATE TABLE IF NOT EXISTS actions (
+    ticker TEXT NOT NULL,
+    date TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value REAL, ratio REAL, factor REAL,
+    PRIMARY KEY (ticker, kind, date)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+indexes = {
+    'mortgage': ["CREATE INDEX IF NOT EXISTS mortgage_type ON mortgage (type, row)"],
+    'stocks': ["CREATE INDEX IF NOT EXISTS stocks_ticker ON stocks (ticker, type, date)"],
+    'csa': ["CREATE INDEX IF NOT EXISTS csa_type ON csa (type, row)"],
+    'salary': ["CREATE INDEX IF NOT EXISTS salary_date ON salary (date)"],
+}
+
+# `row` keeps the csv order, which the running totals follow; views are
+# temporary, created for each connection, so they can read the shared
+# tables of an attached database (the drops clear older stored views)
+views = """
+DROP VIEW IF EXISTS mortgage_running;
+DROP VIEW IF EXISTS csa_periods;
+DROP VIEW IF EXISTS stock_positions;
+DROP VIEW IF EXISTS stocks_adjusted;
+
+CREATE TEMP VIEW IF NOT EXISTS mortgage_running AS
+SELECT m.*,
+    SUM(principal) OVER (ORDER BY row) AS prin_sum,
+    SUM(interest) OVER (ORDER BY row) AS int_sum
+FROM mortgage m;
+
+CREATE TEMP VIEW IF NOT EXISTS csa_periods AS
+SELECT p.*,
+    SUM(acb) OVER (PARTITION BY period ORDER BY row) AS total_acb,
+    SUM(shares) OVER (PARTITION BY period ORDER BY row) AS total_shares
+FROM (SELECT c.*, SUM(type = 'sell') OVER (ORDER BY row) AS period FROM csa c) p;
+
+-- shares & prices in today's units, see m4_actions
+CREATE TEMP VIEW IF NOT EXISTS stocks_adjusted AS
+SELECT row, date, ticker, type, total, number * factor AS number, price / factor AS price
+FROM (SELECT s.*,
+        COALESCE((SELECT a.factor FROM actions a
+                  WHERE a.ticker = s.ticker AND a.kind = 'split' AND a.date > s.date
+                  ORDER BY a.date LIMIT 1), 1) AS factor
+      FROM stocks s);
+
+CREATE TEMP VIEW IF NOT EXISTS stock_positions AS
+SELECT ticker,
+    MIN(CASE WHEN type = 'buy' THEN date END) AS buy_date,
+    MIN(CASE WHEN type = 'buy' THEN price END) AS buy_price,
+    TOTAL(CASE WHEN type = 'buy' THEN number END) AS buy_shares,
+    TOTAL(CASE WHEN type = 'buy' THEN total END) AS book_value,
+    TOTAL(CASE WHEN type = 'dividend' THEN number END) AS div_shares,
+    TOTAL(CASE WHEN type = 'dividend' THEN total END) AS div_total,
+    TOTAL(CASE WHEN type = 'sell' THEN ABS(number) END) AS sell_shares,
+    TOTAL(CASE WHEN type = 'sell' THEN ABS(total) END) AS sell_total
+FROM stocks_adjusted
+GROUP BY ticker;
+"""
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def db_import(con):
+    """Load each ledger csv into its table: lines appended since the last
+    import are parsed & inserted alone, any other change reloads the file
+
+    Args:
+        con: sqlite connection
+    Returns:
+        dict of table name -> 'append' or 'reload', for the tables changed
+    """
+    changed = {}
+    for name, file in ledgers.items():
+        path = os.path.join(ledger_dir(), file)
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        # size held the prefix before the file's size was kept apart
+        seen = con.execute("SELECT sha1, rows, COALESCE(prefix, size), size, mtime FROM imports WHERE name = ?",
+                           (name,)).fetchone()
+        if seen and (seen[3], seen[4]) == (stat.st_size, stat.st_mtime_ns):
+            continue
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        # a line still being written is picked up once it is complete
+        end = data.rfind(b'\n') + 1
+        sha1 = hashlib.sha1(data[:end]).hexdigest()
+        if seen and seen[0] == sha1:
+            con.execute("UPDATE imports SET prefix = ?, size = ?, mtime = ? WHERE name = ?",
+                        (end, stat.st_size, stat.st_mtime_ns, name))
+            con.commit()
+            continue
+
+        if seen and seen[2] and seen[2] <= end and hashlib.sha1(data[:seen[2]]).hexdigest() == seen[0]:
+            # earlier lines unchanged, parse the new ones under the header
+            header = data[:data.index(b'\n') + 1]
+            df = pd.read_csv(io.BytesIO(header + data[seen[2]:end]))
+            df.index += seen[1]
+            columns = ', '.join('"%s"' % column for column in ['row'] + list(df.columns))
+            with con:
+                # another worker may have imported the same lines meanwhile
+                con.execute("BEGIN IMMEDIATE")
+                if con.execute("SELECT sha1 FROM imports WHERE name = ?", (name,)).fetchone()[0] == seen[0]:
+                    con.executemany("INSERT INTO %s (%s) VALUES (%s)" % (name, columns, ', '.join('?' * (len(df.columns) + 1))),
+                                    df.to_records(index=True).tolist())
+                    con.execute("UPDATE imports SET sha1 = ?, rows = ?, prefix = ?, size = ?, mtime = ? WHERE name = ?",
+                                (sha1, seen[1] + len(df), end, stat.st_size, stat.st_mtime_ns, name))
+                    changed[name] = 'append'
+            continue
+
+        df = pd.read_csv(io.BytesIO(data[:end]))
+        with con:
+            df.to_sql(name, con, if_exists='replace', index=True, index_label='row')
+            for sql in indexes[name]:
+                con.execute(sql)
+            con.execute("INSERT OR REPLACE INTO imports (name, sha1, rows, prefix, size, mtime, reloads) "
+                        "VALUES (?, ?, ?, ?, ?, ?, COALESCE((SELECT reloads FROM imports WHERE name = ?), 0) + 1)",
+                        (name, sha1, len(df), end, stat.st_size, stat.st_mtime_ns, name))
+        changed[name] = 'reload'
+
+    return changed
+
+def imports_migrate(con):
+    columns = {row[1] for row in con.execute("PRAGMA table_info(imports)")}
+    for column, kind in import_columns.items():
+        if column not in columns:
+            con.execute("ALTER TABLE imports ADD COLUMN %s %s" % (column, kind))
+
+def portfolio_db():
+    folder = ledger_dir()
+    return db_path if folder == data_dir else os.path.join(folder, "m4.db")
+
+def db_connect(path=None):
+    """Open a new connection to the current portfolio's database, loading
+    changed csvs; connection() keeps one open instead
+
+    Args:
+        path: database file, defaults to the portfolio's m4.db
+    """
+    path = path or portfolio_db()
+    if not state['shared']:
+        shared = sqlite3.connect(db_path)
+        shared.executescript(schema)
+        shared.close()
+        state['shared'] = True
+
+    con = sqlite3.connect(path)
+    if os.path.abspath(path) != os.path.abspath(db_path):
+        # unqualified quotes & actions resolve to the attached tables
+        con.execute("ATTACH DATABASE ? AS shared", (db_path,))
+    con.executescript(ledger_schema)
+    imports_migrate(con)
+    db_import(con)
+    con.executescript(views)
+    return con
+
+def connection():
+    """This thread's connection to the current portfolio's database, after
+    loading the csvs changed since its last use"""
+    if getattr(local, 'pid', None) != os.getpid():
+        local.pid = os.getpid()
+        local.connections = collections.OrderedDict()
+    path = portfolio_db()
+    con = local.connections.get(path)
+    if con is None:
+        con = local.connections[path] = db_connect(path)
+        while len(local.connections) > max(max_connections, 1):
+            # least recently used first
+            local.connections.popitem(last=False)[1].close()
+    else:
+        local.connections.move_to_end(path)
+        if db_import(con):
+            # reloaded tables are created anew, their views with them
+            con.executescript(views)
+    return con
+
+def query(sql, params=(), **kwargs):
+    """Run a query and return a dataframe"""
+    return pd.read_sql_query(sql, connection(), params=params, **kwargs)
+
+# quote history
+
+def quotes_save(ticker, quote):
+    rows = quote[['open', 'high', 'low', 'close', 'adjclose', 'volume']].copy()
+    rows.insert(0, 'date', pd.to_datetime(quote.index).strftime('%Y-%m-%d'))
+    rows.insert(0, 'ticker', ticker)
+    con = connection()
+    with con:
+        con.executemany("INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows.to_records(index=False).tolist())
+
+def quotes_load(ticker, start_date=None):
+    quote = query("SELECT * FROM quotes WHERE ticker = ? AND date >= ? ORDER BY date",
+                  (ticker, str(start_date or '')), index_col='date', parse_dates=['date'])
+    quote.index.name = None
+    return quote
@@ -0,0 +1,309 @@
+# append-only event log for ledger changes, with derived views & snapshots
+
+# libraries
+import os
+import json
+import fcntl
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+data_dir = os.path.join(os.path.dirname(__file__), "../../data")
+log_path = os.path.join(data_dir, "events.jsonl")
+snapshot_path = os.path.join(data_dir, "events.snapshot.json")
+
+# events replayed on top of the snapshot before it is rewritten
+snapshot_every = 1000
+
+# event kinds and the fields each one carries, one json object per line:
+# {"seq": 12, "kind": "buy", "date": "2021-04-16", "ticker": "CVE.TO", ...}
+kinds = {
+    'buy': ['ticker', 'number', 'price', 'total'],
+    'dividend': ['ticker', 'number', 'price', 'total'],
+    'sell': ['ticker', 'number', 'price', 'total'],
+    'payment': ['principal', 'interest'],
+    'extra': ['principal', 'interest'],
+    'salary': ['type', 'amount'],
+}
+
+#### derived views ####
+
+# each view keeps the logged events of its kinds that are not in the
+# csvs (seeded events are flagged `csv`): the rows the tables built from
+# those csvs are topped up with, so they grow with those rows as the csvs
+# do. The snapshot holds the views as folded at its seq; a new state
+# takes them as they are and replays only the log written after it, a
+# running one applies just the snapshot's events it has not seen, see
+# load & snapshot_apply
+view_kinds = {
+    'transactions': ('buy', 'dividend', 'sell'),
+    'payments': ('payment', 'extra'),
+    'salaries': ('salary',),
+}
+
+def rows_view(event_kinds):
+    def view(rows, event):
+        if event['kind'] in event_kinds and not event.get('csv'):
+            rows.append(event)
+    return view
+
+views = {name: rows_view(event_kinds) for name, event_kinds in view_kinds.items()}
+
+# extra callbacks, called as fn(event, state) after the views update
+subscribers = []
+
+def subscribe(fn):
+    subscribers.append(fn)
+    return fn
+
+def empty_state():
+    state = {name: [] for name in views}
+    state['seq'] = 0
+    # inode & end of the last complete line read, and the lines read
+    # from that log, so a read only parses new bytes; not snapshotted
+    state['tail'] = {'inode': None, 'offset': 0, 'lines': 0}
+    return state
+
+def apply(state, event):
+    if event['seq'] <= state['seq']:
+        return
+    for name, view in views.items():
+        view(state[name], event)
+    state['seq'] = event['seq']
+    for fn in subscribers:
+        fn(event, state)
+
+#### log & snapshot ####
+
+# the log is written by any gunicorn worker and the command line: an
+# flock on lock_path serializes the writers across processes, the
+# thread lock the threads of one process; only a writer holding both
+# appends or compacts
+lock_path = log_path + '.lock'
+thread_lock = threading.RLock()
+held = {'depth': 0, 'file': None}
+
+@contextlib.contextmanager
+def log_lock():
+    with thread_lock:
+        if not held['depth']:
+            held['file'] = open(lock_path, 'a')
+            fcntl.flock(held['file'], fcntl.LOCK_EX)
+        held['depth'] += 1
+        try:
+            yield
+        finally:
+            held['depth'] -= 1
+            if not held['depth']:
+                # closing the file releases the flock
+                held['file'].close()
+
+def load():
+    """Rebuild the state from the snapshot's views and the events logged
+    after it, which are the only ones replayed
+
+    Returns:
+        the state dict with one entry per derived view
+    """
+    state = empty_state()
+    try:
+        # the log's inode as of before the snapshot is read: a compaction
+        # in between changes it, and read_new catches up through snapshot_apply
+        state['tail']['inode'] = os.stat(log_path).st_ino
+    except FileNotFoundError:
+        pass
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path) as f:
+            snapshot = json.load(f)
+        # the folded views are the state, nothing is replayed through apply
+        state.update({name: snapshot.get(name, []) for name in views}, seq=snapshot['seq'])
+    read_new(state)
+    return state
+
+def snapshot_apply(state):
+    # events the last compaction dropped from the log, newer than the state
+    if not os.path.exists(snapshot_path):
+        return 0
+    with open(snapshot_path) as f:
+        snapshot = json.load(f)
+    events = {event['seq']: event for name in views for event in snapshot.get(name, [])
+              if event['seq'] > state['seq']}
+    for seq in sorted(events):
+        apply(state, events[seq])
+    state['seq'] = max(state['seq'], snapshot['seq'])
+    return len(events)
+
+def read_new(state):
+    """Apply the complete lines appended to the log since the last read
+
+    Args:
+        state: state from load
+    Returns:
+        the number of events applied
+    """
+    tail = state['tail']
+    with thread_lock:
+        try:
+            f = open(log_path, 'rb')
+        except FileNotFoundError:
+            tail.update(inode=None, offset=0, lines=0)
+            return 0
+        with f:
+            applied = 0
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != tail['inode']:
+                # new or compacted log, the snapshot is written first
+                applied += snapshot_apply(state)
+                tail.update(inode=inode, offset=0, lines=0)
+            f.seek(tail['offset'])
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                tail['offset'] += len(line)
+                tail['lines'] += 1
+                event = json.loads(line)
+                if event['seq'] > state['seq']:
+                    apply(state, event)
+                    applied += 1
+        return applied
+
+def catch_up(state):
+    """Apply events appended to the log since the last call, and compact
+    the log once it holds snapshot_every events
+
+    Args:
+        state: state from load
+    Returns:
+        the number of events applied
+    """
+    applied = read_new(state)
+    if state['tail']['lines'] >= snapshot_every:
+        applied += compact(state)
+    return applied
+
+def append(state, kind, date, **fields):
+    """Write one event to the log and apply it
+
+    Args:
+        state: state from load
+        kind: a key of `kinds`
+        date: event date as YYYY-MM-DD
+        fields: the fields listed in `kinds`
+    Returns:
+        the event dict
+    """
+    return append_many(state, [(kind, date, fields)])[0]
+
+def append_many(state, rows):
+    """Write events in one synced write and apply them
+
+    Args:
+        state: state from load
+        rows: list of (kind, date, fields dict)
+    Returns:
+        the event dicts
+    Raises:
+        ValueError: for a kind that is not in `kinds`
+    """
+    unknown = sorted({kind for kind, date, fields in rows} - set(kinds))
+    if unknown:
+        raise ValueError('unknown event kinds: %s' % ', '.join(unknown))
+
+    with log_lock():
+        # the last seq is the log's, read under the lock, not this
+        # process's, which another writer may have moved past
+        read_new(state)
+        events = []
+        for seq, (kind, date, fields) in enumerate(rows, state['seq'] + 1):
+            event = {'seq': seq, 'kind': kind, 'date': str(date)[0:10]}
+            event.update({k: fields[k] for k in kinds[kind]})
+            if fields.get('csv'):
+                event['csv'] = True
+            events.append(event)
+        lines = ''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in events)
+
+        with open(log_path, 'ab') as f:
+            # drop the partial line of a writer that died mid-write
+            if f.tell() > state['tail']['offset']:
+                f.truncate(state['tail']['offset'])
+            f.write(lines.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        catch_up(state)
+    return events
+
+def write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def compact(state):
+    """Snapshot the state and empty the log, when it still holds
+    snapshot_every events once the lock is held
+
+    Returns:
+        the number of events applied while catching up under the lock
+    """
+    with log_lock():
+        applied = read_new(state)
+        if state['tail']['lines'] < snapshot_every:
+            # another writer compacted first
+            return applied
+        write_atomic(snapshot_path, json.dumps({k: v for k, v in state.items() if k != 'tail'}))
+        write_atomic(log_path, '')
+        state['tail'].update(inode=os.stat(log_path).st_ino, offset=0, lines=0)
+    return applied
+
+#### seeding from the csv ledgers ####
+
+def seed(state, mt, st, sal):
+    """Write the existing ledger rows as events, for an empty log
+
+    Seeded events are flagged `csv` so they are not added to the views
+    a second time. Rows of a type that is not an event kind are skipped
+    with a warning.
+
+    Args:
+        state: state from load
+        mt, st, sal: dataframes from mt_fetch, st_fetch and sal_fetch
+    Returns:
+        the number of events written
+    """
+    rows = []
+    for row in mt.itertuples(index=False):
+        rows.append((row.type, str(row.date)[0:10],
+                     {'principal': float(row.principal), 'interest': float(row.interest), 'csv': True}))
+    for row in st.itertuples(index=False):
+        rows.append((row.type, str(row.date)[0:10],
+                     {'ticker': row.ticker, 'number': float(row.number),
+                      'price': float(row.price), 'total': float(row.total), 'csv': True}))
+    for row in sal.itertuples(index=False):
+        rows.append(('salary', str(row.date)[0:10],
+                     {'type': row.type, 'amount': float(row.amount), 'csv': True}))
+
+    skipped = [row for row in rows if row[0] not in kinds]
+    if skipped:
+        logger.warning('not seeding %d ledger rows of unknown types: %s', len(skipped),
+                       ', '.join(sorted({str(row[0]) for row in skipped})))
+    rows = [row for row in rows if row[0] in kinds]
+    rows.sort(key=lambda r: r[1])
+
+    # the workers start together, the first one seeds
+    with log_lock():
+        read_new(state)
+        if state['seq']:
+            return 0
+        return len(append_many(state, rows))
+
+if __name__ == '__main__':
+    # append an event from the command line, e.g.
+    # python m4_events.py buy 2021-04-20 ticker=CVE.TO number=10 price=8.5 total=85
+    import sys
+    fields = dict(arg.split('=', 1) for arg in sys.argv[3:])
+    fields = {k: v if k in ('ticker', 'type') else float(v) for k, v in fields.items()}
+    print(append(load(), sys.argv[1], sys.argv[2], **fields))
@@ -0,0 +1,222 @@
+# static export of the M4 tabs to html & json, for any static file server
+#
+#   python m4_export.py [outdir] [--force] [--processes N]
+#
+# each tab is written to <tab>.html (figures & tables) and <tab>.json
+# (typed-array figures & table records); manifest.json keeps the hash of
+# the inputs each tab was built from, so a run only rewrites the tabs
+# whose csvs, quotes, ledger events or code changed
+
+# libraries
+import os
+import glob
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import m4_actions
+import m4_db
+import m4_events
+import m4_figures
+import m4_functions
+import m4_fx
+import m4_lazy
+import m4_ledger
+import m4_lots
+import m4_salary
+import m4_wire
+
+pio = m4_lazy.lazy_import('plotly.io')
+
+export_dir = os.path.join(os.path.dirname(__file__), "../../export")
+code_files = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "m4_*.py")))
+
+titles = {
+    'investments': 'Investments',
+    'mortgage': 'Mortgage',
+    'csa': 'CSA',
+    'salary': 'Salary',
+}
+
+#### input hashes ####
+
+def frame_hash(df):
+    return hashlib.sha1(pd.util.hash_pandas_object(df).values.tobytes()).hexdigest()
+
+def file_hash(path):
+    return m4_db.file_hash(path) if os.path.exists(path) else None
+
+def tab_hashes():
+    """Hash the inputs of each tab, without running the fetchers
+
+    Returns:
+        dict of tab -> sha1 of its csv, quotes, events & code
+    """
+    code = [file_hash(path) for path in code_files]
+    ledger = {name: file_hash(os.path.join(m4_db.data_dir, file)) for name, file in m4_db.ledgers.items()}
+    # ledger events seeded from the csvs are covered by the csv hashes
+    events = m4_events.load()
+
+    tickers = m4_db.query("SELECT DISTINCT ticker FROM stocks ORDER BY ticker")['ticker']
+    quotes = {ticker: frame_hash(m4_functions.quote_fetch(ticker)) for ticker in tickers}
+    quotes['CVE.TO'] = frame_hash(m4_functions.quote_cached('CVE.TO'))
+    fx = [frame_hash(m4_fx.fx_history(currency).to_frame())
+          for currency in sorted(set(m4_fx.currencies(tickers).values()) - {m4_fx.base})]
+
+    inputs = {
+        'investments': [ledger['stocks'], events['transactions'], sorted(quotes.items()), frame_hash(m4_actions.actions_load()), fx],
+        'mortgage': [ledger['mortgage'], events['payments']],
+        'csa': [ledger['csa'], quotes['CVE.TO']],
+        'salary': [ledger['salary'], events['salaries'], file_hash(m4_salary.cpi_path), pd.Timestamp.today().strftime('%Y-%m')],
+    }
+    return {tab: hashlib.sha1(json.dumps([code, value]).encode()).hexdigest()
+            for tab, value in inputs.items()}
+
+#### tab contents ####
+
+# the tables the tabs are drawn from, read once per export; forked pool
+# workers inherit them, spawned ones read them again
+tables = {}
+
+def tables_load():
+    if not tables:
+        ledger = m4_events.load()
+        mt, mt_summary = m4_ledger.mortgage_fetch(ledger)
+        mt_terms, mc, mc_summary = m4_ledger.mortgage_simulation(mt)
+        csa, csa_sell = m4_functions.csa_fetch()
+        sal = m4_ledger.salary_fetch(ledger)
+        tables.update(m4_ledger.stocks_fetch(ledger))
+        tables.update(mt=mt, mt_summary=mt_summary, mt_terms=mt_terms, mc=mc, mc_summary=mc_summary,
+                      csa=csa, csa_sell=csa_sell, sal=sal, sal_stats=m4_salary.sal_fetch_analytics(sal))
+    return tables
+
+# each returns the tab's sections as (heading, figures dict, tables dict)
+def tab_sections(tab):
+    t = tables_load()
+
+    if tab == 'investments':
+        risk = t['risk']
+        prices = {'price-' + ticker: m4_figures.price_figure(ticker, t['st_summary']) for ticker in t['tickers']}
+        return [
+            ('Summary as of ' + str(t['current_date'])[0:10], {}, {'st-summary': t['st_summary']}),
+            ('Gains (ACB & FIFO)', {}, {'st-gains': m4_lots.gains_table(t['lots'], t['prices'])}),
+            ('Risk', {'st-risk': m4_figures.risk_figure(risk)},
+             {'st-risk': risk['summary'][risk['summary']['ticker'] == 'portfolio']}),
+            ('Portfolio value', {'st-value': m4_figures.value_figure(t['holdings'])}, {}),
+            ('Stock history', prices, {}),
+            ('Transactions', {}, {'st': t['st']}),
+        ]
+    if tab == 'mortgage':
+        whatif, whatif_summary = m4_figures.whatif_figure(
+            t['mt_terms']['balance'], round(t['mt_terms']['rate'] * 100, 2), 25, 0,
+            ["monthly", "accelerated biweekly"])
+        return [
+            ('Summary stats', {}, {'mt-summary': t['mt_summary']}),
+            ('Balance', {'mt-balance': m4_figures.mt_balance_figure(t['mt'])}, {}),
+            ('Principal & Interest', {'mt-interest': m4_figures.mt_interest_figure(t['mt'])}, {}),
+            ('What-if schedules', {'whatif': whatif}, {'whatif': whatif_summary}),
+            ('Payoff projection', {'mt-payoff': m4_figures.mt_payoff_figure(t['mc'])}, {'mc-summary': t['mc_summary']}),
+            ('Transactions', {}, {'mt': t['mt']}),
+        ]
+    if tab == 'csa':
+        return [
+            ('CSA history', {'csa': m4_figures.csa_figure(t['csa'], t['csa_sell'])}, {}),
+            ('Summary stats', {}, {'csa-sell': t['csa_sell']}),
+            ('Transactions', {}, {'csa': t['csa']}),
+        ]
+    if tab == 'salary':
+        return [
+            ('Salary history', {'sal': m4_figures.sal_figure(t['sal'])}, {}),
+            ('Summary stats', {}, {'sal-summary': t['sal_stats']['summary']}),
+            ('Nominal & real salary', {'sal-real': m4_figures.sal_real_figure(t['sal_stats'])}, {}),
+            ('Cumulative earnings', {'sal-cumulative': m4_figures.sal_cumulative_figure(t['sal_stats'])},
+             {'sal-annual': t['sal_stats']['annual']}),
+            ('Transactions', {}, {'sal': t['sal']}),
+        ]
+    raise ValueError(tab)
+
+def page(title, body):
+    return ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+            '<title>%s</title>\n<script src="plotly.min.js"></script>\n</head>\n'
+            '<body style="font-family: Arial">\n%s\n</body>\n</html>\n' % (title, body))
+
+def export_tab(tab, outdir):
+    """Write <tab>.html and <tab>.json
+
+    Runs in a pool worker: forked workers inherit the loaded tables,
+    spawned ones load them (and run the fetchers) themselves.
+
+    Returns:
+        the tab and the files written
+    """
+    from plotly.utils import PlotlyJSONEncoder
+
+    html = ['<p><a href="index.html">M4</a></p>', '<h2>%s</h2>' % titles[tab]]
+    bundle = {'figures': {}, 'tables': {}}
+    for heading, figures, tables in tab_sections(tab):
+        html.append('<h3 style="text-align: center; color: #2fa4e7">%s</h3>' % heading)
+        for name, df in tables.items():
+            html.append(df.to_html(index=False, border=0))
+            bundle['tables'][name] = df.to_dict('records')
+        for name, fig in figures.items():
+            html.append(pio.to_html(fig, full_html=False, include_plotlyjs=False, div_id=name))
+            bundle['figures'][name] = m4_wire.encode_figure(fig)
+
+    m4_events.write_atomic(os.path.join(outdir, tab + '.html'), page(titles[tab], '\n'.join(html)))
+    m4_events.write_atomic(os.path.join(outdir, tab + '.json'), json.dumps(bundle, cls=PlotlyJSONEncoder))
+    return tab, [tab + '.html', tab + '.json']
+
+#### export ####
+
+def export(outdir=export_dir, force=False, processes=None):
+    """Regenerate the tabs whose inputs changed
+
+    Args:
+        outdir: bundle directory
+        force: rewrite every tab
+        processes: pool size, None for one per core
+    Returns:
+        the names of the tabs that were written
+    """
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    hashes = tab_hashes()
+    stale = [tab for tab in titles
+             if force or manifest.get(tab, {}).get('hash') != hashes[tab]
+             or not all(os.path.exists(os.path.join(outdir, file)) for file in manifest[tab]['files'])]
+    if not stale:
+        return []
+
+    # fetchers run once here; forked workers share the loaded data
+    tables_load()
+    if not os.path.exists(os.path.join(outdir, 'plotly.min.js')):
+        from plotly.offline import get_plotlyjs
+        m4_events.write_atomic(os.path.join(outdir, 'plotly.min.js'), get_plotlyjs())
+
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(export_tab, stale, [outdir] * len(stale)))
+
+    for tab, files in results:
+        manifest[tab] = {'hash': hashes[tab], 'files': files}
+    links = ''.join('<li><a href="%s.html">%s</a> (<a href="%s.json">json</a>)</li>\n' % (tab, title, tab)
+                    for tab, title in titles.items())
+    m4_events.write_atomic(os.path.join(outdir, 'index.html'),
+                           page("Marc's Money-Making Machine", '<ul>\n%s</ul>' % links))
+    m4_events.write_atomic(manifest_path, json.dumps(manifest, indent=1))
+    return stale
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outdir', nargs='?', default=export_dir)
+    parser.add_argument('--force', action='store_true', help='rewrite every tab')
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+
+    written = export(args.outdir, args.force, args.processes)
+    print('wrote ' + ', '.join(written) if written else 'up to date')
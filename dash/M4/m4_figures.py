@@ -0,0 +1,201 @@
+# figures of the M4 tabs, each drawn from the tables passed in, so the
+# app (which caches them until its tables change) and the static export
+# (which draws them once) build the same figures
+
+# libraries
+import m4_amortization
+import m4_functions
+import m4_fx
+import m4_lazy
+import m4_montecarlo
+import m4_risk
+import m4_theme
+
+px = m4_lazy.lazy_import('plotly.express')
+go = m4_lazy.lazy_import('plotly.graph_objects')
+
+#### mortgage ####
+
+def mt_balance_figure(mt):
+    fig = px.scatter(mt, x="date", y="balance", color="type", size="principal")
+    fig.update_traces(hovertemplate = 'Date: %{x}<br>Balance: %{y:$,.0f}<br>Principal: %{marker.size:$,.2f}')
+    return m4_functions.time_of_day(fig)
+
+def mt_interest_figure(mt):
+    fig = px.scatter(mt, x="date", y=["prin_total", "int_total"])
+    fig.update_layout(hovermode='x')
+    return m4_functions.time_of_day(fig)
+
+def mt_payoff_figure(mc, years=m4_montecarlo.default_years):
+    fig = px.histogram(mc, x="payoff_date", nbins=60)
+    fig.update_traces(hovertemplate = 'Payoff: %{x}<br>Scenarios: %{y}')
+    unpaid = mc['payoff_date'].isna().mean()
+    if unpaid:
+        fig.update_layout(title='%.1f%% of scenarios not paid off within %d years' % (unpaid * 100, years))
+    return m4_functions.time_of_day(fig)
+
+def whatif_figure(balance, rate, years, prepayment, frequencies):
+    """Balance of the schedules of each frequency, with and without the
+    annual prepayment
+
+    Returns:
+        the figure and the summary table
+    """
+    frequencies = frequencies or ['monthly']
+    prepayments = sorted({0, prepayment or 0})
+    schedule, summary = m4_amortization.amortize_batch(
+        balance,
+        max(rate or 0, 0) / 100,
+        int(years or 25),
+        [f for f in frequencies for p in prepayments],
+        [p for f in frequencies for p in prepayments],
+    )
+    summary.insert(0, 'label', summary['frequency'] + ' +' + summary['annual prepayment'].map("{:,.0f}".format))
+    schedule = schedule.merge(summary[['scenario', 'label']], on='scenario')
+
+    fig = px.line(schedule, x="years", y="balance", color="label")
+    fig.update_traces(hovertemplate = 'Year: %{x:.1f}<br>Balance: %{y:$,.0f}')
+    fig = m4_functions.time_of_day(fig)
+
+    return fig, summary.drop(columns=['scenario', 'frequency'])
+
+#### csa & salary ####
+
+def csa_figure(csa, csa_sell):
+    fig = px.line(csa, x="date", y="price")
+    fig.add_trace(go.Scatter(x=csa_sell.date, y=csa_sell.price,
+                                    name = "sell price", mode="markers", marker_size = 10,
+                                    marker_color='rgba(200, 40, 0, .8)',
+                                    marker_line_width=2,
+                                    showlegend=False))
+    return m4_functions.time_of_day(fig)
+
+def sal_figure(sal):
+    fig = px.line(sal, x="date", y="amount", color="type")
+    fig.add_trace(go.Scatter(x=sal.date, y=sal.amount,
+                                    name = 'amount', mode="markers", marker_size = 12,
+                                    marker_line_width=3))
+    fig.update_traces(hovertemplate = 'Date: %{x}<br>Amount: %{y:$,.0f}')
+    return m4_functions.time_of_day(fig)
+
+def sal_real_figure(sal_stats):
+    monthly = sal_stats['monthly']
+    columns = [c for c in ['rate', 'real_rate'] if c in monthly]
+    fig = px.line(monthly.reset_index(), x="date", y=columns, line_shape='hv')
+    fig.update_traces(hovertemplate = 'Date: %{x}<br>Salary: %{y:$,.0f}')
+    fig.update_layout(hovermode='x')
+    return m4_functions.time_of_day(fig)
+
+def sal_cumulative_figure(sal_stats):
+    monthly = sal_stats['monthly']
+    columns = [c for c in ['cumulative', 'real_cumulative'] if c in monthly]
+    fig = px.area(monthly.reset_index(), x="date", y=columns)
+    fig.update_traces(hovertemplate = 'Date: %{x}<br>Earned: %{y:$,.0f}')
+    fig.update_layout(hovermode='x')
+    return m4_functions.time_of_day(fig)
+
+#### investments ####
+
+def risk_figure(risk):
+    # weekly points are plenty for a three-month window
+    rolling = risk['rolling'].resample('W').last().reset_index().rename(columns={'index': 'date'})
+    fig = px.line(rolling, x="date", y=list(risk['rolling'].columns))
+    fig.update_traces(hovertemplate = 'Date: %{x}<br>Volatility: %{y:.1f}%')
+    fig.update_traces(line_width=3, selector=dict(name='portfolio'))
+    fig.update_layout(hovermode='x', yaxis_title='%d-day volatility (%%)' % m4_risk.rolling_days)
+    return m4_functions.time_of_day(fig)
+
+def value_figure(holdings):
+    # each day's value at that day's rate to the base currency
+    currencies = m4_fx.currencies(holdings['ticker'].unique())
+    holdings = holdings.assign(value=m4_fx.to_base(holdings['value'], holdings['ticker'].map(currencies).values,
+                                                   holdings['date']).round(2))
+    fig = px.area(holdings, x="date", y="value", color="ticker")
+    fig.update_traces(hovertemplate = 'Date: %{x}<br>Value: %{y:$,.0f}')
+    fig.update_layout(hovermode='x')
+    return m4_functions.time_of_day(fig)
+
+def price_figure(ticker, st_summary, live=False):
+    """Close & moving averages of one holding, with its purchase price
+
+    Args:
+        ticker: stock ticker symbol
+        st_summary: summary table holding the ticker's buy date & price
+        live: add an empty trace the browser extends with streamed ticks
+    """
+    quote = m4_functions.quote_fetch(ticker).copy()
+    quote['date'] = quote.index
+    quote.index.name = None
+    quote['SMA_50'] = quote['close'].rolling(window=50).mean()
+    quote['SMA_200'] = quote['close'].rolling(window=200).mean()
+
+    # Marc's purchase date & cost
+    quote_date = st_summary.loc[st_summary['ticker'] == ticker]['buy_date'].iloc[0]
+    quote_cost = float(st_summary.loc[st_summary['ticker'] == ticker]['buy_price'])
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=quote['date'], y=quote['close'],
+                        mode='lines',
+                        name='close',
+                        line = dict(color='black', width=2)
+                        ))
+    fig.add_trace(go.Scatter(x=quote['date'], y=quote['SMA_50'],
+                        mode='lines',
+                        name='50-day SMA',
+                        line = dict(color='LightSeaGreen', width=2)
+                        ))
+    fig.add_trace(go.Scatter(x=quote['date'], y=quote['SMA_200'],
+                        mode='lines',
+                        name='200-day SMA',
+                        line = dict(color='SeaGreen', width=2),
+
+                        ))
+    if live:
+        # extended in the browser with streamed ticks
+        fig.add_trace(go.Scatter(x=[], y=[],
+                            mode='lines',
+                            name='live',
+                            line = dict(color='RoyalBlue', width=2)
+                            ))
+
+    fig.add_shape(
+            # Line Horizontal
+                type="line",
+                x0=quote_date,
+                y0=quote_cost,
+                x1=quote['date'].max(),
+                y1=quote_cost,
+                line=dict(color="firebrick", width=2, dash = 'dot',
+                ),
+        )
+
+    # update layout
+
+    fig.update_layout(
+        autosize=True,
+        # width=800,
+        height=650,
+        legend_orientation="h",
+        showlegend=False,
+        hovermode="x unified",
+        template=m4_theme.template(),
+        )
+
+    # render slider
+    fig.update_xaxes(
+        range=[quote_date, quote['date'].max()],
+        rangeslider_visible=True,
+        rangeselector=dict(
+            buttons=list([
+                dict(count=1, label="1m", step="month", stepmode="backward"),
+                dict(count=6, label="6m", step="month", stepmode="backward"),
+                dict(count=1, label="YTD", step="year", stepmode="todate"),
+                dict(count=1, label="1y", step="year", stepmode="backward"),
+                dict(count=2, label="2y", step="year", stepmode="backward"),
+                dict(count=5, label="5y", step="year", stepmode="backward"),
+                dict(step="all")
+            ])
+        )
+    )
+
+    return fig
@@ -1,15 +1,25 @@
 # helper functions for the mortgage tabs
 
 # libraries
-import os
-import time
 import pandas as pd
 import numpy as np
 import dash_table
+import dash_core_components as dcc
+import m4_actions
+import m4_cache
+import m4_db
+import m4_fx
+import m4_jobs
+import m4_lazy
 import m4_parameters
-import yahoo_fin.stock_info as si
+import m4_risk
+import m4_theme
+import m4_wire
 from datetime import datetime
 
+# yahoo_fin brings in requests & requests_html, only needed on a cache miss
+si = m4_lazy.lazy_import('yahoo_fin.stock_info')
+
 # mortgage dataframe 
 
 def custom_date_parser(date):
@@ -17,25 +27,31 @@ def custom_date_parser(date):
 
 def mt_fetch():
 
-    mt = pd.read_csv(
-    os.path.join(os.path.dirname(__file__), "../../data/mortgage.csv"),
-    parse_dates=True,
-    date_parser=custom_date_parser,
-    )       
+    # running sums come from the mortgage_running view
+    mt = m4_db.query("SELECT * FROM mortgage_running ORDER BY row", index_col='row')
+    mt.index.name = None
+    prin_sum = mt.pop('prin_sum')
+    int_sum = mt.pop('int_sum')
+
+    mt = mt_metrics(mt, prin_sum, int_sum)
+    return mt, mt_summarize(mt)
 
+def mt_metrics(mt, prin_sum, int_sum):
     # row-based metrics
     # principal percentage and cumsum
     mt['prin%'] = np.where(mt['type'] == 'payment', (mt['principal'] / (mt['principal'] + mt['interest'])*100), np.nan).round(2)
-    mt['prin_total'] = round(mt['principal'].cumsum(),2)
+    mt['prin_total'] = round(prin_sum,2)
 
     # interest percentage and cumsum
     mt['int%'] =np.where(mt['type'] == 'payment', (mt['interest'] / (mt['principal'] + mt['interest'])* 100), np.nan).round(2) 
-    mt['int_total'] = round(mt['interest'].cumsum(),2)
+    mt['int_total'] = round(int_sum,2)
 
     # running balance
     mt['balance'] = round(m4_parameters.mt_balance - mt['prin_total'], 2)
-    mt['balance2'] = mt['balance'].map("{:,}".format)
+    # thousands separators are added when the table renders, see table_setup
+    return mt
 
+def mt_summarize(mt):
     # summary dataframe
     col_names =  ['total payments', 'total extra', 'total principal',
                   'principal %', 'total interest', 'interest %', 
@@ -54,107 +70,241 @@ def mt_fetch():
     #mt_summary = mt_summary.head().style.format("{:,.0f}")
     #mt_summary = mt_summary.style.format('{:,}')
 
-    return mt, mt_summary
+    return mt_summary
+
+def mt_append(mt, rows):
+    """Mortgage table with ledger rows appended, the running totals
+    carried on from its last row
+
+    Args:
+        mt: table from mt_fetch
+        rows: new mortgage.csv rows
+    Returns:
+        the mortgage table and its summary
+    """
+    rows = rows.copy()
+    prin_sum = mt['prin_total'].iloc[-1] + rows['principal'].cumsum()
+    int_sum = mt['int_total'].iloc[-1] + rows['interest'].cumsum()
+    mt = mt.append(mt_metrics(rows, prin_sum, int_sum))
+    return mt, mt_summarize(mt)
+
+# quote history cache, filled by st_fetch so the holdings table
+# can reuse the downloaded histories instead of fetching them again
+quotes = {}
+
+# seconds a downloaded history is reused by every worker
+quote_ttl = 15 * 60
+
+def quote_download(ticker):
+    quote = si.get_data(ticker)
+    m4_db.quotes_save(ticker, quote)
+    return quote
+
+def quote_cached(ticker):
+    return m4_cache.cached('quote:' + ticker, lambda: quote_download(ticker), quote_ttl)
+
+def quote_fetch(ticker):
+    quotes[ticker] = quote_cached(ticker)
+    return quotes[ticker]
 
 # stock dataframe
 
+def positions_fetch():
+    # per-ticker book & dividend totals from the stock_positions view
+    positions = m4_db.query("SELECT * FROM stock_positions", index_col='ticker')
+    positions['buy_date'] = pd.to_datetime(positions['buy_date'])
+    return positions
+
+def positions_table(st):
+    """positions_fetch for a ledger in memory, e.g. with logged events
+    that are not in stocks.csv
+
+    Args:
+        st: stock ledger
+    Returns:
+        the stock_positions columns, indexed by ticker
+    """
+    st = m4_actions.adjust_ledger(st)
+    buy, dividend, sell = [st['type'] == kind for kind in ['buy', 'dividend', 'sell']]
+    rows = pd.DataFrame({
+        'ticker': st['ticker'],
+        'buy_date': st['date'].where(buy),
+        'buy_price': st['price'].where(buy),
+        'buy_shares': st['number'].where(buy, 0),
+        'book_value': st['total'].where(buy, 0),
+        'div_shares': st['number'].where(dividend, 0),
+        'div_total': st['total'].where(dividend, 0),
+        'sell_shares': st['number'].abs().where(sell, 0),
+        'sell_total': st['total'].abs().where(sell, 0),
+    })
+    return rows.groupby('ticker').agg({column: 'min' if column in ('buy_date', 'buy_price') else 'sum'
+                                       for column in rows.columns[1:]})
+
+def st_row(ticker, position, current_date, current_price):
+    """Summary row for one holding at a given price
+
+    Args:
+        ticker: stock ticker symbol
+        position: the ticker's row of positions_fetch
+        current_date: date of the price
+        current_price: price rounded to cents
+    Returns:
+        a dict with the st_summary columns
+    """
+    # scalar book results
+    book_value = round(position['book_value'], 2)
+    buy_date = position['buy_date'].date()
+    buy_price = position['buy_price']
+    days_held = (current_date - position['buy_date']) / np.timedelta64(1, 'D')
+
+    # dividend value calculations
+    div_gain = round(position['div_shares'] * current_price + position['div_total'], 2)
+
+    # calculate current value with dividend values, less the shares sold
+    current_value = round((position['buy_shares'] - position['sell_shares']) * current_price + div_gain, 2)
+    shares = position['buy_shares'] + position['div_shares'] - position['sell_shares']
+
+    # return calculations, sale proceeds count towards the gain
+    total_gain = round(current_value + position['sell_total'] - book_value, 2)
+    capital_gain = round(total_gain - div_gain, 2)
+    capital_return = round(capital_gain / book_value * 100, 2)
+    total_return = round(total_gain / book_value * 100, 2) 
+    daily_return = round(total_return / days_held * 100, 2)
+
+    return {'ticker' : ticker, 
+            'buy_date' : buy_date,
+            'buy_price' : buy_price,
+            'current_price': current_price,
+            #'current_date': current_date,
+            'shares': shares,
+            'book_value' : book_value, 
+            'current_value' : current_value,
+            'total_gain' : total_gain,
+            'capital_gain' : capital_gain,
+            'div_gain' : div_gain,
+            'capital_return' : capital_return,
+            'total_return' : total_return,
+            'daily_return' : daily_return}
+
+def st_stream_row(ticker, position, summary, current_date, current_price):
+    """st_row at a streamed price with the other st_summary columns: the
+    base-currency value & gain repriced at today's rate, the rest (e.g.
+    the daily risk measures) carried over from the summary row
+
+    Args:
+        ticker, position, current_date, current_price: as for st_row
+        summary: the ticker's st_summary row
+    Returns:
+        a dict with the st_summary columns
+    """
+    row = dict(summary)
+    row.update(st_row(ticker, position, current_date, current_price))
+    today = [pd.Timestamp.today().normalize()]
+    base_value = round(m4_fx.to_base([row['current_value']], summary['currency'], today)[0], 2)
+    row['base_total_gain'] = round(summary['base_total_gain'] + base_value - summary['base_current_value'], 2)
+    row['base_current_value'] = base_value
+    return row
+
 def st_fetch():
 
-    st = pd.read_csv(
-    os.path.join(os.path.dirname(__file__), "../../data/stocks.csv")) 
+    st = m4_db.query("SELECT * FROM stocks ORDER BY row", index_col='row')
+    st.index.name = None
     st['date'] =  pd.to_datetime(st['date'])
 
     tickers = st['ticker'].unique()
 
+    # splits & dividends first, positions are in post-split units
+    st_actions(tickers)
+    st_summary, current_date = st_summarize(st, positions_fetch())
+    return st, st_summary, tickers, current_date
+
+def st_actions(tickers):
+    # the splits & dividends of each ticker, checked once per actions_ttl
+    for i, ticker in enumerate(tickers):
+        m4_jobs.progress(0.7 * i / len(tickers), 'Fetching ' + ticker)
+        m4_actions.actions_fetch(ticker, quote_fetch(ticker))
+
+def st_summarize(st, positions):
+    """Summary table of the holdings at their latest quotes
+
+    Args:
+        st: stock ledger
+        positions: per-ticker totals of the ledger, from positions_fetch
+            or positions_table
+    Returns:
+        the summary dataframe and the date of the latest quote
+    """
     # results dataframe
     col_names =  ['ticker', 'buy_date', 'shares', 'buy_price', 'current_price',
                     'book_value', 'current_value', 'total_gain', 'capital_gain', 'div_gain',  
                     'capital_return', 'total_return', 'daily_return']
     st_summary = pd.DataFrame(columns = col_names)
 
-    for ticker in tickers:
+    for ticker in st['ticker'].unique():
         # get current data from Yahoo
-        quote = si.get_data(ticker)
+        quote = quote_fetch(ticker)
         current_date = quote.last('1D').index[0]
         current_price = round(quote.last('1D')['close'][0], 2)
-        
-        # book value calculations
-        book = st.loc[np.where((st['ticker'] == ticker) & (st['type'] == "buy"))]
-        book['current_date'] = current_date
-        book['current_price'] = current_price
-        book['days_held'] = book['current_date'] - book['date']
-        book['years_held'] = round(book['days_held'] / np.timedelta64(1, 'Y'), 2)
-        book['current_value'] = book['current_price'] * book['number']
-        book['gain'] = (book['current_value'] - book['total'])
-
-        # scalar book results
-        book_value = round(book['total'].sum(), 2)
-        buy_date = book['date'].iloc[0].date()
-        buy_price = book['price'].min()
-        years_held = book['years_held'].max()
-        days_held = book['days_held'].max() / np.timedelta64(1, 'D')
-        
-        # dividend value calculations
-        div = st.loc[np.where((st['ticker'] == ticker) & (st['type'] == "dividend"))]
-        div['current_price'] = current_price
-        div['gain'] = div['number'] * div['current_price'] + div['total']
-        div_gain = round(div['gain'].sum(), 2)
-
-        # calculate current value with dividend values
-        current_value = round(book['current_value'].sum() + div_gain, 2)
-        shares = book['number'].sum() + div['number'].sum()
-
-        # return calculations
-        total_gain = round(current_value - book_value, 2)
-        capital_gain = round(total_gain - div_gain, 2)
-        capital_return = round(capital_gain / book_value * 100, 2)
-        total_return = round(total_gain / book_value * 100, 2) 
-        daily_return = round(total_return / days_held * 100, 2)
 
         # add to results dataframe
-        new_row = {'ticker' : ticker, 
-                    'buy_date' : buy_date,
-                    'buy_price' : buy_price,
-                    'current_price': current_price,
-                    #'current_date': current_date,
-                    #'years_held' : years_held,
-                    'shares': shares,
-                    'book_value' : book_value, 
-                    'current_value' : current_value,
-                    'total_gain' : total_gain,
-                    'capital_gain' : capital_gain,
-                    'div_gain' : div_gain,
-                    'capital_return' : capital_return,
-                    'total_return' : total_return,
-                    'daily_return' : daily_return}
-
+        new_row = st_row(ticker, positions.loc[ticker], current_date, current_price)
         st_summary = st_summary.append(new_row, ignore_index = True)
 
-    st_summary = st_summary.sort_values(by = 'daily_return', ascending = False)
-    return st, st_summary, tickers, current_date
+    st_summary = st_base(st, st_summary)
 
-# Cenvous share account
+    # risk columns
+    risk = st_risk(st_summary)['summary']
+    st_summary = st_summary.merge(risk[risk['ticker'] != 'portfolio'], on='ticker', how='left')
+
+    st_summary = st_summary.sort_values(by = 'daily_return', ascending = False)
+    return st_summary, current_date
+
+def st_base(st, st_summary):
+    """Add each holding's currency and its book value, current value &
+    total gain in the base currency (m4_fx.base)
+
+    Buys and sells convert at the rate of their date, the current value
+    at the latest rate, so the base gain includes the currency move.
+    """
+    currencies = m4_fx.currencies(st['ticker'].unique())
+    currency = st_summary['ticker'].map(currencies).values
+    rows = st[st['type'].isin(['buy', 'sell'])]
+    rows = rows.assign(amount=m4_fx.to_base(rows['total'].abs(), rows['ticker'].map(currencies).values,
+                                            rows['date']))
+    flows = rows.pivot_table(index='ticker', columns='type', values='amount', aggfunc='sum')
+    flows = flows.reindex(index=st_summary['ticker'], columns=['buy', 'sell']).fillna(0)
+
+    today = np.repeat(pd.Timestamp.today().normalize(), len(st_summary))
+    st_summary['currency'] = currency
+    st_summary['fx_rate'] = m4_fx.to_base(np.ones(len(st_summary)), currency, today).round(4)
+    st_summary['base_book_value'] = flows['buy'].values.round(2)
+    st_summary['base_current_value'] = m4_fx.to_base(st_summary['current_value'], currency, today).round(2)
+    st_summary['base_total_gain'] = (st_summary['base_current_value'] + flows['sell'].values
+                                     - flows['buy'].values).round(2)
+    return st_summary
+
+def st_risk(st_summary):
+    # holdings weighted by current value in the base currency, see m4_risk
+    return m4_risk.risk_fetch({ticker: quotes[ticker] for ticker in st_summary['ticker']},
+                              dict(zip(st_summary['ticker'], st_summary['base_current_value'])))
+
+# Cenovus share account
 
 def csa_fetch():
 
     # suppress pandas error
     pd.set_option('mode.chained_assignment', None)
 
-    csa = pd.read_csv(
-    os.path.join(os.path.dirname(__file__), "../../data/csa.csv"))
+    # acb totals per sell period come from the csa_periods view
+    csa = m4_db.query("SELECT * FROM csa_periods ORDER BY row", index_col='row')
+    csa.index.name = None
+    csa = csa.drop(['period'], axis=1)
     csa['date'] =  pd.to_datetime(csa['date'])
 
     # add hypothetical sell row at end of dataframe
     csa = csa.append(csa.iloc[ -1:,:])
     csa.iloc[ -1:,:]['type'] = 'sell'
 
-    # calculate acb totals
-    csa['sell'] = np.where(csa['type'] == 'sell', 1, 0)
-    csa['cumsum'] = csa['sell'].cumsum()
-    csa['total_acb']= csa.groupby(['cumsum'])['acb'].cumsum()
-    csa['total_shares']= csa.groupby(['cumsum'])['shares'].cumsum()
-    csa = csa.drop(['sell', 'cumsum'], axis=1)
-
     # calculate return per sell period
     csa['acb'] = round(csa['total_acb'].shift(1).where(csa['type'] == 'sell', csa['acb']), 2)
     csa['shares'] = round(csa['total_shares'].shift(1).where(csa['type'] == 'sell', csa['shares']), 2)
@@ -163,7 +313,7 @@ def csa_fetch():
     csa = csa.drop(['total_acb', 'total_shares'], axis=1)
 
     # calculate hypothetical current return
-    quote = si.get_data('CVE.TO')
+    quote = quote_cached('CVE.TO').copy()
     quote['date'] = quote.index
     csa.iloc[ -1:,:]['date'] = quote.iloc[ -1:,:]['date'][0]
     csa.iloc[ -1:,:]['price'] = round(quote.iloc[ -1:,:]['close'][0], 2)
@@ -187,12 +337,12 @@ def csa_fetch():
 
     return csa, csa_sell
 
-# Cenvous salary
+# Cenovus salary
 
 def sal_fetch():
 
-    sal = pd.read_csv(
-    os.path.join(os.path.dirname(__file__), "../../data/salary.csv"))
+    sal = m4_db.query("SELECT * FROM salary ORDER BY row", index_col='row')
+    sal.index.name = None
     sal['date'] =  pd.to_datetime(sal['date'])
 
     return sal
@@ -200,52 +350,36 @@ def sal_fetch():
 
 # update time of day style for plots
 
-### time of day style
-mytime = time.localtime()
-if mytime.tm_hour < m4_parameters.morning or mytime.tm_hour > m4_parameters.night:
-    # night
-    colors = {
-    'background': '#111111',
-    'text': '#ffffe5'
-    }
-else:
-    # day
-    colors = {
-    'background': '#fdfcfa',
-    'text': '#000000'
-    }
-
-def time_of_day(df): 
-    mytime = time.localtime()
-    if mytime.tm_hour < m4_parameters.morning or mytime.tm_hour > m4_parameters.night:
-        # night
-        df.update_layout(
-        height=650,
-        plot_bgcolor=colors['background'],
-        paper_bgcolor=colors['background'],
-        font_color=colors['text'],
-        ),
-    else:
-        df.update_layout(
-        height=650,
-        paper_bgcolor=colors['background'],
-        font_color=colors['text'],
-        ),
+def time_of_day(df, theme=None):
+    df.update_layout(template=m4_theme.template(theme))
     return df
 
+# graph set up function: the figure goes into a store as typed arrays and
+# the browser decodes it and applies the selected theme (assets/clientside.js)
+def graph_setup (name, figure = None):
+    if figure is not None:
+        figure = m4_wire.encode_figure(figure)
+    return [
+        dcc.Store(id={'type': 'figure-store', 'index': name}, data=figure),
+        dcc.Graph(id={'type': 'themed-graph', 'index': name}),
+    ]
+
 # table set up function for plotly
-def table_setup (df, height = 350):
+def table_setup (df, height = 350, theme = None, name = None, formats = None):
+    # formats: column -> d3-format specifier, applied in the browser so
+    # the frames keep numbers rather than formatted strings
+    ids = {'id': {'type': 'themed-table', 'index': name}} if name else {}
+    columns = [{'id': c, 'name': c} for c in df.columns]
+    for column in columns:
+        if column['id'] in (formats or {}):
+            column.update(type='numeric', format={'specifier': formats[column['id']]})
     table = dash_table.DataTable(
+        **ids,
         data=df.to_dict('records'),
-        columns=[{'id': c, 'name': c} for c in df.columns],
+        columns=columns,
         #style_as_list_view=True,
         fixed_rows={'headers': True},
         style_table={'height': height},
-        style_header={'backgroundColor': '#2fa4e7'},
-        style_cell={
-            'backgroundColor': colors['background'],
-            'color': colors['text'],
-            'font-family': "Arial"
-        },
+        **m4_theme.table_styles[theme or m4_theme.theme_now()],
     )
     return table
\ No newline at end of file
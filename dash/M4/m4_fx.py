@@ -0,0 +1,129 @@
+# currencies: per-ticker currency and an as-of fx rate store for
+# converting amounts into the base currency
+#
+# rates are yahoo fx histories (e.g. USDCAD=X) kept in the quotes table
+# of m4.db; a refresh only downloads the days after the stored ones and
+# falls back to the stored rates when offline
+
+# libraries
+import os
+import pandas as pd
+import numpy as np
+import m4_cache
+import m4_db
+import m4_lazy
+
+si = m4_lazy.lazy_import('yahoo_fin.stock_info')
+
+base = os.environ.get("M4_CURRENCY", "CAD")
+
+# optional overrides, one row per ticker: ticker,currency
+currencies_path = os.path.join(m4_db.data_dir, "currencies.csv")
+
+# listing currency by ticker suffix, no suffix is a us listing
+suffixes = {
+    '.TO': 'CAD', '.V': 'CAD', '.CN': 'CAD', '.NE': 'CAD',
+    '.L': 'GBP', '.PA': 'EUR', '.DE': 'EUR', '.AS': 'EUR', '.SW': 'CHF', '.T': 'JPY',
+}
+
+# seconds a refreshed rate history is reused by every worker
+fx_ttl = 60 * 60
+
+#### currency metadata ####
+
+def overrides():
+    if not os.path.exists(currencies_path):
+        return {}
+    df = pd.read_csv(currencies_path)
+    return dict(zip(df['ticker'], df['currency']))
+
+def currency_of(ticker, known=None):
+    known = overrides() if known is None else known
+    if ticker in known:
+        return known[ticker]
+    for suffix, currency in suffixes.items():
+        if ticker.endswith(suffix):
+            return currency
+    return 'USD'
+
+def currencies(tickers):
+    known = overrides()
+    return {ticker: currency_of(ticker, known) for ticker in tickers}
+
+#### rate store ####
+
+def fx_symbol(currency):
+    # yahoo quotes XXXYYY=X as YYY per XXX
+    return '%s%s=X' % (currency, base)
+
+def history_refresh(symbol):
+    """Stored history of symbol topped up with the days since the last
+    stored one
+
+    Returns:
+        the close series indexed by date
+    """
+    stored = m4_db.quotes_load(symbol)
+    try:
+        if len(stored):
+            # the last stored day may have been a partial one
+            new = si.get_data(symbol, start_date=stored.index.max())
+        else:
+            new = si.get_data(symbol)
+        if not len(new):
+            # nothing downloaded, keep the stored history as it is
+            return stored['close'].dropna()
+        m4_db.quotes_save(symbol, new)
+        new.index = pd.to_datetime(new.index)
+        stored = pd.concat([stored[stored.index < new.index.min()], new])
+    except Exception:
+        if not len(stored):
+            raise
+    return stored['close'].dropna()
+
+# currency -> (last date, dates as int64, rates), rebuilt when the
+# cached history changes
+arrays = {}
+
+def fx_history(currency):
+    symbol = fx_symbol(currency)
+    return m4_cache.cached('fx:' + symbol, lambda: history_refresh(symbol), fx_ttl)
+
+def rate_arrays(currency):
+    rates = fx_history(currency)
+    version = (rates.index[-1], len(rates))
+    if currency not in arrays or arrays[currency][0] != version:
+        arrays[currency] = (version, rates.index.values.astype('datetime64[ns]').astype(np.int64),
+                            rates.values.astype(float))
+    return arrays[currency][1:]
+
+#### conversion ####
+
+def fx_rates(currency, dates):
+    """Rate to the base currency on or before each date, the first rate
+    for dates before the history starts"""
+    dates = pd.to_datetime(dates).values.astype('datetime64[ns]').astype(np.int64)
+    if currency == base:
+        return np.ones(len(dates))
+    days, rates = rate_arrays(currency)
+    return rates[np.clip(np.searchsorted(days, dates, side='right') - 1, 0, None)]
+
+def to_base(amounts, currency, dates):
+    """Convert amounts to the base currency at each date's rate
+
+    Args:
+        amounts: array of amounts
+        currency: array of currency codes, or one code for all amounts
+        dates: array of dates, same length
+    Returns:
+        an array of amounts in the base currency
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    dates = pd.to_datetime(np.asarray(dates))
+    currency = np.broadcast_to(np.asarray(currency, dtype=object), amounts.shape)
+    converted = amounts.copy()
+    for code in pd.unique(currency):
+        if code != base:
+            mask = currency == code
+            converted[mask] = amounts[mask] * fx_rates(code, dates[mask])
+    return converted
@@ -0,0 +1,165 @@
+# materialized daily holdings & value table for the investment tab
+
+# libraries
+import pandas as pd
+import numpy as np
+
+holdings_columns = ['date', 'ticker', 'shares', 'close', 'value']
+
+# share count change per transaction: buys and reinvested dividends add
+# shares, sells remove them
+def share_deltas(st):
+    number = st['number'].fillna(0).abs()
+    return pd.Series(np.where(st['type'] == 'sell', -number, number), index=st.index)
+
+def deltas_by_date(st, dates, tickers):
+    """Sum share changes onto the trading dates they take effect
+
+    Args:
+        st: stock transactions
+        dates: sorted trading dates of the new rows
+        tickers: columns of the result
+    Returns:
+        a date x ticker dataframe of share changes; transactions on
+        non-trading days land on the next trading day, transactions
+        after the last date are left for the next append
+    """
+    pos = dates.searchsorted(st['date'])
+    keep = pos < len(dates)
+    deltas = pd.DataFrame({'pos': pos[keep],
+                           'ticker': st['ticker'].values[keep],
+                           'delta': share_deltas(st).values[keep]})
+    deltas = deltas.groupby(['pos', 'ticker'])['delta'].sum().unstack()
+    deltas = deltas.reindex(index=range(len(dates)), columns=tickers).fillna(0)
+    deltas.index = dates
+    return deltas
+
+def holdings_fetch(st, quotes):
+    """Build the daily holdings table from the ledger and quote histories
+
+    Args:
+        st: stock transactions from st_fetch
+        quotes: dict of ticker -> quote history from yahoo_fin
+    Returns:
+        a long dataframe with one row per date & ticker, starting at
+        the first transaction
+    """
+    holdings = pd.DataFrame(columns=holdings_columns)
+    return holdings_add_prices(holdings, st, quotes, start_date=st['date'].min())
+
+def close_matrix(quotes):
+    close = pd.DataFrame({ticker: quote['close'] for ticker, quote in quotes.items()})
+    close.index = pd.to_datetime(close.index).normalize()
+    return close.groupby(level=0).last().sort_index()
+
+def holdings_add_prices(holdings, st, quotes, start_date=None):
+    """Materialize the days from the last quoted one on
+
+    The last quoted day is redone, as the latest close moves during the
+    day, and so are the days after it that transactions added before
+    their quote arrived. Transactions dated after the last quote add
+    their own day, at the last close.
+
+    Args:
+        holdings: table from holdings_fetch
+        st: all stock transactions, including any not yet materialized
+        quotes: dict of ticker -> quote history, full or just the new tail
+        start_date: first date to materialize on an empty table
+    Returns:
+        the holdings table with the new days appended
+    """
+    close = close_matrix(quotes)
+    late = pd.DatetimeIndex(st['date']).normalize()
+    late = late[late > (close.index.max() if len(close) else pd.Timestamp.min)]
+    close = close.reindex(close.index.union(late))
+
+    if len(holdings):
+        dates = pd.DatetimeIndex(holdings['date'].unique()).sort_values()
+        quoted = dates[dates.isin(close.index[close.notna().any(axis=1)])]
+        since = quoted.max() if len(quoted) else dates.max()
+        kept = holdings[holdings['date'] < since]
+        if kept.empty:
+            return holdings_fetch(st, quotes)
+
+        last_date = kept['date'].max()
+        last = kept[kept['date'] == last_date].set_index('ticker')
+        tickers = close.columns.union(last.index)
+        # seed with the last kept close so gaps carry forward
+        close = pd.concat([last['close'].to_frame(last_date).T,
+                           close[close.index > last_date]]).reindex(columns=tickers)
+        close = close.ffill().iloc[1:]
+        opening = last['shares'].reindex(tickers).fillna(0)
+        ledger = st[st['date'] > last_date]
+        holdings = kept
+    else:
+        close = close.ffill()
+        if start_date is not None:
+            close = close[close.index >= start_date]
+        opening = pd.Series(0.0, index=close.columns)
+        ledger = st
+
+    if close.empty:
+        return holdings
+
+    shares = deltas_by_date(ledger, close.index, close.columns).cumsum() + opening
+
+    new = pd.DataFrame({
+        'date': np.repeat(close.index.values, len(close.columns)),
+        'ticker': np.tile(close.columns.values, len(close.index)),
+        'shares': shares.values.ravel(),
+        'close': close.values.ravel(),
+    })
+    new['value'] = round(new['shares'] * new['close'], 2)
+
+    if holdings.empty:
+        return new
+    return pd.concat([holdings, new], ignore_index=True)
+
+def holdings_add_tickers(holdings, tickers, quotes):
+    # a ticker new to the table starts with no shares on every day
+    dates = pd.DatetimeIndex(holdings['date'].unique()).sort_values()
+    close = close_matrix({ticker: quotes[ticker] for ticker in tickers})
+    close = close.reindex(close.index.union(dates)).ffill().reindex(dates)
+    new = pd.DataFrame({
+        'date': np.repeat(dates.values, len(close.columns)),
+        'ticker': np.tile(close.columns.values, len(dates)),
+        'shares': 0.0,
+        'close': close.values.ravel(),
+        'value': 0.0,
+    })
+    return pd.concat([holdings, new], ignore_index=True).sort_values(['date', 'ticker'], kind='mergesort',
+                                                                      ignore_index=True)
+
+def holdings_add_transactions(holdings, rows, st, quotes):
+    """Apply new transactions
+
+    Rows dated inside the materialized range update the affected rows in
+    place; a ticker the table does not hold yet is added from its quote
+    history first, and rows dated after the last day extend the table.
+
+    Args:
+        holdings: table from holdings_fetch
+        rows: new stock transactions
+        st: all stock transactions, rows included
+        quotes: dict of ticker -> quote history, for every ticker of st
+    Returns:
+        the updated holdings table
+    """
+    if holdings.empty:
+        return holdings_fetch(st, quotes)
+    added = sorted(set(rows['ticker']) - set(holdings['ticker']))
+    if added:
+        holdings = holdings_add_tickers(holdings, added, quotes)
+
+    dates = pd.DatetimeIndex(holdings['date'].unique()).sort_values()
+    inside = rows[rows['date'] <= dates.max()]
+    effective = dates[dates.searchsorted(inside['date'])]
+
+    for ticker, date, delta in zip(inside['ticker'], effective, share_deltas(inside)):
+        mask = (holdings['ticker'] == ticker) & (holdings['date'] >= date)
+        holdings.loc[mask, 'shares'] += delta
+        holdings.loc[mask, 'value'] = round(holdings.loc[mask, 'shares'] * holdings.loc[mask, 'close'], 2)
+
+    if len(inside) < len(rows):
+        holdings = holdings_add_prices(holdings, st, quotes)
+    return holdings
@@ -0,0 +1,85 @@
+# tail-following ingest of the ledger csvs: rows appended to mortgage,
+# stocks, csa or salary.csv reach the running app without a restart
+#
+# m4_db.db_import parses only the lines added since the last import and
+# reloads a file whose earlier lines changed (the sha1 of the imported
+# prefix no longer matches). Each worker polls the imports table: rows
+# added since it last folded them in are read back from the database, so
+# whichever worker imports the lines, every worker folds them into its
+# own tables, and a table that failed to fold is offered again.
+
+# libraries
+import os
+import time
+import logging
+import threading
+import m4_db
+
+logger = logging.getLogger(__name__)
+
+# a poll is one stat per csv while nothing changes
+poll_seconds = float(os.environ.get("M4_INGEST_SECONDS", 5))
+
+# table name -> (rows, reloads) as last folded into this process's tables
+seen = {}
+state = {'thread': None}
+started = threading.Lock()
+
+def imports():
+    # the query imports the changed csvs first
+    df = m4_db.query("SELECT name, rows, reloads FROM imports")
+    return {name: (rows, reloads) for name, rows, reloads in df.itertuples(index=False)}
+
+def poll():
+    """Ledger rows added since they were last folded in
+
+    The first poll only records where each ledger stands. The others
+    leave `seen` as it is: the caller saves a table's mark once its rows
+    are folded in, so a table that failed is offered again.
+
+    Returns:
+        dict of table name -> the appended rows, indexed by csv row like
+        the fetchers' tables, or None when the ledger was reloaded in
+        full and its tables need rebuilding; and dict of table name ->
+        the mark to save in `seen` for it
+    """
+    current = imports()
+    changes = {}
+    for name, (rows, reloads) in current.items():
+        before = seen.setdefault(name, (rows, reloads))
+        if before == (rows, reloads):
+            continue
+        if reloads == before[1] and rows > before[0]:
+            added = m4_db.query("SELECT * FROM %s WHERE row >= ? ORDER BY row" % name,
+                                (before[0],), index_col='row')
+            added.index.name = None
+            changes[name] = added
+        else:
+            changes[name] = None
+    return changes, {name: current[name] for name in changes}
+
+def watch(handler):
+    while True:
+        time.sleep(poll_seconds)
+        try:
+            changes, marks = poll()
+            for name, rows in changes.items():
+                handler({name: rows})
+                seen[name] = marks[name]
+        except Exception as e:
+            # a half-written or malformed csv is retried on the next poll
+            logger.warning('ledger ingest failed, retrying in %.0fs: %r', poll_seconds, e)
+
+def ensure_started(handler):
+    """Start polling in a background thread, once per process; call
+    poll once beforehand to record the ledgers the tables were built from
+
+    Args:
+        handler: function called with the changes from poll
+    """
+    # threads do not survive gunicorn forking a preloaded app, so this is
+    # called on requests rather than at import
+    with started:
+        if state['thread'] is None:
+            state['thread'] = threading.Thread(target=watch, args=(handler,), daemon=True)
+            state['thread'].start()
@@ -0,0 +1,183 @@
+# background jobs: slow callback work runs in a pool of worker processes
+# while the page polls for its progress, so no request waits on it
+#
+# a callback submits a job and returns at once; a dcc.Interval then calls
+# back until job_poll reports the result. Status & results live in the
+# m4_cache backend, so any gunicorn worker can answer a poll, and a job's
+# result is cached under its key, so submitting the same inputs again is
+# answered from the cache without running anything.
+
+# libraries
+import os
+import time
+import hashlib
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import m4_cache
+
+workers = int(os.environ.get("M4_JOB_WORKERS", 2))
+
+# seconds between the page's progress polls
+poll_seconds = 0.5
+
+# seconds a status is kept: finished jobs are looked up by their key,
+# a pending or running one whose worker died is forgotten after stale_ttl,
+# and a failed one is not retried before failed_ttl
+job_ttl = 60 * 60
+stale_ttl = 10 * 60
+failed_ttl = 60
+
+# the memory & fakeredis backends are private to a process, jobs then
+# run on threads so the status they write can be seen
+in_process = m4_cache.backend_url in ('memory', 'fakeredis')
+
+# id of the job running in this process or thread
+job_var = contextvars.ContextVar('job', default=None)
+
+# the pool is created in each gunicorn worker, a forked one can't be used
+state = {'pool': None, 'pid': None}
+
+# job id -> future, for the jobs this process submitted
+futures = {}
+
+class JobCancelled(Exception):
+    """Raised by progress inside a job that was cancelled"""
+
+def pool():
+    if state['pool'] is None or state['pid'] != os.getpid():
+        executor = ThreadPoolExecutor if in_process else ProcessPoolExecutor
+        state['pool'] = executor(workers)
+        state['pid'] = os.getpid()
+    return state['pool']
+
+#### status ####
+
+def job_id_of(key):
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def status_set(job_id, key, state, fraction=0.0, message=''):
+    ttl = {'pending': stale_ttl, 'running': stale_ttl, 'failed': failed_ttl}.get(state, job_ttl)
+    m4_cache.backend.set('job:' + job_id, {'key': key, 'state': state, 'progress': fraction,
+                                           'message': message, 'updated': time.time()}, ttl)
+
+def job_status(job_id):
+    return m4_cache.backend.get('job:' + job_id) or {'key': None, 'state': 'missing', 'progress': 0.0,
+                                                      'message': '', 'updated': None}
+
+def progress(fraction, message=''):
+    """Report the progress of the running job, a no-op outside a job
+
+    Args:
+        fraction: share of the work done, 0 to 1
+        message: what the job is doing, shown under the progress bar
+    Raises:
+        JobCancelled: the job was cancelled, its caller should stop
+    """
+    job = job_var.get()
+    if job is None:
+        return
+    job_id, key = job
+    if m4_cache.backend.get('job-cancel:' + job_id):
+        raise JobCancelled(job_id)
+    status_set(job_id, key, 'running', fraction, message)
+
+#### running ####
+
+def job_run(job_id, key, ttl, function, args):
+    # runs in the pool; the result is stored like m4_cache.cached stores it
+    token = job_var.set((job_id, key))
+    try:
+        start = time.time()
+        progress(0.0)
+        value = function(*args)
+        delta = time.time() - start
+        m4_cache.backend.set(key, (value, delta, start + ttl if ttl else None), ttl)
+        status_set(job_id, key, 'done', 1.0)
+    except JobCancelled:
+        status_set(job_id, key, 'cancelled')
+    except Exception as e:
+        status_set(job_id, key, 'failed', message='%s: %s' % (type(e).__name__, e))
+    finally:
+        job_var.reset(token)
+
+def job_done(job_id, key, future):
+    futures.pop(job_id, None)
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        # job_run reports its own errors, this is the pool itself failing
+        if isinstance(error, BrokenProcessPool):
+            state['pool'] = None
+        status_set(job_id, key, 'failed', message='%s: %s' % (type(error).__name__, error))
+
+def job_submit(key, function, *args, ttl=None, previous=None):
+    """Run function(*args) in the background unless its result is cached
+    or the same job is already running
+
+    Args:
+        key: cache key of the result, the job id is derived from it
+        function: module-level function, as the pool pickles it by name
+        args: picklable arguments
+        ttl: seconds the result stays cached, None to keep it until evicted
+        previous: id of the job these inputs replace, cancelled when it
+            is a different one
+    Returns:
+        the job id, for job_poll
+    """
+    job_id = job_id_of(key)
+    if previous and previous != job_id:
+        job_cancel(previous)
+    status = job_status(job_id)
+    if m4_cache.backend.get(key) is not None:
+        # computed by an earlier job or by m4_cache.cached
+        if status['state'] != 'done':
+            status_set(job_id, key, 'done', 1.0)
+        return job_id
+
+    if status['state'] == 'failed':
+        return job_id
+    # wanted again, even if another page cancelled it meanwhile
+    m4_cache.backend.delete('job-cancel:' + job_id)
+    if status['state'] in ('pending', 'running'):
+        return job_id
+    status_set(job_id, key, 'pending')
+    try:
+        future = pool().submit(job_run, job_id, key, ttl, function, args)
+    except BrokenProcessPool:
+        state['pool'] = None
+        future = pool().submit(job_run, job_id, key, ttl, function, args)
+    futures[job_id] = future
+    future.add_done_callback(lambda future: job_done(job_id, key, future))
+    return job_id
+
+def job_cancel(job_id):
+    """Cancel a job: dropped if it has not started, stopped at its next
+    progress report otherwise"""
+    status = job_status(job_id)
+    if status['state'] not in ('pending', 'running'):
+        return
+    future = futures.pop(job_id, None)
+    if future is not None and future.cancel():
+        status_set(job_id, status['key'], 'cancelled')
+    else:
+        m4_cache.backend.set('job-cancel:' + job_id, True, stale_ttl)
+
+def job_poll(job_id):
+    """Status of a job
+
+    Returns:
+        dict with state ('pending', 'running', 'done', 'failed',
+        'cancelled' or 'missing'), progress, message & the result once
+        the state is 'done'
+    """
+    status = dict(job_status(job_id), result=None)
+    if status['state'] == 'done':
+        entry = m4_cache.backend.get(status['key'])
+        if entry is None:
+            # evicted since, a new submit computes it again
+            status['state'] = 'missing'
+        else:
+            status['result'] = entry[0]
+    return status
@@ -0,0 +1,29 @@
+# deferred imports for heavy modules that are only used inside callbacks
+
+# libraries
+import sys
+import importlib
+import types
+
+class LazyModule(types.ModuleType):
+    """Stand-in that imports the real module on first attribute access
+
+    Unlike importlib.util.LazyLoader, the parent packages are not imported
+    either (yahoo_fin/__init__ already pulls in requests).
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def lazy_import(name):
+    """Return the module if it is already loaded, else a LazyModule
+
+    Args:
+        name: dotted module name, e.g. 'plotly.express'
+    Returns:
+        a module object to use in place of `import name`
+    """
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
@@ -0,0 +1,128 @@
+# the tables of the M4 tabs: the ledger csvs read by m4_functions topped
+# up with the logged events that are not in them (m4_events), and the
+# tables derived from those; m4_app keeps them current as events & csv
+# rows arrive, m4_export reads them once
+
+# libraries
+import pandas as pd
+import m4_actions
+import m4_cache
+import m4_functions
+import m4_holdings
+import m4_lots
+import m4_montecarlo
+
+#### logged events ####
+
+# the ledger table each event view tops up, and its csv columns
+event_tables = {
+    'transactions': ('stocks', ['date', 'ticker', 'type', 'number', 'price', 'total']),
+    'payments': ('mortgage', ['date', 'type', 'principal', 'interest']),
+    'salaries': ('salary', ['date', 'type', 'amount']),
+}
+
+def event_rows(events, view):
+    # ledger rows of an event view, dates as read from the database
+    rows = pd.DataFrame(events)
+    if view != 'salaries':
+        # the type of a salary event is the salary's, e.g. base
+        rows['type'] = rows['kind']
+    return rows[event_tables[view][1]]
+
+#### mortgage & salary ####
+
+def mortgage_fetch(ledger, fetched=None):
+    """mt_fetch with the logged payments that are not in mortgage.csv
+
+    Args:
+        ledger: state from m4_events.load
+        fetched: the results of mt_fetch, when already read
+    Returns:
+        the mortgage table and its summary
+    """
+    mt, mt_summary = fetched or m4_functions.mt_fetch()
+    if ledger['payments']:
+        return m4_functions.mt_append(mt, event_rows(ledger['payments'], 'payments'))
+    return mt, mt_summary
+
+def salary_fetch(ledger, sal=None):
+    # sal_fetch with the logged salary changes that are not in salary.csv
+    sal = m4_functions.sal_fetch() if sal is None else sal
+    if ledger['salaries']:
+        rows = event_rows(ledger['salaries'], 'salaries')
+        sal = sal.append(rows.assign(date=pd.to_datetime(rows['date'])), ignore_index=True)
+    return sal
+
+# simulation is shared by the workers until the mortgage terms change
+mc_params = dict(extra_amount=10000, extra_prob=0.5)
+
+def mortgage_simulation(mt):
+    """Payoff simulation from the current mortgage terms
+
+    Returns:
+        mt_terms, and the scenarios & summary of mc_fetch
+    """
+    mt_terms = m4_montecarlo.mt_terms(mt)
+    mc, mc_summary = m4_cache.cached('mc:%r' % sorted({**mt_terms, **mc_params}.items()),
+                                     lambda: m4_montecarlo.mc_fetch(mt, **mc_params))
+    return mt_terms, mc, mc_summary
+
+#### investments ####
+
+def held_quotes(st):
+    # quote histories of the ledger's tickers, cached ones unless expired
+    return {ticker: m4_functions.quote_fetch(ticker) for ticker in st['ticker'].unique()}
+
+def stocks_summarize(st, positions, summarized=None):
+    """Summary, prices & risk of a stock ledger, after its rows or the
+    quotes changed
+
+    Args:
+        st: stock ledger
+        positions: per-ticker totals of st, see positions_table
+        summarized: st_summary & current_date when already computed
+    Returns:
+        dict with st_summary, current_date, tickers, positions, prices
+        & risk
+    """
+    st_summary, current_date = summarized or m4_functions.st_summarize(st, positions)
+    return {
+        'st_summary': st_summary,
+        'current_date': current_date,
+        'tickers': st['ticker'].unique(),
+        'positions': positions,
+        'prices': dict(zip(st_summary['ticker'], st_summary['current_price'])),
+        'risk': m4_functions.st_risk(st_summary),
+    }
+
+def stocks_fetch(ledger, fetched=None):
+    """Investment tables of the default portfolio: st_fetch with the
+    logged transactions that are not in stocks.csv
+
+    Args:
+        ledger: state from m4_events.load
+        fetched: the results of st_fetch, when already read
+    Returns:
+        the dict of stocks_summarize with st, the daily holdings, the
+        open lots per lot method and the quote histories
+    """
+    st, st_summary, tickers, current_date = fetched or m4_functions.st_fetch()
+    if ledger['transactions']:
+        rows = event_rows(ledger['transactions'], 'transactions')
+        st = st.append(rows.assign(date=pd.to_datetime(rows['date'])), ignore_index=True)
+        m4_functions.st_actions(rows['ticker'].unique())
+        tables = stocks_summarize(st, m4_functions.positions_table(st))
+    else:
+        tables = stocks_summarize(st, m4_functions.positions_fetch(), (st_summary, current_date))
+
+    # share counts follow splits, the quotes are already split-adjusted
+    quotes = held_quotes(st)
+    adjusted = m4_actions.adjust_ledger(st)
+    tables.update({
+        'st': st,
+        'holdings': m4_holdings.holdings_fetch(adjusted, quotes),
+        # open lots & realized totals per lot method, topped up event by event
+        'lots': {method: m4_lots.lots_fetch(adjusted, method)[1] for method in m4_lots.methods},
+        'quotes': quotes,
+    })
+    return tables
@@ -0,0 +1,211 @@
+# tax lots for every holding in the stock ledger: canadian average-cost
+# acb or fifo, realized & unrealized gains
+
+# libraries
+import pandas as pd
+import numpy as np
+
+methods = ['acb', 'fifo']
+
+# share counts below this are treated as a closed position
+eps = 1e-9
+
+lot_columns = ['ticker', 'date', 'shares', 'cost']
+
+#### ledger flows ####
+
+def ledger_flows(st, lots=None):
+    """Share & cash flows per transaction, grouped by ticker
+
+    Buys add shares at their total, reinvested dividends add shares at
+    the dividend price and sells remove shares for the absolute total.
+
+    Args:
+        st: stock transactions (date, ticker, type, number, price, total)
+        lots: open lots (lot_columns) carried in ahead of the transactions
+    Returns:
+        a dataframe with ticker, date, shares, cost, proceeds & dividends
+        columns, the open lots first within each ticker, and a `new`
+        column marking the rows that came from st
+    """
+    kind = st['type'].values
+    number = st['number'].fillna(0).abs().values
+    price = st['price'].fillna(0).values
+    total = st['total'].fillna(0).values
+    sell = kind == 'sell'
+    dividend = kind == 'dividend'
+
+    flows = pd.DataFrame({
+        'ticker': st['ticker'].values,
+        'date': pd.to_datetime(st['date']).values,
+        'shares': np.where(sell, -number, np.where(dividend | (kind == 'buy'), number, 0)),
+        'cost': np.where(kind == 'buy', total, np.where(dividend, number * price, 0)),
+        'proceeds': np.where(sell, np.abs(total), 0),
+        # reinvested value plus the cash total, as in st_row's div_gain
+        'dividends': np.where(dividend, number * price + total, 0),
+        'new': True,
+    }, index=st.index)
+
+    if lots is not None and len(lots):
+        opening = lots[lot_columns].assign(proceeds=0.0, dividends=0.0, new=False)
+        opening['date'] = pd.to_datetime(opening['date'])
+        flows = pd.concat([opening, flows])
+
+    # stable sort keeps the ledger order inside each ticker
+    order = pd.factorize(flows['ticker'])[0]
+    return flows.iloc[np.argsort(order, kind='stable')]
+
+#### average cost ####
+
+def acb_lots(flows):
+    """Canadian average-cost acb over the flows, one pass of group-wise
+    cumulative operations
+
+    Between sells the acb only grows; a sell keeps the unsold fraction f
+    of it, so acb_t = f_t * acb_t-1 + cost_t. With F the running product
+    of f that is acb_t = F_t * cumsum(cost / F). Positions sold out start
+    a new group so F never reaches zero.
+
+    Args:
+        flows: dataframe from ledger_flows
+    Returns:
+        flows with shares_held, book & realized columns, and the open
+        lots (one per ticker)
+    """
+    ticker = flows['ticker'].values
+    shares = flows.groupby(ticker, sort=False)['shares'].cumsum().values
+    before = shares - flows['shares'].values
+    sell = flows['shares'].values < 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sold = np.where(sell & (before > eps), np.minimum(-flows['shares'].values / before, 1), 0)
+
+    closed = sell & (shares <= eps)
+    closes = pd.Series(closed).groupby(ticker, sort=False).cumsum().values - closed
+    keys = [ticker, closes]
+    factor = pd.Series(np.where(closed, 1, 1 - sold)).groupby(keys, sort=False).cumprod().values
+    acb = factor * pd.Series(flows['cost'].values / factor).groupby(keys, sort=False).cumsum().values
+    acb = np.where(shares <= eps, 0, acb)
+
+    acb_before = pd.Series(acb).groupby(ticker, sort=False).shift().fillna(0).values
+    flows = flows.assign(shares_held=shares, book=acb,
+                         realized=np.where(sell, flows['proceeds'].values - sold * acb_before, 0))
+
+    last = flows.groupby('ticker', sort=False).tail(1)
+    lots = last.loc[last['shares_held'] > eps, ['ticker', 'date', 'shares_held', 'book']]
+    lots.columns = lot_columns
+    return flows, lots.reset_index(drop=True)
+
+#### first in, first out ####
+
+def fifo_lots(flows):
+    """First-in first-out cost over the flows
+
+    Acquisitions of all tickers are laid end to end on one cumulative
+    share axis, with the cumulative cost over it; the cost of a sell is
+    the rise of that curve over the ticker's cumulative sold range, so
+    every sell is matched to its lots by a single interpolation.
+
+    Args:
+        flows: dataframe from ledger_flows
+    Returns:
+        flows with shares_held, book & realized columns, and the open
+        lots left after the sells
+    """
+    ticker = flows['ticker'].values
+    acquired = flows['shares'].clip(lower=0).values
+    sold = (-flows['shares']).clip(lower=0).values
+    bought = acquired > eps
+
+    # cumulative share & cost axis, continuous across tickers
+    axis = np.cumsum(acquired)
+    axis_cost = np.cumsum(np.where(bought, flows['cost'].values, 0))
+    group = pd.Series(acquired).groupby(ticker, sort=False)
+    start = axis - group.cumsum().values
+    end = start + group.transform('sum').values
+    xp = np.concatenate([[0], axis[bought]])
+    fp = np.concatenate([[0], axis_cost[bought]])
+
+    def cost_at(x):
+        return np.interp(x, xp, fp)
+
+    # oversold shares are left at the ticker's last lot
+    sold_to = np.minimum(start + pd.Series(sold).groupby(ticker, sort=False).cumsum().values, end)
+    sold_from = np.minimum(sold_to - sold, end)
+    shares = flows.groupby(ticker, sort=False)['shares'].cumsum().values
+
+    flows = flows.assign(
+        shares_held=shares,
+        book=np.where(shares > eps, cost_at(axis) - cost_at(sold_to), 0),
+        realized=np.where(sold > 0, flows['proceeds'].values - (cost_at(sold_to) - cost_at(sold_from)), 0))
+
+    # what is left of each acquisition past the ticker's last sell
+    last_sold = pd.Series(sold_to).groupby(ticker, sort=False).transform('last').values
+    left = np.clip(axis - np.maximum(axis - acquired, last_sold), 0, None)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        unit = np.where(bought, flows['cost'].values / acquired, 0)
+    lots = pd.DataFrame({'ticker': ticker, 'date': flows['date'].values,
+                         'shares': left, 'cost': left * unit})
+    return flows, lots[bought & (left > eps)].reset_index(drop=True)
+
+engines = {
+    'acb': acb_lots,
+    'fifo': fifo_lots,
+}
+
+#### lot state ####
+
+def lots_fetch(st, method='acb', state=None):
+    """Run the lot engine over the ledger, or over rows appended to it
+
+    Args:
+        st: stock transactions, the whole ledger or only the new rows
+        method: 'acb' or 'fifo'
+        state: state returned for the earlier rows, None for a full run
+    Returns:
+        the transactions with shares_held, book & realized columns, and
+        the state: open lots plus realized & dividend totals per ticker
+    """
+    flows, lots = engines[method](ledger_flows(st, state['lots'] if state else None))
+    flows = flows[flows['new']]
+
+    totals = flows.groupby('ticker', sort=False)[['realized', 'dividends']].sum()
+    if state:
+        totals = totals.add(state['totals'], fill_value=0)
+
+    rows = st.join(flows[['shares_held', 'book', 'realized']])
+    return rows, {'lots': lots, 'totals': totals}
+
+def lots_add(state, rows, method='acb'):
+    """lots_fetch for appended transactions
+
+    Returns:
+        the updated state
+    """
+    return lots_fetch(rows, method, state)[1]
+
+def gains_table(states, prices):
+    """Realized & unrealized gains per holding, for each lot method
+
+    Args:
+        states: dict of method -> state from lots_fetch
+        prices: dict of ticker -> current price
+    Returns:
+        a dataframe with one row per ticker
+    """
+    first = next(iter(states.values()))
+    shares = first['lots'].groupby('ticker')['shares'].sum()
+    tickers = first['totals'].index.union(shares.index)
+
+    gains = pd.DataFrame(index=tickers)
+    gains['shares'] = shares.reindex(tickers).fillna(0)
+    gains['current_price'] = pd.Series(prices).reindex(tickers)
+    gains['current_value'] = gains['shares'] * gains['current_price']
+    for method, state in states.items():
+        book = state['lots'].groupby('ticker')['cost'].sum().reindex(tickers).fillna(0)
+        gains[method + '_book'] = book
+        gains[method + '_unrealized'] = gains['current_value'] - book
+        gains[method + '_realized'] = state['totals']['realized'].reindex(tickers).fillna(0)
+    gains['dividends'] = first['totals']['dividends'].reindex(tickers).fillna(0)
+
+    gains.index.name = 'ticker'
+    return gains.round(2).reset_index()
@@ -0,0 +1,161 @@
+# monte carlo payoff projections for the mortgage tab
+
+# libraries
+import time
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from m4_amortization import periodic_rate, annual_rate, annuity
+
+# remaining amortization simulated, in years
+default_years = 25
+
+def mt_terms(mt):
+    """Current mortgage terms implied by the last payment in mortgage.csv
+
+    Args:
+        mt: mortgage dataframe from mt_fetch
+    Returns:
+        a dict with the remaining balance, regular payment, annual rate,
+        payment frequency and last payment date
+    """
+    pay = mt.loc[mt['type'] == 'payment']
+    dates = pd.to_datetime(pay['date'])
+    last = pay.iloc[-1]
+    periods_per_year = int(round(365.25 / dates.diff().dt.days.median()))
+    r = last['interest'] / (last['balance'] + last['principal'])
+
+    return {'balance': mt['balance'].iloc[-1],
+            'payment': last['principal'] + last['interest'],
+            'rate': annual_rate(r, periods_per_year),
+            'periods_per_year': periods_per_year,
+            'date': dates.iloc[-1]}
+
+def mc_paths(n, seed, balance, payment, rate, periods_per_year=26, years=default_years,
+             renewal_years=5, renewal_in=5, rate_vol=0.01, rate_floor=0.005,
+             extra_amount=0, extra_prob=0):
+    """Simulate n payoff paths, one year at a time
+
+    Rates are fixed between renewals, so each year is advanced with the
+    closed-form annuity balance instead of stepping every payment. At a
+    renewal the rate takes a random step and the payment is raised if it
+    no longer amortizes the balance within the remaining years.
+
+    Args:
+        n: number of scenarios
+        seed: seed or SeedSequence for the random generator
+        balance, payment, rate, periods_per_year: current terms
+        years: remaining amortization in years
+        renewal_years: length of each renewal term
+        renewal_in: years until the next renewal
+        rate_vol: standard deviation of the rate change at each renewal
+        rate_floor: lowest rate a renewal can reach
+        extra_amount: largest yearly lump-sum prepayment
+        extra_prob: chance of making a lump-sum prepayment in a year
+    Returns:
+        a dataframe with payoff_years, total_interest and final_rate
+        per scenario; payoff_years is nan for a path still owing after
+        `years`
+    """
+    rng = np.random.default_rng(seed)
+    ppy = periods_per_year
+
+    bal = np.full(n, float(balance))
+    pay = np.full(n, float(payment))
+    rates = np.full(n, float(rate))
+    r = periodic_rate(rates, ppy)
+    interest = np.zeros(n)
+    payoff = np.full(n, np.nan)
+
+    for year in range(years):
+        if year >= renewal_in and (year - renewal_in) % renewal_years == 0:
+            rates = np.maximum(rates + rng.normal(0, rate_vol, n), rate_floor)
+            r = periodic_rate(rates, ppy)
+            pay = np.maximum(pay, annuity(bal, r, (years - year) * ppy))
+
+        active = np.isnan(payoff)
+        growth = (1 + r) ** ppy
+        # at a zero rate the balance falls by the payments alone, and the
+        # closed forms below take their r -> 0 limits
+        with np.errstate(divide='ignore', invalid='ignore'):
+            end = np.where(r == 0, bal - pay * ppy, bal * growth - pay * (growth - 1) / r)
+
+            # payment number that clears the balance, nan if never
+            k = np.where(r == 0, np.ceil(bal / pay), np.ceil(-np.log1p(-bal * r / pay) / np.log1p(r)))
+            pays_off = active & (k <= ppy)
+            k = np.where(pays_off, k, 1)
+            before = np.where(r == 0, bal - pay * (k - 1),
+                              bal * (1 + r) ** (k - 1) - pay * ((1 + r) ** (k - 1) - 1) / r)
+        paid = np.where(pays_off, pay * (k - 1) + before * (1 + r), pay * ppy)
+
+        interest += np.where(active, paid - np.where(pays_off, bal, bal - end), 0)
+        payoff = np.where(pays_off, year + k / ppy, payoff)
+        bal = np.where(active & ~pays_off, end, 0)
+
+        # yearly lump-sum prepayment
+        extra = np.where(rng.random(n) < extra_prob, rng.random(n) * extra_amount, 0)
+        bal -= np.minimum(extra, bal)
+        payoff = np.where(np.isnan(payoff) & (bal <= 0), year + 1, payoff)
+
+    return pd.DataFrame({'payoff_years': payoff,
+                         'total_interest': interest,
+                         'final_rate': rates})
+
+def mc_simulate(n=10000, seed=None, processes=None, **terms):
+    """Run mc_paths, optionally split across a process pool
+
+    Args:
+        n: number of scenarios
+        seed: seed for reproducible runs
+        processes: worker count for very large runs, None runs in process
+        terms: keyword arguments for mc_paths
+    Returns:
+        the combined per-scenario dataframe
+    """
+    if not processes:
+        return mc_paths(n, seed, **terms)
+
+    seeds = np.random.SeedSequence(seed).spawn(processes)
+    sizes = np.diff(np.linspace(0, n, processes + 1).astype(int))
+    with ProcessPoolExecutor(processes) as pool:
+        runs = [pool.submit(mc_paths, size, s, **terms) for size, s in zip(sizes, seeds)]
+        return pd.concat([run.result() for run in runs], ignore_index=True)
+
+def mc_fetch(mt, n=10000, **params):
+    """Project payoff from the current mortgage state
+
+    Args:
+        mt: mortgage dataframe from mt_fetch
+        n: number of scenarios
+        params: keyword arguments for mc_paths
+    Returns:
+        the per-scenario dataframe with payoff dates, NaT for the paths
+        not paid off, and a percentile summary dataframe
+    """
+    terms = mt_terms(mt)
+    start = terms.pop('date')
+    mc = mc_simulate(n, **terms, **params)
+    mc['payoff_date'] = start + pd.to_timedelta(mc['payoff_years'] * 365.25, unit='D')
+
+    # paths still owing at the horizon rank after every path paid off, so
+    # they push the upper percentiles out rather than being left out
+    horizon = (start + pd.Timedelta(days=params.get('years', default_years) * 365.25)).date()
+    quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+    payoff = mc['payoff_years'].fillna(np.inf).quantile(quantiles, interpolation='higher')
+    mc_summary = pd.DataFrame({
+        'percentile': [int(q * 100) for q in quantiles],
+        'payoff date': [(start + pd.Timedelta(days=years * 365.25)).date() if np.isfinite(years)
+                        else 'after %s' % horizon for years in payoff],
+        'total interest': mc['total_interest'].quantile(quantiles).round(2).values,
+        'final rate %': (mc['final_rate'].quantile(quantiles) * 100).round(2).values,
+    })
+
+    return mc, mc_summary
+
+if __name__ == '__main__':
+    # timing check: 100k scenarios over 25 years
+    start = time.perf_counter()
+    mc = mc_simulate(100000, seed=1, balance=400000, payment=1100, rate=0.03,
+                     extra_amount=10000, extra_prob=0.5)
+    print('100k scenarios: %.3f s' % (time.perf_counter() - start))
+    print(mc.describe())
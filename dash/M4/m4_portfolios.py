@@ -0,0 +1,89 @@
+# portfolio registry: one server hosting many investment portfolios
+#
+# data/ is the default portfolio; every data/portfolios/<name>/ holding a
+# stocks.csv is another one, with its own ledger database. Portfolio
+# tables are computed per portfolio and shared by the workers through
+# m4_cache, while quotes, actions & fx rates are cached per ticker, so
+# portfolios holding the same tickers share one download and one copy.
+
+# libraries
+import os
+import re
+import hashlib
+import m4_actions
+import m4_cache
+import m4_db
+import m4_functions
+import m4_holdings
+import m4_jobs
+import m4_lots
+
+default = 'default'
+portfolios_dir = os.path.join(m4_db.data_dir, "portfolios")
+
+# names are directory names, nothing that could leave portfolios_dir
+name_pattern = re.compile(r'^[A-Za-z0-9_-]+$')
+
+def registry():
+    """Portfolios on disk
+
+    Returns:
+        dict of name -> ledger directory
+    """
+    folders = {default: m4_db.data_dir}
+    if os.path.isdir(portfolios_dir):
+        for name in sorted(os.listdir(portfolios_dir)):
+            folder = os.path.join(portfolios_dir, name)
+            if name_pattern.match(name) and os.path.exists(os.path.join(folder, m4_db.ledgers['stocks'])):
+                folders[name] = folder
+    return folders
+
+def portfolio_dir(name):
+    """Ledger directory of a portfolio, None for an unknown name"""
+    if name == default:
+        return m4_db.data_dir
+    if not name or not name_pattern.match(name):
+        return None
+    folder = os.path.join(portfolios_dir, name)
+    return folder if os.path.exists(os.path.join(folder, m4_db.ledgers['stocks'])) else None
+
+def portfolio_version(folder):
+    files = [os.path.join(folder, file) for file in m4_db.ledgers.values()]
+    return hashlib.sha1(''.join(m4_db.file_hash(path) for path in files
+                                if os.path.exists(path)).encode()).hexdigest()
+
+def portfolio_compute(folder):
+    with m4_db.portfolio(folder):
+        st, st_summary, tickers, current_date = m4_functions.st_fetch()
+    quotes = {ticker: m4_functions.quotes[ticker] for ticker in tickers}
+    m4_jobs.progress(0.8, 'Computing gains & holdings')
+    adjusted = m4_actions.adjust_ledger(st)
+    lots = {method: m4_lots.lots_fetch(adjusted, method)[1] for method in m4_lots.methods}
+    return {
+        'st': st,
+        'st_summary': st_summary,
+        'tickers': list(tickers),
+        'current_date': current_date,
+        'holdings': m4_holdings.holdings_fetch(adjusted, quotes),
+        'gains': m4_lots.gains_table(lots, dict(zip(st_summary['ticker'], st_summary['current_price']))),
+        'risk': m4_functions.st_risk(st_summary),
+    }
+
+def portfolio_fetch(name):
+    """Investment tables of one portfolio, shared through the cache until
+    its ledgers change or the quotes expire
+
+    Args:
+        name: portfolio name, see registry
+    Returns:
+        dict with st, st_summary, tickers, current_date, holdings, gains
+        & risk, or None for an unknown portfolio
+    """
+    folder = portfolio_dir(name)
+    if folder is None:
+        return None
+    return m4_cache.cached(portfolio_key(name, folder), lambda: portfolio_compute(folder), m4_functions.quote_ttl)
+
+def portfolio_key(name, folder):
+    # also the key of the background job computing it, see m4_app
+    return 'portfolio:%s:%s' % (name, portfolio_version(folder))
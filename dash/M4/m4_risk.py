@@ -0,0 +1,97 @@
+# risk analytics per holding and for the portfolio: volatility, max
+# drawdown, value at risk, sharpe & sortino from one aligned returns matrix
+
+# libraries
+import hashlib
+from statistics import NormalDist
+import pandas as pd
+import numpy as np
+import m4_cache
+
+trading_days = 252
+
+# trailing history the summary metrics use, in trading days
+risk_days = 3 * trading_days
+
+# rolling volatility window for the risk chart, about three months
+rolling_days = 63
+
+confidence = 0.95
+risk_free = 0.0
+
+def returns_matrix(quotes):
+    """Daily returns of every ticker on one date index
+
+    Args:
+        quotes: dict of ticker -> quote history
+    Returns:
+        a date x ticker dataframe, nan before a ticker's first close
+    """
+    close = pd.DataFrame({ticker: quote['close'] for ticker, quote in quotes.items()})
+    close.index = pd.to_datetime(close.index).normalize()
+    close = close.groupby(level=0).last().sort_index().ffill()
+    return close.pct_change().iloc[1:]
+
+def portfolio_returns(returns, weights):
+    """Returns of the portfolio held at the given weights, renormalized
+    over the tickers trading on each day"""
+    w = pd.Series(weights).reindex(returns.columns).fillna(0).values
+    traded = returns.notna().values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.Series(np.nan_to_num(returns.values) @ w / (traded @ w), index=returns.index)
+
+def risk_metrics(returns):
+    """Risk metrics of every column in one pass over the matrix
+
+    Args:
+        returns: date x name dataframe of daily returns
+    Returns:
+        a dataframe with one row per column of returns
+    """
+    r = returns.values
+    z = NormalDist().inv_cdf(1 - confidence)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nanmean(r, axis=0)
+        std = np.nanstd(r, axis=0, ddof=1)
+        excess = mean - risk_free / trading_days
+        downside = np.sqrt(np.nanmean(np.minimum(r, 0) ** 2, axis=0))
+
+        equity = np.cumsum(np.nan_to_num(np.log1p(r)), axis=0)
+        drawdown = equity - np.maximum.accumulate(np.maximum(equity, 0), axis=0)
+
+        metrics = pd.DataFrame({
+            'volatility': std * np.sqrt(trading_days) * 100,
+            'max_drawdown': np.expm1(drawdown.min(axis=0)) * 100,
+            'var_95': -np.nanquantile(r, 1 - confidence, axis=0) * 100,
+            'var_95_normal': -(mean + z * std) * 100,
+            'sharpe': excess / std * np.sqrt(trading_days),
+            'sortino': excess / downside * np.sqrt(trading_days),
+        }, index=returns.columns)
+    return metrics.round(2)
+
+def risk_analytics(quotes, weights):
+    returns = returns_matrix(quotes)
+    returns['portfolio'] = portfolio_returns(returns, weights)
+
+    summary = risk_metrics(returns.iloc[-risk_days:])
+    summary.index.name = 'ticker'
+    rolling = returns.rolling(rolling_days).std() * np.sqrt(trading_days) * 100
+    return {'summary': summary.reset_index(), 'rolling': rolling.dropna(how='all')}
+
+def risk_fetch(quotes, weights):
+    """risk_analytics, shared through the cache for each version of the
+    quote histories & weights
+
+    Args:
+        quotes: dict of ticker -> quote history
+        weights: dict of ticker -> current value
+    Returns:
+        dict with the summary (one row per ticker & the portfolio) and
+        the rolling annualized volatility in %
+    """
+    version = hashlib.sha1()
+    for ticker in sorted(quotes):
+        version.update(ticker.encode())
+        version.update(pd.util.hash_pandas_object(quotes[ticker]['close']).values.tobytes())
+    version.update(repr(sorted(weights.items())).encode())
+    return m4_cache.cached('risk:' + version.hexdigest(), lambda: risk_analytics(quotes, weights))
@@ -0,0 +1,113 @@
+# salary analytics for the salary tab: monthly & annual series, raise
+# cagr, inflation-adjusted salary and cumulative earnings
+
+# libraries
+import os
+import hashlib
+import pandas as pd
+import numpy as np
+import m4_cache
+import m4_db
+
+# optional consumer price index, one row per month: date,cpi
+cpi_path = os.path.join(m4_db.data_dir, "cpi.csv")
+
+def cpi_fetch():
+    if not os.path.exists(cpi_path):
+        return None
+    cpi = pd.read_csv(cpi_path, parse_dates=['date'])
+    return cpi.sort_values('date')[['date', 'cpi']]
+
+def cagr(start_value, end_value, years):
+    if years <= 0:
+        return np.nan
+    return round(((end_value / start_value) ** (1 / years) - 1) * 100, 2)
+
+# rows of these types set the annual salary from their date on; any
+# other type (e.g. bonus) is a one-off amount earned in its month
+rate_types = ['base', 'promotion']
+
+def sal_rates(sal):
+    # the annual salary set on each date
+    return sal[sal['type'].isin(rate_types)].groupby('date')['amount'].last()
+
+def sal_monthly(sal, cpi=None, end_date=None):
+    """Salary rate & earnings per month
+
+    Each rate row of salary.csv is the annual salary from its date on, so
+    the rate is carried forward month by month until end_date; one-off
+    rows add to the earnings of their month.
+
+    Args:
+        sal: salary dataframe from sal_fetch
+        cpi: dataframe with date & cpi columns, or None
+        end_date: last month, defaults to the current one
+    Returns:
+        a dataframe indexed by month with rate, earned & cumulative
+        columns, plus real_* columns in end_date dollars when cpi is given
+    """
+    rate = sal_rates(sal)
+    end_date = pd.Timestamp(end_date or pd.Timestamp.today()).to_period('M').to_timestamp()
+    months = pd.date_range(rate.index.min().to_period('M').to_timestamp(), end_date, freq='MS')
+    once = sal[~sal['type'].isin(rate_types)]
+    once = once.groupby(once['date'].dt.to_period('M').dt.to_timestamp())['amount'].sum()
+
+    monthly = pd.DataFrame({'rate': rate.resample('MS').last().reindex(months).ffill()})
+    monthly.index.name = 'date'
+    monthly['earned'] = monthly['rate'] / 12 + once.reindex(months).fillna(0).values
+    monthly['cumulative'] = monthly['earned'].cumsum()
+
+    if cpi is not None:
+        # latest index published on or before each month
+        index = pd.merge_asof(monthly.reset_index()[['date']], cpi, on='date')['cpi'].values
+        factor = index[-1] / index
+        monthly['real_rate'] = monthly['rate'] * factor
+        monthly['real_earned'] = monthly['earned'] * factor
+        monthly['real_cumulative'] = monthly['real_earned'].cumsum()
+
+    return monthly
+
+def sal_annual(monthly):
+    """Calendar-year totals from sal_monthly"""
+    sums = [c for c in ['earned', 'real_earned'] if c in monthly]
+    annual = monthly[sums].resample('A').sum()
+    annual.insert(0, 'rate', monthly['rate'].resample('A').mean())
+    annual.insert(0, 'year', annual.index.year)
+    annual['cumulative'] = annual['earned'].cumsum()
+    return annual.round(2).reset_index(drop=True)
+
+def sal_summary(sal, monthly):
+    rate = sal_rates(sal)
+    years = (rate.index[-1] - rate.index[0]) / np.timedelta64(1, 'D') / 365.25
+    summary = {
+        'current salary': monthly['rate'].iloc[-1],
+        'raise CAGR %': cagr(rate.iloc[0], rate.iloc[-1], years),
+        'total earned': round(monthly['cumulative'].iloc[-1], 2),
+    }
+    if 'real_rate' in monthly:
+        real = monthly['real_rate'].reindex(rate.index.to_period('M').to_timestamp())
+        summary['real CAGR %'] = cagr(real.iloc[0], real.iloc[-1], years)
+        summary['total earned (real)'] = round(monthly['real_cumulative'].iloc[-1], 2)
+    return pd.DataFrame([summary])
+
+def sal_analytics(sal, cpi=None, end_date=None):
+    monthly = sal_monthly(sal, cpi, end_date)
+    return {
+        'monthly': monthly,
+        'annual': sal_annual(monthly),
+        'summary': sal_summary(sal, monthly),
+    }
+
+def sal_fetch_analytics(sal):
+    """sal_analytics, shared through the cache until the salary rows,
+    cpi.csv or the month change
+
+    Returns:
+        dict with the monthly, annual & summary dataframes
+    """
+    # the rows rather than salary.csv, they include the logged events
+    rows = hashlib.sha1(pd.util.hash_pandas_object(sal, index=False).values.tobytes()).hexdigest()
+    cpi = m4_db.file_hash(cpi_path) if os.path.exists(cpi_path) else None
+    month = pd.Timestamp.today().strftime('%Y-%m')
+    return m4_cache.cached('salary:%s:%s:%s' % (rows, cpi, month),
+                           lambda: sal_analytics(sal, cpi_fetch()))
@@ -0,0 +1,194 @@
+# live quote streaming: a tick source feeds per-ticker ring buffers and
+# browsers follow them over server-sent events (/stream/quotes)
+
+# libraries
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+import numpy as np
+import m4_functions
+import m4_lazy
+
+si = m4_lazy.lazy_import('yahoo_fin.stock_info')
+
+logger = logging.getLogger(__name__)
+
+# M4_STREAM turns streaming on and picks the tick source:
+#   replay   replays the ticker's daily moves, scaled to the tick interval
+#   yahoo    polls yahoo_fin.get_live_price
+source_name = os.environ.get("M4_STREAM")
+
+# ticks kept per ticker, on the server and in each open chart
+ring_size = 2000
+tick_seconds = 1.0
+poll_seconds = 15.0
+heartbeat_seconds = 15.0
+
+# a failing source is restarted after retry_seconds, doubling up to
+# retry_max_seconds while it keeps failing
+retry_seconds = 5.0
+retry_max_seconds = 300.0
+
+# each open stream holds a gunicorn thread for as long as the page is
+# open, so a worker serves at most max_streams and keeps the rest of its
+# GUNICORN_THREADS for callbacks; a browser over the limit is told to
+# reconnect after stream_retry_ms
+max_streams = int(os.environ.get("M4_STREAM_MAX", max(int(os.environ.get("GUNICORN_THREADS", 4)) - 2, 1)))
+stream_retry_ms = 30000
+
+# ticker -> deque of (seq, ms, price); seq orders ticks across tickers
+buffers = {}
+state = {'seq': 0, 'thread': None, 'streams': 0}
+ticked = threading.Condition()
+
+def publish(ticker, ms, price):
+    with ticked:
+        state['seq'] += 1
+        buffers.setdefault(ticker, deque(maxlen=ring_size)).append((state['seq'], ms, price))
+        ticked.notify_all()
+
+def since(seq):
+    """Buffered ticks after seq, oldest first
+
+    Returns:
+        a list of (seq, ticker, ms, price)
+    """
+    with ticked:
+        ticks = [(s, ticker, ms, price) for ticker, ring in buffers.items()
+                 for s, ms, price in ring if s > seq]
+    return sorted(ticks)
+
+#### sources ####
+
+def replay_source(tickers, seed=None):
+    """Yield (ticker, price) ticks forever by replaying daily log-returns
+    from each ticker's history, scaled down to one tick
+
+    Args:
+        tickers: function returning the tickers to stream
+        seed: random seed of the starting points
+    """
+    rng = np.random.default_rng(seed)
+    scale = np.sqrt(tick_seconds / (6.5 * 3600))
+    walks = {}
+
+    while True:
+        for ticker in tickers():
+            if ticker not in walks:
+                close = m4_functions.quote_cached(ticker)['close'].dropna().values
+                returns = np.diff(np.log(close)) * scale
+                # a history needs two closes for one return
+                walks[ticker] = [close[-1], returns, int(rng.integers(len(returns)))] if len(returns) else None
+            walk = walks[ticker]
+            if walk is None:
+                continue
+            price, returns, i = walk
+            walk[0] = price * np.exp(returns[i % len(returns)])
+            walk[2] = i + 1
+            yield ticker, walk[0]
+        time.sleep(tick_seconds)
+
+def yahoo_source(tickers):
+    while True:
+        for ticker in tickers():
+            yield ticker, si.get_live_price(ticker)
+        time.sleep(poll_seconds)
+
+sources = {
+    'replay': replay_source,
+    'yahoo': yahoo_source,
+}
+
+def run(tickers):
+    delay = retry_seconds
+    try:
+        while True:
+            started = time.time()
+            try:
+                for ticker, price in sources[source_name](tickers):
+                    publish(ticker, time.time() * 1000, round(float(price), 2))
+            except Exception as e:
+                # e.g. a network error, the subscribers keep the ticks they have
+                if time.time() - started > retry_max_seconds:
+                    delay = retry_seconds
+                logger.warning('%s quote source failed, restarting in %.1fs: %r', source_name, delay, e)
+                time.sleep(delay)
+                delay = min(delay * 2, retry_max_seconds)
+    finally:
+        # the next subscriber starts a new thread
+        with ticked:
+            state['thread'] = None
+
+def ensure_started(tickers):
+    # started on the first subscriber rather than at import: threads do not
+    # survive gunicorn forking a preloaded app, each worker runs its own
+    with ticked:
+        if state['thread'] is None:
+            state['thread'] = threading.Thread(target=run, args=(tickers,), daemon=True)
+            state['thread'].start()
+
+def stream_open():
+    # take one of the max_streams slots, False when all are taken
+    with ticked:
+        if state['streams'] >= max_streams:
+            return False
+        state['streams'] += 1
+        return True
+
+def stream_close():
+    with ticked:
+        state['streams'] -= 1
+
+#### server-sent events ####
+
+def events(last_seq, row_fn):
+    """Generate the event stream for one subscriber
+
+    Args:
+        last_seq: last tick the browser has seen (Last-Event-ID)
+        row_fn: function (ticker, ms, price) -> summary row dict
+    """
+    while True:
+        with ticked:
+            if state['seq'] <= last_seq:
+                ticked.wait(heartbeat_seconds)
+        ticks = since(last_seq)
+        if not ticks:
+            # comment line, keeps proxies from closing the connection
+            yield ': heartbeat\n\n'
+            continue
+        for seq, ticker, ms, price in ticks:
+            data = {'ticker': ticker, 'ms': ms, 'price': price, 'row': row_fn(ticker, ms, price)}
+            yield 'id: %d\ndata: %s\n\n' % (seq, json.dumps(data, default=str))
+            last_seq = seq
+
+def register(server, tickers, row_fn):
+    """Add the /stream/quotes endpoint
+
+    Each open stream holds a worker thread, at most max_streams per
+    worker; see gunicorn.conf.py for sizing.
+
+    Args:
+        server: the flask app
+        tickers: function returning the tickers to stream, read again as
+            the ledger changes
+        row_fn: function (ticker, ms, price) -> summary row dict
+    """
+    import flask
+
+    @server.route('/stream/quotes')
+    def stream_quotes():
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        if not stream_open():
+            # an empty stream: EventSource reconnects after the retry delay
+            return flask.Response('retry: %d\n\n' % stream_retry_ms, mimetype='text/event-stream',
+                                  headers=headers)
+        ensure_started(tickers)
+        last_seq = int(flask.request.headers.get('Last-Event-ID') or flask.request.args.get('since', 0))
+        response = flask.Response(events(last_seq, row_fn), mimetype='text/event-stream', headers=headers)
+        # called when the browser disconnects and the server closes the stream
+        response.call_on_close(stream_close)
+        return response
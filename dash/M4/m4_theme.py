@@ -0,0 +1,67 @@
+# day & night themes for plots and tables, built once at import
+
+# libraries
+import copy
+import json
+import pkgutil
+import time
+import m4_lazy
+import m4_parameters
+
+pio = m4_lazy.lazy_import('plotly.io')
+
+colors = {
+    'day': {
+    'background': '#fdfcfa',
+    'text': '#000000'
+    },
+    'night': {
+    'background': '#111111',
+    'text': '#ffffe5'
+    },
+}
+
+# template dicts for the browser, each a full copy of the default template
+# so a figure can swap between them as a whole; read from plotly's json
+# rather than pio.templates, which validates every property on load
+plotly_template = json.loads(pkgutil.get_data('plotly', 'package_data/templates/plotly.json'))
+
+templates = {}
+for theme, color in colors.items():
+    template = copy.deepcopy(plotly_template)
+    template['layout'].update(
+        height=650,
+        paper_bgcolor=color['background'],
+        font={**template['layout'].get('font', {}), 'color': color['text']},
+    )
+    if theme == 'night':
+        template['layout']['plot_bgcolor'] = color['background']
+    templates[theme] = template
+
+# datatable styles
+table_styles = {
+    theme: {
+        'style_header': {'backgroundColor': '#2fa4e7'},
+        'style_cell': {
+            'backgroundColor': color['background'],
+            'color': color['text'],
+            'font-family': "Arial"
+        },
+    }
+    for theme, color in colors.items()
+}
+
+def theme_now():
+    mytime = time.localtime()
+    if mytime.tm_hour < m4_parameters.morning or mytime.tm_hour > m4_parameters.night:
+        return 'night'
+    return 'day'
+
+def template(theme=None):
+    """Name of the plotly template for a theme, registered as m4_day or
+    m4_night on first use"""
+    name = 'm4_' + (theme or theme_now())
+    if name not in pio.templates:
+        for key, value in templates.items():
+            pio.templates['m4_' + key] = value
+    return name
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Compact figure payloads for callbacks
+
+Numeric and date series are sent as base64 typed arrays following the
+plotly.js binary array spec (`{"dtype": "f8", "bdata": "..."}`) instead of
+JSON lists of ISO strings and decimal text. Dates are sent as float64
+epoch milliseconds, which plotly.js reads directly on a date axis; the
+spec has no int64 dtype. assets/clientside.js decodes the arrays so they
+also work with the plotly.js bundled in older Dash releases.
+
+Also imported by the stock dashboard (dash/stock-dashboard-python/app.py),
+which serves assets/wire.js, the browser decoder, to its pages.
+"""
+import base64
+import gzip
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ARRAY_KEYS = ("x", "y", "z", "open", "high", "low", "close")
+
+
+def encode_array(values, float32=False):
+    """Encode a numeric or date series as a typed array
+
+    Args:
+        values: list, numpy array or pandas series
+        float32: send non-date values as float32 to halve the size
+    Returns:
+        a `dict` with dtype and base64 bdata, or the values unchanged
+        when they are not numeric or dates
+    """
+    if isinstance(values, pd.Series):
+        values = values.values
+    arr = np.asarray(values)
+
+    if np.issubdtype(arr.dtype, np.datetime64):
+        ms = arr.astype("datetime64[ms]")
+        arr = np.where(np.isnat(ms), np.nan, ms.astype("int64")).astype("<f8")
+        dtype = "f8"
+    elif np.issubdtype(arr.dtype, np.number) and arr.ndim == 1:
+        dtype = "f4" if float32 else "f8"
+        arr = arr.astype("<" + dtype)
+    else:
+        return values
+
+    return {"dtype": dtype, "bdata": base64.b64encode(arr.tobytes()).decode("ascii")}
+
+
+def is_date(values):
+    if isinstance(values, pd.Series):
+        return pd.api.types.is_datetime64_any_dtype(values)
+    return np.issubdtype(np.asarray(values).dtype, np.datetime64)
+
+
+def encode_figure(figure, float32=False):
+    """Encode the data arrays of a figure
+
+    Args:
+        figure: a plotly figure or figure `dict`
+        float32: send non-date values as float32
+    Returns:
+        a figure `dict` with typed array data; axes holding encoded dates
+        are marked as date axes
+    """
+    if hasattr(figure, "to_dict"):
+        figure = figure.to_dict()
+
+    layout = dict(figure.get("layout", {}))
+    data = []
+    for trace in figure.get("data", []):
+        trace = dict(trace)
+        for key in ARRAY_KEYS:
+            if key not in trace or trace[key] is None:
+                continue
+            if key in ("x", "y") and is_date(trace[key]):
+                axis = key + "axis" + trace.get(key + "axis", key)[1:]
+                layout[axis] = dict(layout.get(axis, {}), type="date")
+            trace[key] = encode_array(trace[key], float32)
+        data.append(trace)
+
+    return dict(figure, data=data, layout=layout)
+
+
+def benchmark(points=1000000):
+    """Compare plain JSON and typed array payloads for one line chart"""
+    from plotly.utils import PlotlyJSONEncoder
+
+    dates = pd.date_range("1990-01-01", periods=points, freq="min")
+    values = np.random.default_rng(0).normal(100, 5, points).cumsum()
+    figure = {"data": [{"x": dates, "y": values, "type": "scatter"}], "layout": {}}
+
+    for name, encode in [
+        ("json lists", lambda f: f),
+        ("typed f8", encode_figure),
+        ("typed f4", lambda f: encode_figure(f, float32=True)),
+    ]:
+        start = time.perf_counter()
+        payload = json.dumps(encode(figure), cls=PlotlyJSONEncoder).encode()
+        encoded = time.perf_counter() - start
+        start = time.perf_counter()
+        compressed = gzip.compress(payload, 6)
+        zipped = time.perf_counter() - start
+        line = "%-10s %6.1f MB raw %5.1f MB gzip  encode %4.2f s  gzip %4.2f s" % (
+            name, len(payload) / 1e6, len(compressed) / 1e6, encoded, zipped)
+        if brotli:
+            start = time.perf_counter()
+            compressed = brotli.compress(payload, quality=4)
+            line += "  %5.1f MB br  br %4.2f s" % (len(compressed) / 1e6, time.perf_counter() - start)
+        print(line)
+
+
+if __name__ == "__main__":
+    benchmark()
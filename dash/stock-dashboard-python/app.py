@@ -1,33 +1,56 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ClientsideFunction
+import flask
 import pandas as pd
 
+import compact
+
+# the typed-array figure encoding is shared with M4: m4_wire.py on the
+# server and its decoder, assets/wire.js, in the browser
+M4_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "M4")
+sys.path.append(M4_DIR)
+import m4_wire as wire
+
 MIN_DATE = pd.Timestamp(2010, 1, 4, 0).date()
 MAX_DATE = pd.Timestamp(2018, 11, 7, 0).date()
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
+                external_scripts=["/wire.js"], compress=True)
+app.server.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+server = app.server
+
+
+@server.route("/wire.js")
+def wire_js():
+    return flask.send_from_directory(os.path.join(M4_DIR, "assets"), "wire.js")
 
 
 def custom_date_parser(date):
     return pd.datetime.strptime(date, "%Y-%m-%d")
 
 
-# Fetch prices from local CSV using pandas
-prices = pd.read_csv(
-    os.path.join(os.path.dirname(__file__), "prices.csv"),
-    # index_col=0,
-    parse_dates=True,
-    date_parser=custom_date_parser,
-)
+# Out-of-core mode: point PRICES_STORE at a Parquet store built with
+# `python store.py prices.csv <dir>` and callbacks read only the partitions
+# they need instead of holding the whole CSV in memory
+PRICES_STORE = os.environ.get("PRICES_STORE")
+
+if PRICES_STORE:
+    import store
 
-prices["date"] = pd.to_datetime(prices["date"], format="%Y-%m-%d")
-tickers = prices["ticker"].unique()
+    prices = None
+    tickers = store.store_tickers(PRICES_STORE)
+else:
+    # Fetch prices from local CSV into the compact layout: categorical
+    # tickers, float32 prices, sorted by ticker & date (see compact.py)
+    prices = compact.read_prices(os.path.join(os.path.dirname(__file__), "prices.csv"))
+    tickers = list(prices["ticker"].cat.categories)
 
 # top nav bar
 nav = dbc.Navbar(
@@ -131,10 +154,14 @@ graphs = [
         color="info",
     ),
     dcc.Graph(id="stock-price-graph", animate=True),
+    dcc.Store(id="stock-price-data"),
     dcc.Graph(
         id="stock-volume-graph",
         animate=True,
     ),
+    # volume series for the selected tickers; the volume graph is sliced
+    # to the price graph's zoom range in the browser (assets/clientside.js)
+    dcc.Store(id="stock-volume-data"),
 ]
 
 
@@ -169,7 +196,7 @@ def filter_data_by_date(df, ticker, start_date, end_date):
     """Apply filter to the input dataframe
 
     Args:
-        df: dateframe to filter
+        df: compact dateframe to filter, see compact.compact_frame
         ticker: stock ticker symbol for filter criteria
         start_date: min date threshold
         end_date: max date threshold
@@ -182,36 +209,40 @@ def filter_data_by_date(df, ticker, start_date, end_date):
     if end_date is None:
         end_date = MAX_DATE
 
-    filtered = df[
-        (df["ticker"] == ticker) & (df["date"] >= start_date) & (df["date"] <= end_date)
-    ]
+    # rows are sorted by ticker & date, the selection is one slice
+    filtered = df.iloc[compact.row_range(df, ticker, start_date, end_date)]
     return filtered
 
 
-def volume_figure_layout(selected_tickers, xaxis_range=None):
-    """Add layout specific to x-axis
+def select_prices(ticker, columns, start_date=None, end_date=None):
+    """Fetch one ticker's prices from memory or the out-of-core store
 
     Args:
-        selected_tickers: stock tickers for title
-        xaxis_range: `dict` with layout.xaxis.range config
+        ticker: stock ticker symbol
+        columns: value columns needed by the caller
+        start_date: min date threshold
+        end_date: max date threshold
     Returns:
-        a layout dict
+        a dataframe with `date` and the requested columns
     """
-    layout = dict(xaxis={}, yaxis={})
-    layout["title"] = "Trading Volume (%s)" % (" & ").join(selected_tickers)
-    layout["yaxis"] = {"autorange": True}
-    layout["yaxis"]["title"] = "Volume"
-    layout["xaxis"]["title"] = "Trading Volume by Date"
+    if PRICES_STORE:
+        return store.read_prices(PRICES_STORE, [ticker], start_date, end_date, columns)
+    # a bound left as None is open, as in the store
+    return prices.iloc[compact.row_range(prices, ticker, start_date, end_date)]
 
-    if xaxis_range:
-        layout["xaxis"]["range"] = xaxis_range
-        layout["xaxis"]["autorange"] = True
 
-    return layout
+def relayout_range(relayoutData):
+    """Date range zoomed to on the price graph, or (None, None)"""
+    if relayoutData:
+        from_date = relayoutData.get("xaxis.range[0]", None)
+        to_date = relayoutData.get("xaxis.range[1]", None)
+        if from_date and to_date:
+            return pd.Timestamp(from_date), pd.Timestamp(to_date)
+    return None, None
 
 
 @app.callback(
-    Output("stock-price-graph", "figure"),
+    Output("stock-price-data", "data"),
     [
         Input("stock-ticker-select", "value"),
         Input("stock-ticker-price", "value"),
@@ -225,97 +256,85 @@ def update_price_figure(tickers, price):
         price: the radio button price selection
     Returns:
         a graph `figure` dict containing the specificed
-        price data points per stock
+        price data points per stock, as typed arrays
     """
 
-    return {
-        "data": [
+    data = []
+    for stock in tickers:
+        selected = select_prices(stock, [price])
+        data.append(
             {
-                "x": [date for date in prices.loc[(prices.ticker == stock)]["date"]],
-                "y": [p for p in prices.loc[(prices.ticker == stock)][price]],
+                "x": selected["date"],
+                "y": selected[price],
                 "type": "scatter",
                 "mode": "lines",
                 "name": stock,
             }
-            for stock in tickers
-        ],
+        )
+
+    # prices are held as float32, sending float64 would add no precision
+    return wire.encode_figure({
+        "data": data,
         "layout": {
             "title": "Stock Price - %s (%s)" % (price.title(), (" & ").join(tickers)),
             "xaxis": {"title": "Date"},
             "yaxis": {"title": "Price"},
         },
-    }
+    }, float32=True)
 
 
-@app.callback(
-    Output("stock-volume-graph", "figure"),
-    [
-        Input("stock-ticker-select", "value"),
-        Input("stock-price-graph", "relayoutData"),
-    ],
+app.clientside_callback(
+    ClientsideFunction(namespace="clientside", function_name="price_figure"),
+    Output("stock-price-graph", "figure"),
+    Input("stock-price-data", "data"),
 )
-def update_volume_figure(selected_tickers, relayoutData):
-    """Create a plot of stock volume
+
+
+# in memory the volume figure is re-sliced in the browser on zoom; from the
+# store, a zoom reads the years in view only, pruning the year partitions
+volume_inputs = [Input("stock-ticker-select", "value")]
+if PRICES_STORE:
+    volume_inputs.append(Input("stock-price-graph", "relayoutData"))
+
+
+@app.callback(Output("stock-volume-data", "data"), volume_inputs)
+def update_volume_data(selected_tickers, relayoutData=None):
+    """Collect the volume series for the selected tickers
 
     Args:
         selected_tickers: ticker symbols from the dropdown select
-        relayoutData: data emitted from a `selection` on the price graph
+        relayoutData: zoom on the price graph, store mode only
     Returns:
-        a graph `figure` dict containing the specificed
-        volume data points per stock within the relayoutData
-        date range.
+        a `dict` with one volume trace per stock, as typed arrays, and
+        the default date range, for the clientside volume figure
     """
 
     data = []
-    from_date = None
-    to_date = None
-
-    if relayoutData:
-        from_date = relayoutData.get("xaxis.range[0]", None)
-        to_date = relayoutData.get("xaxis.range[1]", None)
-
-        if from_date and to_date:
-            from_date = pd.Timestamp(from_date)
-            to_date = pd.Timestamp(to_date)
-
-            for stock in selected_tickers:
-                filtered = filter_data_by_date(prices, stock, from_date, to_date)
-                data.append(
-                    {
-                        "x": filtered["date"],
-                        "y": filtered["volume"],
-                        "type": "bar",
-                        "name": stock,
-                    }
-                )
-
-            xaxis_range = [from_date, to_date]
-
-            return {
-                "data": data,
-                "layout": volume_figure_layout(selected_tickers, xaxis_range),
+    start_date, end_date = relayout_range(relayoutData)
+    for stock in selected_tickers:
+        filtered = select_prices(stock, ["volume"], start_date, end_date)
+        data.append(
+            {
+                "x": wire.encode_array(filtered["date"]),
+                "y": wire.encode_array(filtered["volume"]),
+                "type": "bar",
+                "name": stock,
             }
+        )
 
-        else:
-            data = [
-                {
-                    "x": [item for item in prices[(prices.ticker == stock)]["date"]],
-                    "y": [item for item in prices[(prices.ticker == stock)]["volume"]],
-                    "type": "bar",
-                    "name": stock,
-                }
-                for stock in selected_tickers
-            ]
+    return {"data": data, "tickers": selected_tickers, "range": [MIN_DATE, MAX_DATE]}
 
-            # default dates
-            xaxis_range = [MIN_DATE, MAX_DATE]
-
-            return {
-                "data": data,
-                "layout": volume_figure_layout(selected_tickers, xaxis_range),
-            }
 
-    return {"data": data, "layout": volume_figure_layout(selected_tickers)}
+# zooming the price graph only changes the view, so the volume figure is
+# re-sliced in the browser instead of making a server round-trip
+app.clientside_callback(
+    ClientsideFunction(namespace="clientside", function_name="volume_figure"),
+    Output("stock-volume-graph", "figure"),
+    [
+        Input("stock-volume-data", "data"),
+        Input("stock-price-graph", "relayoutData"),
+    ],
+)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+// clientside.js
+// view-state callbacks that only re-slice data already in the browser
+
+// typed arrays from m4_wire.py are decoded by the shared wire.js, see app.py
+const decodeTrace = (trace) => window.m4Wire.decodeTrace(trace);
+
+// relayout ranges are UTC date strings, encoded dates are epoch ms
+const toMillis = (value) => {
+    const text = String(value).replace(' ', 'T');
+    return Date.parse(text.length > 10 ? text + 'Z' : text);
+};
+
+const volumeFigureLayout = (selectedTickers, xaxisRange) => {
+    const layout = {
+        title: 'Trading Volume (' + selectedTickers.join(' & ') + ')',
+        xaxis: {title: 'Trading Volume by Date', type: 'date'},
+        yaxis: {autorange: true, title: 'Volume'}
+    };
+    if (xaxisRange) {
+        layout.xaxis.range = xaxisRange;
+        layout.xaxis.autorange = true;
+    }
+    return layout;
+};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    clientside: {
+        price_figure: function(figure) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            return Object.assign({}, figure, {data: figure.data.map(decodeTrace)});
+        },
+
+        volume_figure: function(volume, relayoutData) {
+            if (!volume) {
+                return {data: [], layout: volumeFigureLayout([])};
+            }
+            const traces = volume.data.map(decodeTrace);
+            if (!relayoutData) {
+                return {data: [], layout: volumeFigureLayout(volume.tickers)};
+            }
+
+            const fromDate = relayoutData['xaxis.range[0]'];
+            const toDate = relayoutData['xaxis.range[1]'];
+            if (!(fromDate && toDate)) {
+                return {
+                    data: traces,
+                    layout: volumeFigureLayout(volume.tickers, volume.range)
+                };
+            }
+
+            const start = toMillis(fromDate);
+            const end = toMillis(toDate);
+            const data = traces.map((trace) => {
+                const x = [];
+                const y = [];
+                trace.x.forEach((date, i) => {
+                    if (date >= start && date <= end) {
+                        x.push(date);
+                        y.push(trace.y[i]);
+                    }
+                });
+                return Object.assign({}, trace, {x: x, y: y});
+            });
+
+            return {data: data, layout: volumeFigureLayout(volume.tickers, [fromDate, toDate])};
+        }
+    }
+});
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Compact in-memory layout for the prices frame
+
+pandas reads prices.csv with object tickers (one Python string per row)
+and float64 values. The compact layout keeps:
+
+    ticker   categorical, int16 codes and one copy of each symbol
+    date     datetime64[ns], i.e. int64 epoch nanoseconds
+    prices   float32, 7 significant digits, under a cent below $100,000
+    volume   float64, whole numbers exact up to 2**53, NaN for a gap
+
+The value dtypes are fixed per column (VALUE_DTYPES) rather than picked
+from the values, so the csv and every store selection share one layout.
+
+Rows are sorted by ticker then date, so a ticker is one contiguous block
+found by binary search on the category codes and a date range is a
+binary search on the block's int64 dates: filtering is O(log n) slicing
+instead of three full-column comparisons.
+
+Usage:
+    python compact.py --bench [rows]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLS = ["ticker"]
+
+# dtype of each value column; other numeric columns are kept as float64
+PRICE_COLS = ["open", "high", "low", "close", "adj close"]
+VALUE_DTYPES = dict({column: np.float32 for column in PRICE_COLS}, volume=np.float64)
+
+
+def compact_frame(df, categories=CATEGORY_COLS):
+    """Convert a prices frame to the compact layout
+
+    Args:
+        df: dataframe with a `date` column, as read from prices.csv
+        categories: string columns stored as categoricals
+    Returns:
+        a new dataframe sorted by ticker and date
+    """
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if column in categories:
+            df[column] = values.astype(str).astype("category")
+        elif column == "date":
+            # parquet may hold other units, e.g. datetime64[us]
+            df[column] = pd.to_datetime(values, format="%Y-%m-%d").astype("datetime64[ns]")
+        elif pd.api.types.is_numeric_dtype(values):
+            df[column] = values.astype(VALUE_DTYPES.get(column, np.float64))
+    return df.sort_values([c for c in categories if c in df] + ["date"], kind="mergesort").reset_index(drop=True)
+
+
+def read_prices(path):
+    """Read prices.csv straight into the compact layout, the tickers are
+    parsed as a categorical so no per-row strings are built"""
+    return compact_frame(pd.read_csv(path, dtype={c: "category" for c in CATEGORY_COLS}))
+
+
+def row_range(df, ticker, start_date, end_date):
+    """Rows of one ticker between two dates in a compact frame
+
+    Args:
+        df: dataframe from compact_frame
+        ticker: stock ticker symbol
+        start_date: min date threshold, None for the first row
+        end_date: max date threshold, None for the last row
+    Returns:
+        a slice of row positions, empty for an unknown ticker
+    """
+    categories = df["ticker"].cat.categories
+    if ticker not in categories:
+        return slice(0, 0)
+    codes = df["ticker"].cat.codes.values
+    code = categories.get_loc(ticker)
+    first, last = np.searchsorted(codes, [code, code + 1])
+
+    # epoch nanoseconds, like Timestamp.value, whatever the column's unit
+    dates = df["date"].values[first:last].astype("datetime64[ns]", copy=False).view("int64")
+    start = 0 if start_date is None else np.searchsorted(dates, pd.Timestamp(start_date).value, side="left")
+    stop = len(dates) if end_date is None else np.searchsorted(dates, pd.Timestamp(end_date).value, side="right")
+    return slice(first + start, first + stop)
+
+
+def memory_mb(df):
+    return df.memory_usage(index=True, deep=True).sum() / 2 ** 20
+
+
+def synthetic_prices(rows, tickers=500):
+    """A prices.csv-shaped frame with the default dtypes"""
+    rng = np.random.default_rng(0)
+    days = rows // tickers
+    dates = pd.bdate_range("2000-01-03", periods=days)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (tickers, days)), axis=1)).ravel()
+    return pd.DataFrame({
+        "date": np.tile(dates, tickers),
+        "ticker": np.repeat(["T%04d" % i for i in range(tickers)], days).astype(object),
+        "open": close * (1 + rng.normal(0, 0.005, close.size)),
+        "high": close * 1.01,
+        "low": close * 0.99,
+        "close": close,
+        "volume": rng.integers(0, 5000000, close.size).astype(float),
+    })
+
+
+def timed(function, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(rows=1000000):
+    loose = synthetic_prices(rows)
+    tight = compact_frame(loose)
+    start_date, end_date = pd.Timestamp("2003-01-01"), pd.Timestamp("2005-12-31")
+    per_million = 1000000 / len(loose)
+
+    def mask():
+        return loose[(loose["ticker"] == "T0250") & (loose["date"] >= start_date) & (loose["date"] <= end_date)]
+
+    def sliced():
+        return tight.iloc[row_range(tight, "T0250", start_date, end_date)]
+
+    assert np.allclose(mask()["close"].values, sliced()["close"].values, rtol=1e-6)
+    print("%d rows, %d tickers" % (len(loose), loose["ticker"].nunique()))
+    print("memory per million rows   default %.1f MB, compact %.1f MB"
+          % (memory_mb(loose) * per_million, memory_mb(tight) * per_million))
+    print("filter one ticker & range default %.2f ms, compact %.3f ms" % (timed(mask), timed(sliced)))
+    print("groupby ticker mean close default %.1f ms, compact %.1f ms" % (
+        timed(lambda: loose.groupby("ticker")["close"].mean(), 5),
+        timed(lambda: tight.groupby("ticker", observed=True)["close"].mean(), 5)))
+    print("groupby ticker, year max  default %.1f ms, compact %.1f ms" % (
+        timed(lambda: loose.groupby(["ticker", loose["date"].dt.year])["high"].max(), 3),
+        timed(lambda: tight.groupby(["ticker", tight["date"].dt.year], observed=True)["high"].max(), 3)))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--bench"]:
+        bench(*[int(arg) for arg in sys.argv[2:3]])
+    else:
+        print(__doc__)
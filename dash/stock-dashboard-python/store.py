@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Out-of-core prices store
+
+prices.csv is converted once into a Parquet dataset partitioned by ticker
+and then year (`<root>/ticker=AAPL/year=2015/...`). Reads push the ticker
+and year predicates down to the partition directories, so a callback only
+opens the files for the stocks and years it shows and memory stays bounded
+by the selection rather than the whole price universe.
+
+Usage:
+    python store.py prices.csv prices_parquet
+"""
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import compact
+
+PARTITION_COLS = ["ticker", "year"]
+
+
+def build_store(csv_path, root, chunksize=1000000):
+    """Convert a prices CSV into the partitioned Parquet store
+
+    Args:
+        csv_path: prices CSV with a `date` and `ticker` column
+        root: output directory, must not exist yet
+        chunksize: rows parsed per chunk, bounds peak memory
+    Returns:
+        the number of rows written
+    """
+    if os.path.exists(root):
+        raise FileExistsError(root)
+
+    rows = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        chunk["date"] = pd.to_datetime(chunk["date"], format="%Y-%m-%d")
+        chunk["year"] = chunk["date"].dt.year
+        pq.write_to_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            root,
+            partition_cols=PARTITION_COLS,
+        )
+        rows += len(chunk)
+    return rows
+
+
+def store_tickers(root):
+    """List the tickers in the store from its partition directories"""
+    return sorted(
+        name.split("=", 1)[1]
+        for name in os.listdir(root)
+        if name.startswith("ticker=")
+    )
+
+
+def read_prices(root, tickers, start_date=None, end_date=None, columns=None):
+    """Read the rows for some tickers and a date range
+
+    Args:
+        root: store directory
+        tickers: ticker symbols to read
+        start_date: min date threshold, or None
+        end_date: max date threshold, or None
+        columns: value columns to read besides `ticker` and `date`
+    Returns:
+        a dataframe in the compact layout, sorted by ticker and date
+    """
+    filters = [("ticker", "in", list(tickers))]
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        filters.append(("year", ">=", start_date.year))
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+        filters.append(("year", "<=", end_date.year))
+    if columns is not None:
+        columns = ["ticker", "date"] + [c for c in columns if c not in ("ticker", "date")]
+
+    prices = pd.read_parquet(root, columns=columns, filters=filters)
+    prices = compact.compact_frame(prices.drop(columns="year", errors="ignore"))
+
+    if start_date is not None:
+        prices = prices[prices["date"] >= start_date]
+    if end_date is not None:
+        prices = prices[prices["date"] <= end_date]
+
+    return prices
+
+
+if __name__ == "__main__":
+    print("%d rows written" % build_store(sys.argv[1], sys.argv[2]))
@@ -13,6 +13,7 @@ MIN_DATE = pd.Timestamp(2015, 12, 1, 0).date()
 MAX_DATE = pd.Timestamp(2021, 2, 28, 0).date()
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+server = app.server
 
 
 def custom_date_parser(date):
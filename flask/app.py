@@ -1,32 +1,87 @@
 # app.py
 # from https://www.jumpingrivers.com/blog/r-shiny-python-flask/
 
-from flask import Flask, render_template, request
+from flask import Flask, abort, render_template, request
+from flask_compress import Compress
+from functools import lru_cache
 from pandas import read_csv
-import plotly.express as px
+import plotly.graph_objects as go
 from plotly.utils import PlotlyJSONEncoder
 import json
 import numpy as np
+import density
 
 faithful = read_csv('flask/data/faithful.csv')
+# sorted once, every bin rule, density & ecdf view reads this copy
+waiting = np.sort(faithful['waiting'].to_numpy(dtype=float))
 app = Flask(__name__)
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+Compress(app)
+
+# the slider's range is 1-50, other bin counts are clamped to these
+min_bins, max_bins = 1, 200
+views = ('hist', 'cumulative', 'ecdf')
+
+# keyed on the bin count, so only the recent ones are kept
+@lru_cache(maxsize=64)
+def edges(rule, bins):
+  return density.bin_edges(waiting, rule, bins)
+
+@lru_cache(maxsize=None)
+def kde():
+  return density.kde(waiting)
 
 @app.route('/graph', methods=['GET'])
 def hist():
-  # calculate the bins
-  x = faithful['waiting']
-  counts, bins = np.histogram(x, bins=np.linspace(np.min(x), np.max(x), int(request.args['bins'])+1))
-  bins = 0.5* (bins[:-1] + bins[1:])
-  p = px.bar(
-    x=bins, y=counts,
+  # rule: fixed (the slider's bin count), fd, scott or blocks
+  # view: hist, cumulative or ecdf; kde: overlay the kernel density
+  rule = request.args.get('rule', 'fixed')
+  view = request.args.get('view', 'hist')
+  overlay = request.args.get('kde') == 'true'
+  if rule != 'fixed' and rule not in density.rules:
+    abort(400, 'unknown bin rule: %s, expected fixed or %s' % (rule, ', '.join(density.rules)))
+  if view not in views:
+    abort(400, 'unknown view: %s, expected %s' % (view, ', '.join(views)))
+  # a bin count that is not a number is the default
+  bins = min(max(request.args.get('bins', 30, type=int), min_bins), max_bins)
+  n = len(waiting)
+  fig = go.Figure()
+
+  if view == 'ecdf':
+    x, y = density.ecdf(waiting)
+    fig.add_trace(go.Scatter(x=x, y=y, mode='lines', line_shape='hv', name='ECDF'))
+    ylabel = 'Cumulative proportion'
+    if overlay:
+      grid, f = kde()
+      fig.add_trace(go.Scatter(x=grid, y=np.cumsum(f) * (grid[1] - grid[0]), mode='lines', name='KDE'))
+  else:
+    # calculate the bins
+    bin_edges = edges(rule, bins if rule == 'fixed' else 0)
+    counts = density.bin_counts(waiting, bin_edges)
+    widths = np.diff(bin_edges)
+    if view == 'cumulative':
+      # the kde overlay is then a cdf, so the bars become proportions
+      y = np.cumsum(counts) / (n if overlay else 1)
+      ylabel = 'Cumulative proportion' if overlay else 'Cumulative frequency'
+    elif overlay or rule == 'blocks':
+      # unequal bins or a density overlay put the bars on a density scale
+      y, ylabel = counts / (n * widths), 'Density'
+    else:
+      y, ylabel = counts, 'Frequency'
+    fig.add_trace(go.Bar(x=0.5 * (bin_edges[:-1] + bin_edges[1:]), y=y, width=widths, name=ylabel))
+    if overlay:
+      grid, f = kde()
+      curve = np.cumsum(f) * (grid[1] - grid[0]) if view == 'cumulative' else f
+      fig.add_trace(go.Scatter(x=grid, y=curve, mode='lines', name='KDE'))
+
+  fig.update_layout(
     title='Histogram of waiting times',
-    labels={
-      'x': 'Waiting time to next eruption (in mins)',
-      'y': 'Frequency'
-    },
-    template='simple_white'
+    xaxis_title='Waiting time to next eruption (in mins)',
+    yaxis_title=ylabel,
+    template='simple_white',
+    showlegend=overlay
   )
-  return json.dumps(p, cls=PlotlyJSONEncoder)
+  return json.dumps(fig, cls=PlotlyJSONEncoder)
 
 @app.route('/')
 def home():
@@ -0,0 +1,147 @@
+# density.py
+# bin rules, binned-FFT kernel density & ecdf, all computed from one
+# sorted copy of the column so no variant sorts the data again
+
+import numpy as np
+
+def quantile(xs, q):
+  # linear interpolation between order statistics of a sorted array
+  pos = (len(xs) - 1) * q
+  lo = int(np.floor(pos))
+  hi = min(lo + 1, len(xs) - 1)
+  return xs[lo] + (xs[hi] - xs[lo]) * (pos - lo)
+
+def iqr(xs):
+  return quantile(xs, 0.75) - quantile(xs, 0.25)
+
+#### bin rules ####
+
+def equal_edges(xs, bins):
+  return np.linspace(xs[0], xs[-1], bins + 1)
+
+def width_edges(xs, width):
+  if not width > 0:
+    return equal_edges(xs, 1)
+  bins = max(1, int(np.ceil((xs[-1] - xs[0]) / width)))
+  return equal_edges(xs, bins)
+
+def fd_edges(xs):
+  # Freedman-Diaconis: 2 IQR n^(-1/3), robust to outliers
+  return width_edges(xs, 2 * iqr(xs) * len(xs) ** (-1 / 3))
+
+def scott_edges(xs):
+  # Scott: 3.49 sigma n^(-1/3), optimal for normal data
+  return width_edges(xs, 3.49 * np.std(xs, ddof=1) * len(xs) ** (-1 / 3))
+
+def blocks_edges(xs, p0=0.05):
+  """Bayesian blocks (Scargle et al. 2013): the piecewise-constant density
+  with the best fitness, by dynamic programming over the distinct values
+
+  Args:
+    xs: sorted data
+    p0: false-positive rate of a change point
+  Returns:
+    the bin edges, of varying width
+  """
+  # distinct values & their counts, read off the sorted data
+  starts = np.concatenate([[0], np.flatnonzero(np.diff(xs)) + 1])
+  t = xs[starts]
+  nn = np.diff(np.concatenate([starts, [len(xs)]]))
+  n = len(t)
+  if n < 2:
+    return np.array([xs[0], xs[-1]])
+
+  edges = np.concatenate([t[:1], 0.5 * (t[1:] + t[:-1]), t[-1:]])
+  block_length = t[-1] - edges
+  ncp_prior = 4 - np.log(73.53 * p0 * n ** -0.478)
+
+  best = np.zeros(n)
+  last = np.zeros(n, dtype=int)
+  for r in range(n):
+    width = block_length[:r + 1] - block_length[r + 1]
+    count = np.cumsum(nn[:r + 1][::-1])[::-1]
+    fitness = count * (np.log(count) - np.log(width)) - ncp_prior
+    fitness[1:] += best[:r]
+    last[r] = np.argmax(fitness)
+    best[r] = fitness[last[r]]
+
+  # walk the change points back from the end
+  points = []
+  r = n
+  while r > 0:
+    points.append(r)
+    r = last[r - 1]
+  points.append(0)
+  return edges[points[::-1]]
+
+rules = {
+  'fd': fd_edges,
+  'scott': scott_edges,
+  'blocks': blocks_edges,
+}
+
+def bin_edges(xs, rule, bins=30):
+  """Bin edges of sorted data
+
+  Args:
+    xs: sorted data
+    rule: 'fixed' for `bins` equal-width bins, or a key of rules
+    bins: bin count of the fixed rule
+  Raises:
+    ValueError: for a rule that is neither fixed nor in rules
+  """
+  if rule in rules:
+    return rules[rule](xs)
+  if rule != 'fixed':
+    raise ValueError('unknown bin rule: %s' % rule)
+  return equal_edges(xs, bins)
+
+def bin_counts(xs, edges):
+  # binary search per edge rather than a pass over the data; the last
+  # bin is closed like np.histogram
+  cuts = np.searchsorted(xs, edges, side='left')
+  cuts[-1] = np.searchsorted(xs, edges[-1], side='right')
+  return np.diff(cuts)
+
+#### kernel density ####
+
+def bandwidth(xs):
+  # Silverman's rule of thumb
+  return 0.9 * min(np.std(xs, ddof=1), iqr(xs) / 1.34) * len(xs) ** -0.2
+
+def kde(xs, h=None, m=512):
+  """Gaussian kernel density on a grid by binned FFT convolution
+
+  The data are linearly binned onto m grid points, O(n), and the bin
+  weights convolved with the sampled kernel by FFT, O(m log m), instead
+  of summing n kernels at each of the m points.
+
+  Args:
+    xs: sorted data
+    h: bandwidth, by default Silverman's rule
+    m: grid points
+  Returns:
+    the grid and the density on it
+  """
+  h = h or bandwidth(xs)
+  grid = np.linspace(xs[0] - 3 * h, xs[-1] + 3 * h, m)
+  dx = grid[1] - grid[0]
+
+  # linear binning: each point split between its two grid neighbours
+  pos = (xs - grid[0]) / dx
+  lo = np.floor(pos).astype(int)
+  frac = pos - lo
+  weights = np.bincount(lo, 1 - frac, m) + np.bincount(np.minimum(lo + 1, m - 1), frac, m)
+
+  # kernel sampled at every grid offset, zero-padded against wrap-around
+  offsets = np.arange(-(m - 1), m) * dx
+  kernel = np.exp(-0.5 * (offsets / h) ** 2) / (h * np.sqrt(2 * np.pi))
+  size = 1 << int(np.ceil(np.log2(3 * m - 2)))
+  conv = np.fft.irfft(np.fft.rfft(weights, size) * np.fft.rfft(kernel, size), size)
+  return grid, conv[m - 1:2 * m - 1] / len(xs)
+
+#### ecdf ####
+
+def ecdf(xs):
+  # the sorted data are the steps, no binning needed
+  return xs, np.arange(1, len(xs) + 1) / len(xs)
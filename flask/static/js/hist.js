@@ -1,12 +1,18 @@
 // hist.js
-const updatePlot = (data) => {
+// every control change redraws with all the current options
+const options = {
+  'bins': 30,
+  'rule': 'fixed',
+  'view': 'hist',
+  'kde': false
+};
+
+const updatePlot = () => {
     $.ajax({
         url: 'graph',
         type: 'GET',
         contentType: 'application/json;charset=UTF-8',
-        data: {
-          'bins': data.from
-        },
+        data: options,
         dataType: 'json',
         success: function(data){
           Plotly.newPlot('histogram', data)
@@ -22,6 +28,23 @@ const updatePlot = (data) => {
       step: 1,
       from: 30,
       grid: true,
-      onStart: updatePlot,
-      onFinish: updatePlot
-  });
\ No newline at end of file
+      onStart: (data) => { options.bins = data.from; updatePlot() },
+      onFinish: (data) => { options.bins = data.from; updatePlot() }
+  });
+
+  // the slider only sets the bin count of the fixed rule
+  $('#rule').on('change', function() {
+    options.rule = this.value;
+    $('.js-range-slider').data('ionRangeSlider').update({disable: this.value !== 'fixed'});
+    updatePlot();
+  });
+
+  $('#view').on('change', function() {
+    options.view = this.value;
+    updatePlot();
+  });
+
+  $('#kde').on('change', function() {
+    options.kde = this.checked;
+    updatePlot();
+  });
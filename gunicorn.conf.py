@@ -0,0 +1,56 @@
+# gunicorn.conf.py
+# production profile shared by the Dash and Flask apps, run from the repo root:
+#
+#   gunicorn -c gunicorn.conf.py --chdir dash/M4 m4_app:server
+#   gunicorn -c gunicorn.conf.py --chdir dash/stock-dashboard-python app:server
+#   gunicorn -c gunicorn.conf.py --chdir dash/stocks stocks_app:server
+#   gunicorn -c gunicorn.conf.py --chdir dash/dash-tutorial app:server
+#   gunicorn -c gunicorn.conf.py --pythonpath flask app:app
+#
+# Sizing: callbacks are pandas/numpy work that holds the GIL, so throughput
+# scales with processes, not threads. Start with one worker per core. Keep a
+# few threads per worker so requests that wait on yahoo_fin or disk do not
+# block the worker. Override with WEB_CONCURRENCY and GUNICORN_THREADS.
+#
+# M4 live quotes (M4_STREAM): each open dashboard holds one thread for its
+# server-sent event stream. A worker serves at most M4_STREAM_MAX streams,
+# by default GUNICORN_THREADS - 2, so callbacks always have threads left;
+# dashboards over the limit reconnect 30 s later. For N open dashboards,
+# set WEB_CONCURRENCY * M4_STREAM_MAX >= N.
+import gc
+import math
+import os
+
+
+def available_cores():
+    """Cores this process may run on: the cpu affinity mask, capped by a
+    cgroup v2 cpu quota (docker --cpus, kubernetes limits), which
+    multiprocessing.cpu_count() ignores"""
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cores, 1)
+
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", available_cores()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+timeout = 120
+
+# import the app once in the master: csvs, quote downloads and precomputed
+# tables are built a single time and shared with the workers copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # move everything allocated during preload into the permanent generation
+    # so the workers' garbage collector never touches those pages, which
+    # would otherwise copy them into each worker
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,73 @@
+# importcheck.py
+# import-time regression check built on `python -X importtime`, e.g.
+#
+#   python importcheck.py --chdir dash/M4 m4_app \
+#       --forbid plotly.express --forbid yahoo_fin --budget 400
+#
+# exits with status 1 when a forbidden module is imported eagerly or the
+# fastest of the runs is over the budget, so it can gate a CI job.
+import argparse
+import os
+import subprocess
+import sys
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` output
+
+    Args:
+        stderr: text written by the interpreter
+    Returns:
+        a list of (module, self us, cumulative us, depth) in import order
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(module, chdir=None):
+    """Import a module in a fresh interpreter and return the parsed timings"""
+    env = dict(os.environ, PYTHONWARNINGS="ignore")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=chdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if process.returncode:
+        sys.exit(process.stderr)
+    return parse_importtime(process.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("module")
+    parser.add_argument("--chdir", help="directory to import from")
+    parser.add_argument("--forbid", action="append", default=[],
+                        help="module that must not be imported at startup")
+    parser.add_argument("--budget", type=float, help="total import time budget in ms")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [measure(args.module, args.chdir) for _ in range(args.repeat)]
+    rows = min(runs, key=lambda r: sum(row[1] for row in r))
+    total = sum(row[1] for row in rows) / 1000
+
+    print("%s: %.0f ms over %d modules (best of %d)" % (args.module, total, len(rows), args.repeat))
+    for name, self_us, cumulative_us, depth in sorted(rows, key=lambda r: -r[2])[:args.top]:
+        print("  %8.1f ms  %s%s" % (cumulative_us / 1000, "  " * depth, name))
+
+    imported = {row[0] for row in rows}
+    failures = ["%s imported at startup" % name for name in args.forbid
+                if name in imported or any(m.startswith(name + ".") for m in imported)]
+    if args.budget is not None and total > args.budget:
+        failures.append("%.0f ms is over the %.0f ms budget" % (total, args.budget))
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    sys.exit(1 if failures else 0)
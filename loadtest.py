@@ -0,0 +1,82 @@
+# loadtest.py
+# throughput check for a running app at increasing client concurrency, e.g.
+#
+#   WEB_CONCURRENCY=1 gunicorn -c gunicorn.conf.py --chdir dash/stock-dashboard-python app:server
+#   python loadtest.py --dash-price AAPL
+#
+# then restart with WEB_CONCURRENCY=2, 4, ... and compare requests/s.
+#
+# Worker scaling only shows with more cores than workers plus this client,
+# which shares the machine; the run prints the cores it can see and warns
+# when there are too few for the comparison to mean anything.
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def dash_price_payload(ticker):
+    """Callback request for update_price_figure in the stock dashboard"""
+    return {
+        "output": "stock-price-data.data",
+        "outputs": {"id": "stock-price-data", "property": "data"},
+        "inputs": [
+            {"id": "stock-ticker-select", "property": "value", "value": [ticker]},
+            {"id": "stock-ticker-price", "property": "value", "value": "close"},
+        ],
+        "changedPropIds": ["stock-ticker-select.value"],
+    }
+
+
+def request(url, body):
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip, br"}
+    req = urllib.request.Request(url, data=body, headers=headers)
+    start = time.perf_counter()
+    with urllib.request.urlopen(req) as response:
+        size = len(response.read())
+    return time.perf_counter() - start, size
+
+
+def run(url, body, concurrency, requests):
+    with ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda _: request(url, body), range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    return {
+        "concurrency": concurrency,
+        "req/s": round(requests / elapsed, 1),
+        "p50 ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95 ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+        "bytes": results[0][1],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--dash-price", metavar="TICKER",
+                        help="POST the stock dashboard price callback instead of a GET")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    args = parser.parse_args()
+
+    url = args.url + args.path
+    body = None
+    if args.dash_price:
+        url = args.url + "/_dash-update-component"
+        body = json.dumps(dash_price_payload(args.dash_price)).encode()
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print({"cores": cores, "cpu_count": os.cpu_count()})
+    if cores < 2:
+        print("warning: one core, the server workers and this client share it; "
+              "requests/s will not change with WEB_CONCURRENCY", file=sys.stderr)
+
+    for concurrency in map(int, args.concurrency.split(",")):
+        print(run(url, body, concurrency, args.requests))